@@ -1,7 +1,16 @@
 import argparse
+import json
+import multiprocessing
+import os
 import sys
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from contextlib import redirect_stderr, redirect_stdout
 
 from model import HandledException
+from model_io import load, write_result
+from solver import PAIR_MODEL_COMBINATIONS, PAIR_MODEL_SLOTS, Solver, SolverOptions
 from ui import AppUI
 
 
@@ -10,19 +19,82 @@ def main():
         AppUI().run()
         return
 
-    # TODO new CLI interface
-    # parser = CustomArgumentParser()
-    # parser.add_argument("--ignore-previous", action="store_true",
-    #                     help="Negeer eerder resultaat, minimaliseer dus niet het aantal wijzigingen")
-    # parser.add_argument("--force-xlsx", action="store_true",
-    #                     help="Forceer het schrijven van een Excel-bestand ook als er geen wijzigingen zijn")
-    # parser.add_argument("--debug", action="store_true", help="Debug mode")
-    # parser.add_argument("dirs", nargs="+", help="De directories met de inputbestanden (klassen)")
-    #
-    # args = parser.parse_args()
-    #
-    # for directory in args.dirs:
-    #     verdeel(directory, args.ignore_previous, args.force_xlsx, args.debug)
+    parser = CustomArgumentParser(description="Verdeel de leerlingen over de keuzevakken")
+    parser.add_argument("input", nargs="+",
+                        help="Het invoerbestand (xlsx), of de vakkentabel (csv of parquet) met de andere tabellen "
+                             "ernaast. Een directory staat voor de Keuzes.xlsx, vakken.csv of vakken.parquet erin. Bij "
+                             "meerdere invoerbestanden worden die parallel verdeeld, met de uitvoer per invoer in een "
+                             "logbestand naast het uitvoerbestand.")
+    parser.add_argument("--previous", help="Eerder resultaat (xlsx, csv of parquet), om het aantal wijzigingen te "
+                                           "minimaliseren, relatief aan de directory van het invoerbestand. Bij "
+                                           "meerdere invoerbestanden alleen gebruikt als het daar bestaat.")
+    parser.add_argument("--output", default="Resultaat.xlsx",
+                        help="Het uitvoerbestand (xlsx, csv of parquet), relatief aan de directory van het "
+                             "invoerbestand")
+    parser.add_argument("--ignore-previous", action="store_true",
+                        help="Negeer eerder resultaat, minimaliseer dus niet het aantal wijzigingen (die worden wel "
+                             "geteld)")
+    parser.add_argument("--force-xlsx", action="store_true",
+                        help="Schrijf het uitvoerbestand ook als er geen wijzigingen zijn ten opzichte van het eerdere "
+                             "resultaat")
+    parser.add_argument("--debug", action="store_true", help="Debug mode")
+    parser.add_argument("--no-cache", action="store_true",
+                        help="Lees de invoer opnieuw in, ook als die sinds de vorige keer niet is gewijzigd")
+    parser.add_argument("--jobs", type=int,
+                        help="Aantal invoerbestanden dat tegelijk wordt verdeeld, standaard zoveel als past bij het "
+                             "aantal cores en --workers")
+    parser.add_argument("--summary", metavar="BESTAND",
+                        help="Schrijf per invoer een samenvatting als JSON-regel naar dit bestand, '-' voor de "
+                             "standaarduitvoer (bij meerdere invoerbestanden is dat de standaard)")
+    add_solver_arguments(parser)
+
+    args = parser.parse_args()
+    options = solver_options(args)
+    use_cache = not args.no_cache
+    if len(args.input) == 1:
+        input_path = resolve_input(args.input[0])
+        previous = resolve_previous(input_path, args.previous, required=True)
+        summary = verdeel(input_path, previous, args.output, options, args.debug, use_cache, args.ignore_previous,
+                          args.force_xlsx)
+        if args.summary:
+            write_summaries(args.summary, [summary])
+    else:
+        verdeel_batch(args.input, args.previous, args.output, options, args.debug, use_cache, args.jobs,
+                      args.summary or "-", args.ignore_previous, args.force_xlsx)
+
+
+def add_solver_arguments(parser: argparse.ArgumentParser):
+    defaults = SolverOptions()
+    parser.add_argument("--workers", type=int, default=defaults.workers,
+                        help="Aantal parallelle zoekprocessen, 0 voor alle cores")
+    parser.add_argument("--time-limit", type=float, default=defaults.time_per_pass,
+                        help="Maximale rekentijd per ronde in seconden")
+    parser.add_argument("--gap", type=float, default=defaults.relative_gap,
+                        help="Stop als de oplossing binnen deze fractie van de ondergrens ligt, bijvoorbeeld 0.01")
+    parser.add_argument("--seed", type=int, default=defaults.seed, help="Random seed voor het zoeken")
+    parser.add_argument("--deterministic", action="store_true",
+                        help="Reproduceerbaar zoeken, de tijdslimiet is dan in deterministische tijdseenheden")
+    parser.add_argument("--aggregate", action="store_true",
+                        help="Reken leerlingen met dezelfde keuzes (en geen samen/apart-wens) als één groep door")
+    parser.add_argument("--pair-model", choices=[PAIR_MODEL_COMBINATIONS, PAIR_MODEL_SLOTS],
+                        default=defaults.pair_model,
+                        help="Modellering van de samen/apart-paren: per combinatie van indelingen (standaard), of per "
+                             "vak en periode die de leerlingen delen, wat beter schaalt bij veel keuzes")
+    parser.add_argument("--delta", action="store_true",
+                        help="Reken met een vorige verdeling alleen de leerlingen opnieuw door die door een wijziging "
+                             "van de invoer hun vorige vakken niet kunnen houden")
+    parser.add_argument("--lns", action="store_true",
+                        help="Verbeter een oplossing door steeds een deel van de leerlingen opnieuw in te delen, voor "
+                             "zeer grote scholen. De tijdslimiet geldt dan voor de hele berekening")
+    parser.add_argument("--fast", action="store_true",
+                        help="Deel direct in met een snelle heuristiek in plaats van de solver, om snel de gevolgen "
+                             "van een wijziging te zien. De indeling is geldig, maar niet per se de beste")
+
+
+def solver_options(args: argparse.Namespace) -> SolverOptions:
+    return SolverOptions(workers=args.workers, time_per_pass=args.time_limit, relative_gap=args.gap,
+                         seed=args.seed, deterministic=args.deterministic, aggregate=args.aggregate,
+                         pair_model=args.pair_model, delta=args.delta, lns=args.lns, fast=args.fast)
 
 
 class CustomArgumentParser(argparse.ArgumentParser):
@@ -34,34 +106,152 @@ class CustomArgumentParser(argparse.ArgumentParser):
         self.exit(2)
 
 
-# def verdeel(directory: str, ignore_previous: bool, force_xlsx: bool, debug: bool):
-#     print(f"\nProcessing {directory} {'(ignore previous)' if ignore_previous else ''}")
-#     data = load(directory)
-#
-#     minimize_changes = not ignore_previous and data.previous_result
-#     solver = Solver(data, minimize_changes, debug)
-#     solver.solve()
-#
-#     write_csv = True
-#     write_xlsx = True
-#     if data.previous_result:
-#         diffs = data.get_difference_count()
-#         if diffs == 0:
-#             write_csv = False
-#             write_xlsx = force_xlsx
-#             print(f"\033[92mNo changes detected, skip writing the csv{"" if write_xlsx else " and xlsx"}\033[0m")
-#         else:
-#             print(f"\033[93m{diffs} change{'' if diffs == 1 else 's'} detected\033[0m")
-#
-#     if write_csv:
-#         write_to_csv(data, directory)
-#
-#     if write_xlsx:
-#         write_to_excel(data, directory)
-#         print(f"\033[92mWrote {directory}/resultaat.xlsx\033[0m")
+# the input file that is used for a directory, the first that exists
+DIRECTORY_INPUTS = ("Keuzes.xlsx", "vakken.csv", "vakken.parquet")
+
+
+def resolve_input(path: str) -> str:
+    """The input file for the path, which may be a directory containing one of the DIRECTORY_INPUTS"""
+    if not os.path.isdir(path):
+        return path
+    for name in DIRECTORY_INPUTS:
+        if os.path.exists(os.path.join(path, name)):
+            return os.path.join(path, name)
+    raise HandledException(f"Geen invoerbestand ({', '.join(DIRECTORY_INPUTS)}) gevonden in {path}")
+
+
+def resolve_previous(input_path: str, previous: str | None, required: bool) -> str | None:
+    """
+    The previous result relative to the directory of the input, like the output. If it does not exist, that is an error
+    if it is required, otherwise there is no previous result.
+    """
+    if not previous:
+        return None
+    path = os.path.join(os.path.dirname(input_path), previous)
+    if os.path.exists(path):
+        return path
+    if required:
+        raise HandledException(f"Eerder resultaat {path} niet gevonden")
+    return None
+
+
+def verdeel(input_path: str, previous_path: str | None, output: str, options: SolverOptions, debug: bool,
+            use_cache: bool = True, ignore_previous: bool = False, force_xlsx: bool = False) -> dict:
+    """
+    Loads, solves and writes one input, and returns a summary of the run. With ignore_previous the previous result is
+    only used to count the changes. When nothing changed, the output is only written with force_xlsx.
+    """
+    start = time.perf_counter()
+    # parse with as many processes as the solver may use, which in a batch is the share of the cores of this job
+    data = load(input_path, previous_path, use_cache, options.workers or None)
+    loaded = time.perf_counter()
+    for warning in data.warnings:
+        print(f"\033[93m{warning}\033[0m")
+    solver = Solver(data, data.previous_result is not None and not ignore_previous, debug, options=options)
+    result = solver.solve()
+    solved = time.perf_counter()
+
+    diffs = None
+    write_output = True
+    if data.previous_result:
+        diffs = data.get_difference_count()
+        if diffs == 0:
+            write_output = force_xlsx
+            print(f"\033[92mNo changes detected{'' if write_output else ', skip writing the output'}\033[0m")
+        else:
+            print(f"\033[93m{diffs} change{'' if diffs == 1 else 's'} detected\033[0m")
+
+    output_file = os.path.join(os.path.dirname(input_path), output)
+    if write_output:
+        write_result(data, output_file)
+    written = time.perf_counter()
+    details = f", gap {result.gap:.2%}" if result.gap is not None else ""
+    if result.delta_students is not None:
+        details += f", delta result for {result.delta_students} of {len(data.students)} students"
+    done = f"Wrote {output_file}" if write_output else "Solved"
+    print(f"\033[92m{done} (penalty {result.objective}, bound {result.bound}{details})\033[0m")
+
+    return {
+        "input": input_path,
+        "status": "optimal" if result.optimal else "feasible",
+        # the number of students solved again in a delta solve, None if all students were solved
+        "delta_students": result.delta_students,
+        "schedulable": result.schedulable,
+        "penalty": result.objective,
+        "bound": result.bound,
+        "gap": result.gap,
+        "changes": diffs,
+        "warnings": data.warnings,
+        "students": len(data.students),
+        "output": output_file,
+        "written": write_output,
+        "load_time": round(loaded - start, 3),
+        "solve_time": round(solved - loaded, 3),
+        "export_time": round(written - solved, 3),
+        "total_time": round(written - start, 3),
+    }
+
+
+def verdeel_batch(inputs: list[str], previous: str | None, output: str, options: SolverOptions, debug: bool,
+                  use_cache: bool, jobs: int | None, summary: str, ignore_previous: bool = False,
+                  force_xlsx: bool = False):
+    """
+    Runs verdeel for each input in a process pool. The number of jobs times the CP-SAT workers per job matches the
+    number of cores, unless both are given. The summaries are written as JSON lines in the order the jobs finish.
+    """
+    cores = os.cpu_count() or 1
+    if not jobs:
+        jobs = max(1, min(len(inputs), cores // options.workers if options.workers else cores))
+    if not options.workers:
+        options = options._replace(workers=max(1, cores // jobs))
+
+    print(f"Verdelen van {len(inputs)} invoerbestanden, {jobs} tegelijk met elk {options.workers} workers",
+          file=sys.stderr)
+    with ProcessPoolExecutor(max_workers=jobs) as executor:
+        futures = [executor.submit(_batch_job, path, previous, output, options, debug, use_cache, ignore_previous,
+                                   force_xlsx) for path in inputs]
+        for future in as_completed(futures):
+            write_summaries(summary, [future.result()])
+
+
+def _batch_job(path: str, previous: str | None, output: str, options: SolverOptions, debug: bool,
+               use_cache: bool, ignore_previous: bool, force_xlsx: bool) -> dict:
+    """Runs verdeel in a worker process, with its output in a log file next to the output file"""
+    start = time.perf_counter()
+    try:
+        input_path = resolve_input(path)
+    except HandledException as e:
+        return {"input": path, "status": "error", "error": str(e), "total_time": 0.0}
+    previous = resolve_previous(input_path, previous, required=False)
+
+    log_file = os.path.splitext(os.path.join(os.path.dirname(input_path), output))[0] + ".log"
+    with open(log_file, "w") as log, redirect_stdout(log), redirect_stderr(log):
+        try:
+            return verdeel(input_path, previous, output, options, debug, use_cache, ignore_previous,
+                           force_xlsx) | {"log": log_file}
+        except Exception as e:
+            if not isinstance(e, HandledException):
+                traceback.print_exc()
+            print(f"\033[91m{e}\033[0m")
+            return {"input": input_path, "status": "error", "error": str(e), "log": log_file,
+                    "total_time": round(time.perf_counter() - start, 3)}
+
+
+def write_summaries(path: str, summaries: list[dict]):
+    """Appends the summaries as JSON lines to the file, or to the standard output for '-'"""
+    lines = "".join(json.dumps(summary) + "\n" for summary in summaries)
+    if path == "-":
+        sys.stdout.write(lines)
+        sys.stdout.flush()
+    else:
+        with open(path, "a") as f:
+            f.write(lines)
 
 
 if __name__ == "__main__":
+    # the frozen app starts the worker processes with spawn, which run this entry point again, freeze_support makes
+    # them run their work instead of the app
+    multiprocessing.freeze_support()
     try:
         main()
     except HandledException as e:
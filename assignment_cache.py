@@ -0,0 +1,54 @@
+import threading
+from collections import OrderedDict
+from typing import Hashable
+
+# rough size in bytes of a cached assignment: the Assignment tuple, its tuple of courses and the reference to it
+ASSIGNMENT_SIZE_ESTIMATE = 150
+DEFAULT_MAX_BYTES = 256 * 1024 * 1024
+
+
+class AssignmentCache:
+    """
+    LRU cache of the valid assignments (with their penalties) of a student, keyed by everything they depend on, see
+    Solver._create_valid_assignments. The memory use is capped by evicting the least recently used entries. The cached
+    lists are shared, so they must not be modified.
+    """
+
+    def __init__(self, max_bytes: int = DEFAULT_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._entries: OrderedDict[Hashable, list] = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: Hashable) -> list | None:
+        with self._lock:
+            assignments = self._entries.get(key)
+            if assignments is None:
+                self.misses += 1
+                return None
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return assignments
+
+    def put(self, key: Hashable, assignments: list):
+        size = len(assignments) * ASSIGNMENT_SIZE_ESTIMATE
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = assignments
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= len(evicted) * ASSIGNMENT_SIZE_ESTIMATE
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+
+    def __len__(self):
+        return len(self._entries)
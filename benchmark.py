@@ -0,0 +1,143 @@
+import argparse
+import os
+import random
+import tempfile
+import time
+
+from excel_exporter import ExcelExporter
+from excel_loader import ExcelLoader
+from model import ResultRecord
+from penalties import UNSOLVABLE_PENALTY
+from solver import Solver, SolverOptions, PAIR_MODEL_COMBINATIONS, PAIR_MODEL_SLOTS
+from testset_generator import generate_data, write_workbook
+
+
+def generate_scaled_data(student_count: int, pair_count: int = 0):
+    """
+    The testset from testset_generator, with the course sizes scaled along with the number of students. Half of the
+    random pairs are put under 'Samen' and the other half under 'Apart'.
+    """
+    scale = max(1, student_count // 200)
+    data = generate_data(
+        seed=42,
+        periods=5,
+        course_count=20,
+        student_count=student_count,
+        size_min=10 * scale,
+        size_max=20 * scale,
+        availability_chance=0.9
+    )
+    rnd = random.Random(42)
+    names = [student.name for student in data.students]
+    pairs = [rnd.sample(names, 2) for _ in range(pair_count)]
+    data.config = data.config._replace(together=pairs[:pair_count // 2], apart=pairs[pair_count // 2:])
+    return data
+
+
+def benchmark_model(student_count: int, pair_count: int, pair_model: str):
+    data = generate_scaled_data(student_count, pair_count)
+    solver = Solver(data, False, options=SolverOptions(pair_model=pair_model))
+
+    start = time.perf_counter()
+    solver._build_model(0)
+    print(f"Model build time for {student_count} students and {pair_count} pairs ({pair_model}): "
+          f"{time.perf_counter() - start:.2f}s")
+
+
+def benchmark_lns(student_count: int, pair_count: int, time_limit: float, workers: int):
+    """
+    Solves the same generated data with the whole model and with large neighbourhood search on the same time budget,
+    and prints the objective over time of both.
+    """
+    for lns in (False, True):
+        data = generate_scaled_data(student_count, pair_count)
+        trace = []
+        start = time.perf_counter()
+        solver = Solver(data, False, options=SolverOptions(workers=workers, time_per_pass=time_limit, lns=lns),
+                        progress_listener=lambda progress: trace.append((time.perf_counter() - start,
+                                                                         progress.objective)))
+        result = solver.solve()
+        name = "LNS" if lns else "CP-SAT"
+        print(f"{name}: penalty {result.objective} after {time.perf_counter() - start:.1f}s")
+        for elapsed, objective in trace:
+            print(f"{name} {elapsed:7.1f}s {objective:g}")
+
+
+def benchmark_heuristic(student_count: int, pair_count: int):
+    """Times the heuristic alone (SolverOptions.fast) on generated data"""
+    data = generate_scaled_data(student_count, pair_count)
+    start = time.perf_counter()
+    result = Solver(data, False, options=SolverOptions(fast=True)).solve()
+    short = sum(record.penalty >= UNSOLVABLE_PENALTY for record in result.result)
+    print(f"Heuristic for {student_count} students and {pair_count} pairs: penalty {result.objective}, "
+          f"{short} students short of courses, {time.perf_counter() - start:.2f}s")
+
+
+def benchmark_excel(student_count: int, class_count: int, workers: int):
+    """
+    Loads a generated input workbook with the given number of class sheets, each formatted far below the students,
+    together with a previous result, first in one process and then with the given number of workers. Checks that both
+    give the same data and reports the load times and the peak resident memory of the process.
+    """
+    data = generate_data(seed=42, periods=5, course_count=20, student_count=student_count, size_min=10, size_max=20,
+                         availability_chance=0.9, class_count=class_count)
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "keuzes.xlsx")
+        write_workbook(data, path, formatted_rows=1000)
+        previous_path = os.path.join(directory, "vorige.xlsx")
+        # the first choices as previous result, the generated data is usually not schedulable
+        data.result = [ResultRecord(student.name, (student.choices + [None] * 5)[:5], 0) for student in data.students]
+        ExcelExporter().export(data, previous_path)
+        del data
+        print(f"Input workbook of {os.path.getsize(path) / 1024 / 1024:.1f} MB")
+
+        loaded = []
+        for load_workers in (1, workers):
+            start = time.perf_counter()
+            loaded.append(ExcelLoader(path, previous_path, load_workers).load())
+            elapsed = time.perf_counter() - start
+            print(f"Loaded {len(loaded[-1].students)} students in {class_count} class sheets with {load_workers} "
+                  f"workers in {elapsed:.2f}s")
+    sequential, parallel = loaded
+    same = ([(s.name, s.choices) for s in sequential.students] == [(s.name, s.choices) for s in parallel.students]
+            and sequential.student_to_class == parallel.student_to_class
+            and all(sequential.previous_result.get(s.name) == parallel.previous_result.get(s.name)
+                    for s in sequential.students))
+    print("Same data loaded" if same else "DIFFERENT DATA LOADED")
+    try:
+        # POSIX only
+        import resource
+    except ImportError:
+        return
+    # kilobytes on Linux
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"Peak RSS {peak:.0f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmarks voor het verdelen van keuzevakken")
+    parser.add_argument("--students", type=int, default=5000, help="Aantal leerlingen")
+    parser.add_argument("--pairs", type=int, default=0, help="Aantal paren onder 'Samen' en 'Apart'")
+    parser.add_argument("--pair-model", choices=[PAIR_MODEL_COMBINATIONS, PAIR_MODEL_SLOTS],
+                        default=PAIR_MODEL_COMBINATIONS, help="Modellering van de paren")
+    parser.add_argument("--excel", type=int, metavar="KLASSEN",
+                        help="Meet het inlezen van een gegenereerd Excel-bestand met dit aantal klassen")
+    parser.add_argument("--workers", type=int, default=os.cpu_count(),
+                        help="Aantal processen voor het parallel inlezen bij --excel, en zoekprocessen bij --lns")
+    parser.add_argument("--lns", type=float, metavar="SECONDEN",
+                        help="Vergelijk het verloop van de strafpunten van het hele model en van LNS in deze tijd")
+    parser.add_argument("--fast", action="store_true", help="Meet de snelle heuristiek (zonder solver)")
+    args = parser.parse_args()
+
+    if args.excel:
+        benchmark_excel(args.students, args.excel, args.workers)
+    elif args.fast:
+        benchmark_heuristic(args.students, args.pairs)
+    elif args.lns:
+        benchmark_lns(args.students, args.pairs, args.lns, args.workers)
+    else:
+        benchmark_model(args.students, args.pairs, args.pair_model)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,104 @@
+from typing import NamedTuple
+
+import numpy as np
+from ortools.graph.python import max_flow
+
+from model import Data
+
+SOURCE = 0
+SINK = 1
+
+
+class CapacityAnalysis(NamedTuple):
+    # the first solver pass that is not ruled out by the capacity bound, None if no pass can be feasible
+    first_pass: int | None
+
+    # the number of course places that are short in the first pass (when each student gets all periods filled)
+    shortage: int
+
+    # codes of the courses that have too little capacity for the students that need them in the first pass
+    oversubscribed: list[str]
+
+
+def analyse_capacity(data: Data, max_pass: int) -> CapacityAnalysis:
+    """
+    Bounds the solver passes that can be feasible, without invoking the CP solver. In pass n each student needs to be
+    assigned to all periods but n (or fewer if there are not enough choices). A pass is ruled out if a student can not
+    fill the required periods with its choices at all, or if the maximum flow from students to courses, with each
+    course limited to its size in each period it is given, is less than the number of places needed.
+    """
+    instance = data.get_instance()
+    periods = instance.periods
+    course_periods = [np.flatnonzero(available).tolist() for available in instance.availability]
+    # the matching only depends on the periods of the courses, which repeat a lot with a handful of periods
+    course_masks = [sum(1 << p for p in course_period) for course_period in course_periods]
+    matchings: dict[tuple[int, ...], int] = {}
+
+    student_courses = []
+    needed_empty = []
+    max_assigned = []
+    for row, count in zip(instance.choices, instance.choice_counts):
+        numbers = row[:count].tolist()
+        courses = list(dict.fromkeys(c for c in numbers if c >= 0 and course_periods[c]))
+        student_courses.append(courses)
+        needed_empty.append(numbers.count(-1) + max(periods - len(numbers), 0))
+        masks = tuple(sorted(course_masks[c] for c in courses))
+        if masks not in matchings:
+            matchings[masks] = _max_matching(courses, course_periods)
+        max_assigned.append(matchings[masks])
+
+    # The network: source -> student -> course -> sink, only the capacities of the source arcs depend on the pass
+    student_count = len(data.students)
+    student_node = 2
+    course_node = student_node + student_count
+    student_nodes = np.arange(student_node, course_node)
+    course_nodes = np.arange(course_node, course_node + len(data.courses))
+    choice_tails = np.repeat(student_nodes, [len(courses) for courses in student_courses])
+    choice_heads = course_node + np.fromiter((c for courses in student_courses for c in courses), dtype=np.int64,
+                                             count=len(choice_tails))
+    course_capacities = instance.sizes.astype(np.int64) * instance.availability.sum(axis=1)
+
+    flow = max_flow.SimpleMaxFlow()
+    source_arcs = flow.add_arcs_with_capacity(np.full(student_count, SOURCE), student_nodes,
+                                              np.zeros(student_count, dtype=np.int64))
+    flow.add_arcs_with_capacity(choice_tails, choice_heads, np.ones(len(choice_tails), dtype=np.int64))
+    flow.add_arcs_with_capacity(course_nodes, np.full(len(course_nodes), SINK), course_capacities)
+
+    needed_empty = np.array(needed_empty, dtype=np.int64)
+    max_assigned = np.array(max_assigned, dtype=np.int64)
+    shortage = 0
+    oversubscribed = []
+    for solver_pass in range(max_pass + 1):
+        required = np.maximum(periods - np.maximum(needed_empty, solver_pass), 0)
+        flow.set_arcs_capacity(source_arcs, required)
+        flow.solve(SOURCE, SINK)
+        pass_shortage = int(required.sum()) - flow.optimal_flow()
+        if solver_pass == 0:
+            shortage = pass_shortage
+            oversubscribed = _bottleneck_courses(data, flow, course_node) if shortage else []
+        if pass_shortage == 0 and np.all(required <= max_assigned):
+            return CapacityAnalysis(solver_pass, shortage, oversubscribed)
+
+    return CapacityAnalysis(None, shortage, oversubscribed)
+
+
+def _max_matching(courses: list[int], course_periods: list[list[int]]) -> int:
+    """The maximum number of the given courses that can be assigned to distinct periods"""
+    period_course = {}
+
+    def assign(course, visited):
+        for period in course_periods[course]:
+            if period not in visited:
+                visited.add(period)
+                if period not in period_course or assign(period_course[period], visited):
+                    period_course[period] = course
+                    return True
+        return False
+
+    return sum(1 for course in courses if assign(course, set()))
+
+
+def _bottleneck_courses(data: Data, flow: max_flow.SimpleMaxFlow, course_node: int) -> list[str]:
+    """The courses on the source side of the minimum cut, their capacity is fully used by the maximum flow"""
+    source_side = set(flow.get_source_side_min_cut())
+    return [course.code for c, course in enumerate(data.courses) if course_node + c in source_side]
@@ -0,0 +1,90 @@
+import ortools
+from ortools.sat.python import cp_model
+
+# Direct access to the proto of a CP-SAT model. Building a constraint through a LinearExpr adds the terms one by one,
+# which dominates the model build time for large numbers of students, so the solver writes constraints, the objective
+# and the hint to the model proto in one go. This needs the protobuf backed CpModel.Proto() of ortools < 9.12 (see
+# requirements.txt), later versions return a proto without SetInParent/ClearField. All proto access is in this module,
+# so only this module has to change when the ortools version is raised.
+
+if tuple(int(part) for part in ortools.__version__.split(".")[:2]) >= (9, 12):
+    raise ImportError(f"cp_proto.py needs ortools < 9.12 (see requirements.txt), ortools {ortools.__version__} is "
+                      f"installed")
+
+
+def add_linear(model: cp_model.CpModel, variables: list[cp_model.IntVar], coefficients: list[int], lower: int,
+               upper: int, enforcement_literal=None) -> int:
+    """
+    Adds the constraint lower <= sum(coefficients * variables) <= upper, optionally only enforced if the given literal
+    is true. Returns the index of the constraint.
+    """
+    proto = model.Proto()
+    index = len(proto.constraints)
+    constraint = proto.constraints.add()
+    if enforcement_literal is not None:
+        constraint.enforcement_literal.append(enforcement_literal.Index())
+    constraint.linear.vars.extend([var.Index() for var in variables])
+    constraint.linear.coeffs.extend(coefficients)
+    constraint.linear.domain.extend([lower, upper])
+    return index
+
+
+def extend_linear(model: cp_model.CpModel, index: int, variables: list[cp_model.IntVar], coefficients: list[int]):
+    """Adds terms to a linear constraint that was added with add_linear"""
+    linear = model.Proto().constraints[index].linear
+    linear.vars.extend([var.Index() for var in variables])
+    linear.coeffs.extend(coefficients)
+
+
+def add_exactly_one(model: cp_model.CpModel) -> int:
+    """Adds an (empty) exactly one constraint, returns the index of the constraint"""
+    proto = model.Proto()
+    index = len(proto.constraints)
+    proto.constraints.add().exactly_one.SetInParent()
+    return index
+
+
+def extend_exactly_one(model: cp_model.CpModel, index: int, variables: list[cp_model.IntVar]):
+    """Adds literals to an exactly one constraint that was added with add_exactly_one"""
+    model.Proto().constraints[index].exactly_one.literals.extend([var.Index() for var in variables])
+
+
+def set_domain(model: cp_model.CpModel, variable: cp_model.IntVar, lower: int, upper: int):
+    domain = model.Proto().variables[variable.Index()].domain
+    del domain[:]
+    domain.extend([lower, upper])
+
+
+def variable_count(model: cp_model.CpModel) -> int:
+    return len(model.Proto().variables)
+
+
+def extend_objective(model: cp_model.CpModel, variables: list[int], coefficients: list[int]):
+    """Adds terms (by variable index) to the minimized objective"""
+    objective = model.Proto().objective
+    objective.vars.extend(variables)
+    objective.coeffs.extend(coefficients)
+
+
+def objective_size(model: cp_model.CpModel) -> int:
+    return len(model.Proto().objective.vars)
+
+
+def clear_objective(model: cp_model.CpModel):
+    model.Proto().ClearField("objective")
+
+
+def set_hint(model: cp_model.CpModel, variables: list[int], values: list[int]):
+    """Replaces the solution hint, by variable index"""
+    hint = model.Proto().solution_hint
+    del hint.vars[:]
+    del hint.values[:]
+    hint.vars.extend(variables)
+    hint.values.extend(values)
+
+
+def hint_objective(model: cp_model.CpModel) -> int:
+    """The objective of the solution hint, the variables that are not hinted count as zero"""
+    proto = model.Proto()
+    values = dict(zip(proto.solution_hint.vars, proto.solution_hint.values))
+    return sum(coeff * values.get(var, 0) for var, coeff in zip(proto.objective.vars, proto.objective.coeffs))
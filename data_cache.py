@@ -0,0 +1,246 @@
+import hashlib
+import os
+import struct
+from typing import NamedTuple
+
+from model import Data, Config, ClassConfig, Course, Student, PreviousResult
+
+# Binary snapshot of the Data the ExcelLoader parsed from an input workbook (and previous result), stored next to the
+# input, so an unchanged input does not have to be parsed again. The format is a header with the keys of the files it
+# was made from, followed by a table of the distinct values and the data as length-prefixed lists of references to
+# them. It contains no code, so unlike a pickle it is safe to read a snapshot someone else left next to the input.
+
+MAGIC = b"KVDC"
+# increase when the format or the loaded Data changes, older snapshots are then ignored
+FORMAT_VERSION = 1
+
+_NONE, _STR, _INT, _FLOAT, _BOOL = range(5)
+
+
+class FileKey(NamedTuple):
+    """Identifies the contents of a file, the hash is only calculated if the modification time and size match"""
+    mtime_ns: int
+    size: int
+    sha256: bytes
+
+
+def cache_path(input_path: str) -> str:
+    directory, name = os.path.split(input_path)
+    return os.path.join(directory, f".{name}.cache")
+
+
+def load_cached(input_path: str, previous_path: str | None) -> Data | None:
+    """The data from the snapshot of the input, None if there is none or it does not match the files anymore"""
+    try:
+        with open(cache_path(input_path), "rb") as f:
+            content = f.read()
+    except OSError:
+        return None
+    try:
+        reader = _Reader(content)
+        if reader.read(4) != MAGIC or reader.uint() != FORMAT_VERSION:
+            return None
+        for path in (input_path, previous_path):
+            if reader.uint():
+                key = FileKey(reader.uint(), reader.uint(), reader.read(32))
+                if path is None or not _matches(path, key):
+                    return None
+            elif path is not None:
+                return None
+        reader.read_table()
+        return _read_data(reader)
+    except (struct.error, ValueError, UnicodeDecodeError, IndexError):
+        print(f"Ignoring unreadable cache {cache_path(input_path)}")
+        return None
+
+
+def store(data: Data, input_path: str, previous_path: str | None):
+    """Writes the snapshot of the data, a failure to write is only reported, the cache is an optimization"""
+    header = [MAGIC, struct.pack("<Q", FORMAT_VERSION)]
+    for path in (input_path, previous_path):
+        header.append(struct.pack("<Q", path is not None))
+        if path is not None:
+            key = _file_key(path)
+            header.append(struct.pack("<QQ", key.mtime_ns, key.size) + key.sha256)
+    writer = _Writer()
+    _write_data(writer, data)
+    path = cache_path(input_path)
+    try:
+        with open(path, "wb") as f:
+            f.write(writer.getvalue(b"".join(header)))
+    except OSError as e:
+        print(f"Could not write cache {path}: {e}")
+
+
+def _file_key(path: str) -> FileKey:
+    stat = os.stat(path)
+    with open(path, "rb") as f:
+        sha256 = hashlib.file_digest(f, "sha256").digest()
+    return FileKey(stat.st_mtime_ns, stat.st_size, sha256)
+
+
+def _matches(path: str, key: FileKey) -> bool:
+    try:
+        stat = os.stat(path)
+        if stat.st_mtime_ns != key.mtime_ns or stat.st_size != key.size:
+            return False
+        return _file_key(path).sha256 == key.sha256
+    except OSError:
+        return False
+
+
+def _write_data(writer: '_Writer', data: Data):
+    config = data.config
+    writer.uint(config.periods)
+    writer.refs([value for class_config in config.classes for value in (class_config.code, class_config.name)])
+    for pairs in (config.together, config.apart):
+        writer.uint(len(pairs))
+        for pair in pairs:
+            writer.refs(pair)
+
+    writer.refs([value for course in data.courses for value in (course.code, course.size, course.name)])
+    for course in data.courses:
+        writer.refs([int(available) for available in course.availability])
+
+    writer.refs([student.name for student in data.students])
+    writer.refs([data.student_to_class.get(student.name) for student in data.students])
+    writer.ints([len(student.choices) for student in data.students])
+    writer.refs([choice for student in data.students for choice in student.choices])
+
+    previous = data.previous_result
+    writer.uint(previous is not None)
+    if previous is not None:
+        writer.refs(list(previous))
+        writer.ints([course for name in previous for course in previous.get(name)])
+        writer.refs(list(previous.unknown_students))
+        writer.refs([value for pair in previous.unknown_courses for value in pair])
+        writer.refs(list(previous.duplicate_students))
+
+
+def _read_data(reader: '_Reader') -> Data:
+    data = Data()
+    periods = reader.uint()
+    class_values = reader.refs()
+    classes = [ClassConfig(code, name) for code, name in zip(class_values[::2], class_values[1::2])]
+    together = [reader.refs() for _ in range(reader.uint())]
+    apart = [reader.refs() for _ in range(reader.uint())]
+    data.config = Config(periods, classes, together, apart)
+
+    course_values = reader.refs()
+    for code, size, name in zip(course_values[::3], course_values[1::3], course_values[2::3]):
+        availability = "".join("1" if available else "0" for available in reader.refs())
+        data.add_course(Course(code, size, availability, name))
+
+    names = reader.refs()
+    class_codes = reader.refs()
+    choice_counts = reader.ints()
+    choices = reader.refs()
+    students: list[Student] = []
+    start = 0
+    for i, (name, count) in enumerate(zip(names, choice_counts)):
+        students.append(Student(name, choices[start:start + count]))
+        start += count
+        # the students are added per class, like the loader does
+        if i + 1 == len(names) or class_codes[i + 1] != class_codes[i]:
+            data.add_students(class_codes[i], students)
+            students = []
+
+    if reader.uint():
+        previous_names = reader.refs()
+        previous_courses = reader.ints()
+        courses = {name: tuple(previous_courses[i * periods:(i + 1) * periods])
+                   for i, name in enumerate(previous_names)}
+        unknown_students = tuple(reader.refs())
+        unknown_values = reader.refs()
+        unknown_courses = tuple(zip(unknown_values[::2], unknown_values[1::2]))
+        data.previous_result = PreviousResult(courses, unknown_students, unknown_courses, tuple(reader.refs()))
+    return data
+
+
+class _Writer:
+    """
+    Writes the values (None, strings, ints, floats and bools) once in a table, and refers to them by their index in
+    the table, so a snapshot is small and lists of values can be read in one go.
+    """
+
+    def __init__(self):
+        self._parts: list[bytes] = []
+        self._table: dict[tuple[type, object], int] = {}
+
+    def write(self, value: bytes):
+        self._parts.append(value)
+
+    def uint(self, value: int):
+        self._parts.append(struct.pack("<Q", value))
+
+    def ints(self, values: list[int]):
+        self.uint(len(values))
+        self._parts.append(struct.pack(f"<{len(values)}i", *values))
+
+    def refs(self, values: list):
+        self.ints([self._table.setdefault((type(value), value), len(self._table)) for value in values])
+
+    def getvalue(self, header: bytes) -> bytes:
+        """The header, followed by the value table and the data"""
+        table = [struct.pack("<Q", len(self._table))]
+        for _, value in self._table:
+            table.append(_pack_value(value))
+        return header + b"".join(table) + b"".join(self._parts)
+
+
+def _pack_value(value) -> bytes:
+    if value is None:
+        return bytes((_NONE,))
+    if isinstance(value, str):
+        encoded = value.encode()
+        return struct.pack("<BI", _STR, len(encoded)) + encoded
+    if isinstance(value, bool):
+        return struct.pack("<B?", _BOOL, value)
+    if isinstance(value, int):
+        return struct.pack("<Bq", _INT, value)
+    return struct.pack("<Bd", _FLOAT, value)
+
+
+class _Reader:
+    def __init__(self, content: bytes):
+        self._content = memoryview(content)
+        self._offset = 0
+        self._table: list = []
+
+    def read(self, size: int) -> bytes:
+        if self._offset + size > len(self._content):
+            raise ValueError("Unexpected end of cache")
+        value = bytes(self._content[self._offset:self._offset + size])
+        self._offset += size
+        return value
+
+    def _unpack(self, fmt: str) -> tuple:
+        values = struct.unpack_from(fmt, self._content, self._offset)
+        self._offset += struct.calcsize(fmt)
+        return values
+
+    def uint(self) -> int:
+        return self._unpack("<Q")[0]
+
+    def ints(self) -> list[int]:
+        return list(self._unpack(f"<{self.uint()}i"))
+
+    def refs(self) -> list:
+        table = self._table
+        return [table[i] for i in self.ints()]
+
+    def read_table(self):
+        for _ in range(self.uint()):
+            tag = self._unpack("<B")[0]
+            if tag == _NONE:
+                self._table.append(None)
+            elif tag == _STR:
+                self._table.append(self.read(self._unpack("<I")[0]).decode())
+            elif tag == _BOOL:
+                self._table.append(self._unpack("<?")[0])
+            elif tag == _INT:
+                self._table.append(self._unpack("<q")[0])
+            elif tag == _FLOAT:
+                self._table.append(self._unpack("<d")[0])
+            else:
+                raise ValueError(f"Unknown value type {tag}")
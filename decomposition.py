@@ -0,0 +1,71 @@
+import numpy as np
+
+from model import Data
+
+
+def find_components(data: Data) -> list[list[int]]:
+    """
+    Splits the students in groups that do not interact, so each group can be solved separately. Students interact
+    through a together/apart pair, or through a course they both chose that more students chose than it has places.
+    A course with enough places for all students that chose it can never be full, so it does not couple them.
+
+    Returns the student indices per component, largest component first.
+    """
+    instance = data.get_instance()
+    parent = list(range(len(data.students)))
+
+    def find(i):
+        while parent[i] != i:
+            parent[i] = parent[parent[i]]
+            i = parent[i]
+        return i
+
+    def union(i, j):
+        root_i, root_j = find(i), find(j)
+        if root_i != root_j:
+            parent[root_j] = root_i
+
+    course_students: dict[int, list[int]] = {}
+    for i, (row, count) in enumerate(zip(instance.choices, instance.choice_counts)):
+        for course in dict.fromkeys(row[:count].tolist()):
+            if course >= 0:
+                course_students.setdefault(course, []).append(i)
+    for course, students in course_students.items():
+        if len(students) > instance.sizes[course]:
+            for i in students[1:]:
+                union(students[0], i)
+
+    for student1, student2 in np.concatenate((instance.together, instance.apart)).tolist():
+        union(student1, student2)
+
+    components: dict[int, list[int]] = {}
+    for i in range(len(data.students)):
+        components.setdefault(find(i), []).append(i)
+    return sorted(components.values(), key=len, reverse=True)
+
+
+def group_components(components: list[list[int]], group_count: int) -> list[list[int]]:
+    """
+    Packs the components in at most group_count groups of about equal size, each group is solved as one model. The
+    largest component is put in a group of its own if possible, so the wall time is determined by that component.
+    """
+    groups: list[list[int]] = [[] for _ in range(min(group_count, len(components)))]
+    for component in sorted(components, key=len, reverse=True):
+        min(groups, key=len).extend(component)
+    return [sorted(group) for group in groups]
+
+
+def component_data(data: Data, students: list[int]) -> Data:
+    """The data restricted to the given students, sharing the courses and the configuration"""
+    component = Data()
+    component.students = [data.students[i] for i in students]
+    names = {student.name for student in component.students}
+    component.config = data.config._replace(
+        together=[pair for pair in data.config.together if pair[0] in names],
+        apart=[pair for pair in data.config.apart if pair[0] in names])
+    component.courses = data.courses
+    component.student_to_class = {name: data.student_to_class[name] for name in names
+                                  if name in data.student_to_class}
+    if data.previous_result is not None:
+        component.previous_result = data.previous_result.restricted_to(names)
+    return component
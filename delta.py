@@ -0,0 +1,76 @@
+import numpy as np
+
+from model import Data
+
+# Delta re-solve: after a small change of the input, only the students affected by the change are solved again, the
+# other students keep their assignment of the previous result. There is no copy of the input the previous result was
+# made from, so the change is derived from the previous result itself: a student is affected if its previous assignment
+# does not fit the current input anymore.
+
+
+def affected_students(data: Data, solver_pass: int) -> np.ndarray:
+    """
+    The students (as a boolean per index in Data.students) that can not keep their previous assignment:
+
+    - students without a previous result
+    - students whose previous assignment is not one of their valid assignments in the given pass anymore, because a
+      course is not one of their choices, is not given in its period or is assigned twice, or because it leaves more
+      periods empty than needed (their choices changed)
+    - the students in a course that has more students than places in a period (its size changed)
+    - the together/apart partners of these students
+    """
+    instance = data.get_instance()
+    periods = instance.periods
+    previous = instance.previous
+    assigned = previous >= 0
+
+    # a course of the previous assignment must be one of the choices (or reserves) and be given in its period
+    chosen = (previous[:, :, np.newaxis] == instance.choices[:, np.newaxis, :]).any(axis=2)
+    available = instance.availability[np.maximum(previous, 0), np.arange(periods)]
+    valid = instance.has_previous & (~assigned | (chosen & available)).all(axis=1)
+
+    # no course twice, an empty period sorts before the courses
+    ordered = np.sort(previous, axis=1)
+    valid &= ~((ordered[:, 1:] == ordered[:, :-1]) & (ordered[:, 1:] >= 0)).any(axis=1)
+
+    # the empty periods the choices need, like in Solver._create_valid_assignments, plus the ones the pass allows
+    columns = np.arange(instance.choices.shape[1])
+    counted = columns[np.newaxis, :] < np.maximum(periods, instance.choice_counts)[:, np.newaxis]
+    needed_empty = ((instance.choices == -1) & counted).sum(axis=1)
+    valid &= (~assigned).sum(axis=1) <= np.maximum(needed_empty, solver_pass)
+
+    # the course periods that are over their size with the students that keep their assignment
+    occupancy = np.zeros(instance.availability.shape, dtype=np.int32)
+    kept = assigned & valid[:, np.newaxis]
+    np.add.at(occupancy, (previous[kept], np.nonzero(kept)[1]), 1)
+    full = occupancy > instance.sizes[:, np.newaxis]
+    in_full = (kept & full[np.maximum(previous, 0), np.arange(periods)]).any(axis=1)
+
+    return _with_partners(data, ~valid | in_full)
+
+
+def grow_neighbourhood(data: Data, free: np.ndarray) -> np.ndarray:
+    """
+    Grows the free students when they can not be solved with the other students fixed: the students that have a course
+    the free students chose in their previous assignment are freed as well, so places can be swapped. If that adds no
+    students, all students are freed.
+    """
+    instance = data.get_instance()
+    wanted = np.zeros(len(instance.sizes) + 1, dtype=bool)
+    # the empty choices (-1) land in the extra last element, which is reset below
+    wanted[instance.choices[free]] = True
+    wanted[-1] = False
+    grown = _with_partners(data, free | wanted[instance.previous].any(axis=1))
+    if (grown == free).all():
+        return np.ones_like(free)
+    return grown
+
+
+def _with_partners(data: Data, free: np.ndarray) -> np.ndarray:
+    """The free students with the together/apart partners of the free students"""
+    instance = data.get_instance()
+    free = free.copy()
+    for student1, student2 in np.concatenate((instance.together, instance.apart)).tolist():
+        if free[student1] or free[student2]:
+            free[student1] = free[student2] = True
+    return free
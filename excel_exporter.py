@@ -1,9 +1,15 @@
 import colorsys
+from copy import copy
 
+import numpy as np
+from openpyxl.cell import WriteOnlyCell
 from openpyxl.styles import PatternFill
+from openpyxl.styles.fonts import DEFAULT_FONT
+from openpyxl.utils import get_column_letter
 from openpyxl.workbook import Workbook
+from openpyxl.worksheet.worksheet import Worksheet
 
-from model import Data, ClassConfig
+from model import Data, ClassConfig, EnrichedResultRecord
 from util import make_backup
 
 CELL_WIDTH_STUDENT_NAME = 25
@@ -17,103 +23,121 @@ COLOR_VARIANTS = (
     (75, 70),
 )
 
+TITLE_FONT = copy(DEFAULT_FONT)
+TITLE_FONT.sz = 14
+
+
 class ExcelExporter:
+    def __init__(self):
+        # one fill object per colour, shared by all cells with that colour
+        self._fills: dict[str, PatternFill] = {}
+
     def export(self, data: Data, filename: str):
-        wb = Workbook()
-        wb.remove(wb.active)
+        # write-only mode streams the rows to the file, instead of keeping all cells of all sheets in memory
+        wb = Workbook(write_only=True)
+
+        # the records per class, in one pass over the result
+        class_records: dict[str, list[EnrichedResultRecord]] = {cl.code: [] for cl in data.config.classes}
+        for record in data.enriched_result:
+            class_records.setdefault(data.student_to_class[record.student], []).append(record)
 
-        # classes = set(data.student_to_class.values())
         for class_config in data.config.classes:
-            # class_config = next(cl for cl in data.config.classes if cl.code == code)
-            self._add_class_sheet(wb, data, class_config)
+            self._add_class_sheet(wb, data, class_config, class_records[class_config.code])
 
         self._add_courses_sheet(wb, data)
 
         make_backup(filename)
         wb.save(filename)
 
-    def _add_class_sheet(self, wb: Workbook, data: Data, cl: ClassConfig):
+    def _add_class_sheet(self, wb: Workbook, data: Data, cl: ClassConfig, records: list[EnrichedResultRecord]):
         ws = wb.create_sheet(title=cl.name)
 
-        ws.append([cl.name, "keuzevakken indeling"])
-        ws.cell(row=1, column=1).font = ws.cell(row=1, column=1).font.copy(size=14)
-
-        ws.append([])
-        ws.append(["Naam", "Periode 1", "Periode 2", "Periode 3", "Periode 4", "", "Reserve"])
-
-        code_to_index = {course.code: i for i, course in enumerate(data.courses)}
-
-        for record in data.enriched_result:
-            if data.student_to_class[record.student] == cl.code:
-                courses = record.assigned[:data.config.periods] + [None] + record.assigned[data.config.periods:]
-                row = [record.student]
-                for course in courses:
-                    if course:
-                        row.append(data.get_course_name(course.code) + ("*" if course.original_reserve else ""))
-                    else:
-                        row.append("")
-                ws.append(row)
-
-                # color the cells based on the course
-                for i, course in enumerate(courses):
-                    if course:
-                        if course.fits:
-                            fill = self._solid_fill(self._color_for_index(code_to_index[course.code]))
-                        else:
-                            # intense red
-                            fill = self._solid_fill(self._hls_color(0, 60, 100))
-                        ws.cell(row=ws.max_row, column=i + 2).fill = fill
-
-        ws.append([])
-        ws.append(["* = oorspronkelijke reservekeuze"])
-
+        # the column widths of a write-only sheet must be set before the rows
         ws.column_dimensions["A"].width = CELL_WIDTH_STUDENT_NAME
         for i in range(1, 8):
             width = CELL_WIDTH_BREAK_COLUMN if i == data.config.periods + 1 else CELL_WIDTH_COURSE_NAME
             ws.column_dimensions[chr(65 + i)].width = width
 
-        ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-        ws.print_area = ws.dimensions
+        title = WriteOnlyCell(ws, value=cl.name)
+        title.font = TITLE_FONT
+        rows = [[title, "keuzevakken indeling"],
+                [],
+                ["Naam", "Periode 1", "Periode 2", "Periode 3", "Periode 4", "", "Reserve"]]
+
+        for record in records:
+            courses = record.assigned[:data.config.periods] + [None] + record.assigned[data.config.periods:]
+            row = [record.student]
+            for course in courses:
+                if course:
+                    cell = WriteOnlyCell(ws, value=data.get_course_name(course.code)
+                                         + ("*" if course.original_reserve else ""))
+                    # color the cells based on the course
+                    if course.fits:
+                        cell.fill = self._solid_fill(self._color_for_index(data.index_of_course(course.code)))
+                    else:
+                        # intense red
+                        cell.fill = self._solid_fill(self._hls_color(0, 60, 100))
+                    row.append(cell)
+                else:
+                    row.append("")
+            rows.append(row)
+
+        rows.append([])
+        rows.append(["* = oorspronkelijke reservekeuze"])
+
+        self._write_rows(ws, rows)
 
     def _add_courses_sheet(self, wb: Workbook, data: Data):
         ws = wb.create_sheet(title="Vakken")
 
-        ws.append(["Vak", "Grootte"] + [f"Periode {i + 1}" for i in range(data.config.periods)])
-
-        for y, course in enumerate(data.courses):
-            record = [course.name, course.size]
-            for p in range(data.config.periods):
-                count = 0
-                for rr in data.enriched_result:
-                    if rr.assigned[p] and rr.assigned[p].code == course.code:
-                        count += 1
-                if count > 0 or course.availability[p]:
-                    record.append(count)
-                else:
-                    record.append("")
-            ws.append(record)
+        ws.column_dimensions["A"].width = CELL_WIDTH_COURSE_NAME
+        for p in range(data.config.periods + 1):
+            ws.column_dimensions[chr(66 + p)].width = 10
+
+        periods = data.config.periods
+        instance = data.get_instance()
+
+        # the number of students per course and period, in one pass over the result
+        occupancy = np.zeros((len(data.courses), periods), dtype=np.int32)
+        for record in data.enriched_result:
+            for p, course in enumerate(record.assigned[:periods]):
+                if course:
+                    occupancy[data.index_of_course(course.code), p] += 1
 
+        rows = [["Vak", "Grootte"] + [f"Periode {i + 1}" for i in range(periods)]]
         for i, course in enumerate(data.courses):
-            y = i + 2
-            for x in range(3, data.config.periods + 3):
-                cell = ws.cell(row=y, column=x)
-                count = int(cell.value) if cell.value else 0
-                size = course.size if course.availability[x - 3] else 0
+            counts = occupancy[data.index_of_course(course.code)].tolist()
+            row = [course.name, course.size]
+            for p, count in enumerate(counts):
+                size = int(instance.sizes[i]) if instance.availability[i, p] else 0
                 if count > size:
-                    cell.fill = self._solid_fill(self._hls_color(0, 60, 100))
+                    fill = self._solid_fill(self._hls_color(0, 60, 100))
                 elif count > 0:
                     ratio = count / size
-                    cell.fill = self._solid_fill(self._hls_color(0, 100 - ratio * 100 / 2, 0))
-
-        ws.column_dimensions["A"].width = CELL_WIDTH_COURSE_NAME
-        for p in range(data.config.periods + 1):
-            ws.column_dimensions[chr(66 + p)].width = 10
-
-        ws.page_setup.orientation = ws.ORIENTATION_LANDSCAPE
-        ws.print_area = ws.dimensions
+                    fill = self._solid_fill(self._hls_color(0, 100 - ratio * 100 / 2, 0))
+                else:
+                    row.append(count if instance.availability[i, p] else "")
+                    continue
+                cell = WriteOnlyCell(ws, value=count)
+                cell.fill = fill
+                row.append(cell)
+            rows.append(row)
+
+        self._write_rows(ws, rows)
+
+    def _write_rows(self, ws, rows: list[list]):
+        """Appends the rows and sets the print area to them, a write-only sheet does not know its dimensions"""
+        ws.page_setup.orientation = Worksheet.ORIENTATION_LANDSCAPE
+        for row in rows:
+            ws.append(row)
+        ws.print_area = f"A1:{get_column_letter(max(len(row) for row in rows))}{len(rows)}"
 
     def _solid_fill(self, color: str):
-        return PatternFill(start_color=color, end_color=color, fill_type="solid")
+        fill = self._fills.get(color)
+        if fill is None:
+            fill = PatternFill(start_color=color, end_color=color, fill_type="solid")
+            self._fills[color] = fill
+        return fill
 
     def _color_for_index(self, index: int):
         hue = index * HUE_STEP % 360
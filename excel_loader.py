@@ -1,6 +1,10 @@
+import os
+from concurrent.futures import Executor, ProcessPoolExecutor
+
 from openpyxl.reader.excel import load_workbook
 
-from model import Data, HandledException, Config, ClassConfig, Course, Student, ResultRecord
+from model import Data, HandledException, Config, ClassConfig, Course, Student, ResultRecord, PreviousResult
+from xlsx_reader import XlsxReader
 
 
 class ExcelLoaderException(HandledException):
@@ -9,108 +13,187 @@ class ExcelLoaderException(HandledException):
 
 _META_SHEETS = ["config", "vakken"]
 
+# input workbooks from this size on have their class sheets parsed by several processes
+PARALLEL_SHEETS_MIN_BYTES = 256 * 1024
+
 
 class ExcelLoader:
-    def __init__(self, inputpath: str, previous: str | None):
+    def __init__(self, inputpath: str, previous: str | None, workers: int | None = 1):
         self.input = inputpath
         self.previous = previous
+        # number of processes to parse with, the number of cores if None. 1 (the default) parses everything in this
+        # process, so loading from the UI does not start processes.
+        self.workers = workers if workers is not None else os.cpu_count() or 1
 
     def load(self) -> Data:
-        data = Data()
-        wb = load_workbook(self.input, data_only=True)
+        """
+        Parsing the workbooks is CPU-bound, so with more than one worker the previous workbook is parsed in another
+        process while the input is parsed, and the class sheets of a large input are divided over the processes. The
+        result is the same as when everything is parsed in this process.
+        """
+        parallel_sheets = self.workers > 1 and os.path.getsize(self.input) >= PARALLEL_SHEETS_MIN_BYTES
+        if not parallel_sheets and (self.workers == 1 or not self.previous):
+            return self._load(None)
+        with ProcessPoolExecutor(max_workers=self.workers) as executor:
+            return self._load(executor, parallel_sheets)
+
+    def _load(self, executor: Executor | None, parallel_sheets: bool = False) -> Data:
+        previous_records = None
+        if self.previous and executor:
+            previous_records = executor.submit(read_previous_records, self.previous)
 
-        self._parse_config(data, wb)
-        self._parse_courses(data, wb)
-        self._parse_classes(data, wb)
-
-        if self.previous:
-            wb = load_workbook(self.previous, data_only=True)
-            self._parse_previous(data, wb)
+        data = Data()
+        # read-only mode streams the rows, instead of loading all cells of all sheets in memory. When the class sheets
+        # are read by the workers, only the config and courses sheets are read here, which the XlsxReader does without
+        # first scanning all sheets.
+        if parallel_sheets:
+            wb = XlsxReader(self.input)
+        else:
+            wb = load_workbook(self.input, read_only=True, data_only=True)
+        try:
+            self._parse_config(data, wb)
+            self._parse_courses(data, wb)
+            if parallel_sheets:
+                self._parse_classes_parallel(data, executor)
+            else:
+                self._parse_classes(data, wb)
+        finally:
+            wb.close()
+
+        if previous_records:
+            data.previous_result = PreviousResult.from_records(data, previous_records.result())
+        elif self.previous:
+            data.previous_result = PreviousResult.from_records(data, read_previous_records(self.previous))
 
         return data
 
     def _parse_config(self, data: Data, wb):
-        ws = self._get_sheet(wb, "Config")
-        periods = int(ws.cell(row=(self._find_in_column(ws, 1, "Periodes")), column=2).value)
+        """
+        Reads the config sheet in one pass. The number of periods is next to 'Periodes' in the first column, the pairs
+        are in the rows below the 'Samen' and 'Apart' cells, up to the first empty row.
+        """
+        ws = _get_sheet(wb, "Config")
+        periods = None
+        pairs: dict[str, list[list[str]] | None] = {"samen": None, "apart": None}
+        # anchor -> column of the pairs that are being read
+        reading: dict[str, int] = {}
+        for row in ws.iter_rows(values_only=True):
+            for anchor, col in list(reading.items()):
+                if _value(row, col):
+                    pairs[anchor].append([_value(row, col), _value(row, col + 1)])
+                else:
+                    del reading[anchor]
+
+            if periods is None and _value(row, 0) and str(_value(row, 0)).lower() == "periodes":
+                periods = int(_value(row, 1))
+            for col, value in enumerate(row):
+                anchor = str(value).lower() if value else None
+                if anchor in pairs and pairs[anchor] is None:
+                    pairs[anchor] = []
+                    reading[anchor] = col
+
+        if periods is None:
+            raise ExcelLoaderException(f"'Periodes' niet gevonden in werkblad {ws.title}")
+        for anchor, anchor_pairs in pairs.items():
+            if anchor_pairs is None:
+                raise ExcelLoaderException(f"'{anchor.capitalize()}' niet gevonden in werkblad {ws.title}")
+
         classes = [ClassConfig(name, name) for name in wb.sheetnames
                    if name.lower() not in _META_SHEETS and not name.startswith("_")]
-
-        def parse_pairs(ws, value):
-            r, c = self._find_in_sheet(ws, value)
-            r += 1
-            pairs = []
-            while ws.cell(row=r, column=c).value:
-                pairs.append([ws.cell(row=r, column=c).value, ws.cell(row=r, column=c + 1).value])
-                r += 1
-            return pairs
-
-        together = parse_pairs(ws, "Samen")
-        apart = parse_pairs(ws, "Apart")
-
-        data.config = Config(periods, classes, together, apart)
+        data.config = Config(periods, classes, pairs["samen"], pairs["apart"])
 
     def _parse_courses(self, data: Data, wb):
-        ws = self._get_sheet(wb, "Vakken")
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-            code = row[0].value
+        ws = _get_sheet(wb, "Vakken")
+        for row in ws.iter_rows(min_row=2, values_only=True):
+            code = _value(row, 0)
             if not code:
                 break
-            size = int(row[1].value)
-            availability = "".join(["1" if cell.value == "x" else "0" for cell in row[2:data.config.periods + 2]])
-            data.courses.append(Course(code, size, availability))
+            size = int(row[1])
+            availability = "".join(["1" if _value(row, col) == "x" else "0"
+                                    for col in range(2, data.config.periods + 2)])
+            data.add_course(Course(code, size, availability))
 
     def _parse_classes(self, data: Data, wb):
         for cl in data.config.classes:
-            ws = self._get_sheet(wb, cl.code)
-            self._parse_class(data, ws)
-
-    def _parse_class(self, data: Data, ws):
-        students = []
-        for row in ws.iter_rows(min_row=2, max_row=ws.max_row):
-            name = row[0].value
-            if not name:
-                break
-            choices = [cell.value for cell in row[1:] if cell.value]
-            students.append(Student(name, choices))
-        data.add_students(ws.title, students)
-
-    def _parse_previous(self, data: Data, wb):
-        previous_records = []
-        for name in wb.sheetnames:
-            if name.lower() in _META_SHEETS or name.startswith("_"):
-                continue
-            ws = self._get_sheet(wb, name)
-
-            row = self._find_in_column(ws, 1, "Naam") + 1
-            while ws.cell(row=row, column=1).value:
-                name = ws.cell(row=row, column=1).value
-                courses = []
-                for col in range(2, data.config.periods + 2):
-                    courses.append(ws.cell(row=row, column=col).value)
-                    previous_records.append(ResultRecord(name, courses, 0))
-                row += 1
-        data.previous_result = previous_records
-
-    def _get_sheet(self, wb, sheet_name):
-        if sheet_name not in wb.sheetnames:
-            raise ExcelLoaderException(f"Werkblad '{sheet_name}' niet gevonden")
-        return wb[sheet_name]
-
-    def _find_in_sheet(self, ws, value) -> tuple[int, int]:
-        for row in ws.iter_rows():
-            for cell in row:
-                if cell.value and str(cell.value).lower() == value.lower():
-                    return cell.row, cell.column
-        raise ExcelLoaderException(f"'{value}' niet gevonden in werkblad {ws.title}")
-
-    def _find_in_column(self, ws, col, value) -> int:
-        for row in ws.iter_rows(min_row=1, max_row=ws.max_row, min_col=col, max_col=col):
-            if row[0].value and row[0].value.lower() == value.lower():
-                return row[0].row
-        raise ExcelLoaderException(f"'{value}' niet gevonden in werkblad {ws.title}")
+            data.add_students(cl.code, _read_students(_get_sheet(wb, cl.code)))
+
+    def _parse_classes_parallel(self, data: Data, executor: Executor):
+        """
+        Divides the class sheets in consecutive chunks, one per worker. Each worker opens the xlsx file itself and
+        only streams the sheets of its chunk from it, and returns the students per sheet.
+        """
+        codes = [cl.code for cl in data.config.classes]
+        chunk_size = -(-len(codes) // self.workers)
+        chunks = [codes[i:i + chunk_size] for i in range(0, len(codes), chunk_size)]
+        futures = [executor.submit(_read_class_sheets, self.input, chunk) for chunk in chunks]
+        for chunk, future in zip(chunks, futures):
+            for code, students in zip(chunk, future.result()):
+                data.add_students(code, students)
 
     # def _find_value(sheet, value) -> tuple[int, int]:
     #     for row in sheet.iter_rows(min_row=1, max_row=sheet.max_row, min_col=1, max_col=1):
     #         if row[0].value and row[0].value.lower() == value:
     #             return row[0].row, 2
     #     raise HandledException(f"Value '{value}' not found in sheet {sheet.title}")
+
+
+def _get_sheet(wb, sheet_name):
+    if sheet_name not in wb.sheetnames:
+        raise ExcelLoaderException(f"Werkblad '{sheet_name}' niet gevonden")
+    return wb[sheet_name]
+
+
+def _read_students(ws) -> list[Student]:
+    students = []
+    # rows after the first empty name are ignored, however far down the sheet is formatted
+    for row in ws.iter_rows(min_row=2, values_only=True):
+        name = _value(row, 0)
+        if not name:
+            break
+        choices = [value for value in row[1:] if value]
+        students.append(Student(name, choices))
+    return students
+
+
+def _read_class_sheets(path: str, codes: list[str]) -> list[list[Student]]:
+    """The students of the given class sheets, runs in a worker process"""
+    wb = XlsxReader(path)
+    try:
+        return [_read_students(_get_sheet(wb, code)) for code in codes]
+    finally:
+        wb.close()
+
+
+def read_previous_records(path: str) -> list[ResultRecord]:
+    """
+    Reads one record per student from the rows below the 'Naam' header of each class sheet of a previous result, up
+    to the first empty name. The records contain all columns after the name, the periods are not known yet when this
+    runs in a worker process.
+    """
+    wb = load_workbook(path, read_only=True, data_only=True)
+    try:
+        previous_records = []
+        for name in wb.sheetnames:
+            if name.lower() in _META_SHEETS or name.startswith("_"):
+                continue
+            ws = wb[name]
+
+            header_found = False
+            for row in ws.iter_rows(values_only=True):
+                student = _value(row, 0)
+                if not header_found:
+                    header_found = bool(student) and str(student).lower() == "naam"
+                    continue
+                if not student:
+                    break
+                previous_records.append(ResultRecord(student, list(row[1:]), 0))
+            if not header_found:
+                raise ExcelLoaderException(f"'Naam' niet gevonden in werkblad {ws.title}")
+        return previous_records
+    finally:
+        wb.close()
+
+
+def _value(row: tuple, col: int):
+    """The value in the given (0-based) column, rows of a read-only sheet may be shorter than the sheet is wide"""
+    return row[col] if col < len(row) else None
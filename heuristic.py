@@ -0,0 +1,390 @@
+import math
+import random
+import time
+from functools import lru_cache
+from typing import NamedTuple
+
+import numpy as np
+
+from model import Data
+from penalties import calculate_penalties
+
+# A fast heuristic for a complete schedule, without a proof of how good it is. The students are assigned one by one the
+# best valid assignment that still fits, the students with the most to lose first (regret), after which a local search
+# moves and swaps students to better assignments as long as time allows. Students that fit no valid assignment get
+# one with the full course periods left empty, so the schedule always respects the course sizes. It is used as a hint
+# for CP-SAT, as the result if CP-SAT finds no solution and as the fast mode of the solver.
+
+# the time the local search after the greedy assignment may take
+LOCAL_SEARCH_TIME = 0.5
+# the number of times the regret of the students that are left is determined again during the greedy assignment
+REGRET_ROUNDS = 4
+# the number of better assignments of a student, blocked by a single full course period, that are tried to swap for
+SWAP_OPTIONS = 3
+# the number of students in that full course period that are tried to move elsewhere
+SWAP_CANDIDATES = 20
+# the candidates of this number of assignments (students times templates) are generated at once
+CHUNK_ASSIGNMENTS = 1 << 18
+
+
+class Candidates(NamedTuple):
+    # the valid assignments of all students as course number per period (-1 for an empty period), the assignments of a
+    # student are consecutive and ordered by penalty
+    assignments: np.ndarray
+    penalties: np.ndarray
+
+    # the index of the first assignment of each student (by row in Data.students), plus the end of the last one
+    starts: np.ndarray
+
+
+class Templates(NamedTuple):
+    # the assignments of a number of courses to the periods, as position of the course per period (-1 for empty)
+    positions: np.ndarray
+
+    # the set of positions each template assigns, as index in subsets
+    subset: np.ndarray
+
+    # the positions of each set in ascending order, -1 for the periods that are not needed
+    subsets: np.ndarray
+
+
+def valid_candidates(data: Data, solver_pass: int, minimize_changes: bool) -> Candidates:
+    """
+    The valid assignments of all students in the given pass with their penalties, the same as the assignments that
+    Solver._create_valid_assignments generates. These are generated from templates of choice positions instead of one by
+    one, as converting the assignments of the solver alone takes longer than the whole heuristic.
+    """
+    instance = data.get_instance()
+    periods = instance.periods
+    columns = np.arange(instance.choices.shape[1])
+    counted = columns[np.newaxis, :] < np.maximum(periods, instance.choice_counts)[:, np.newaxis]
+    needed_empty = ((instance.choices == -1) & counted).sum(axis=1)
+    empty_slots = np.maximum(needed_empty, solver_pass).tolist()
+
+    # the rows per number of (distinct) chosen courses and empty slots, which share their templates
+    groups: dict[tuple[int, int], tuple[list[int], list[list[int]]]] = {}
+    for row, (choices, count) in enumerate(zip(instance.choices.tolist(), instance.choice_counts.tolist())):
+        courses = list(dict.fromkeys(course for course in choices[:count] if course >= 0))
+        rows, group_courses = groups.setdefault((len(courses), empty_slots[row]), ([], []))
+        rows.append(row)
+        group_courses.append(courses)
+
+    generated = []
+    owners = []
+    generated_penalties = []
+    period_index = np.arange(periods)
+    for (course_count, empty), (rows, group_courses) in groups.items():
+        templates = _templates(course_count, periods, empty)
+        rows = np.array(rows)
+        # a last column of -1 for the empty periods of the templates
+        courses = np.hstack([np.array(group_courses, dtype=np.int16).reshape(len(rows), course_count),
+                             np.full((len(rows), 1), -1, dtype=np.int16)])
+        chunk = max(1, CHUNK_ASSIGNMENTS // max(1, len(templates.positions)))
+        for start in range(0, len(rows), chunk):
+            chunk_rows, chunk_courses = rows[start:start + chunk], courses[start:start + chunk]
+            # whether the course at each position is given in each period, the empty (last) position always is, which
+            # an empty period of a template (position -1) refers to
+            available = instance.availability[chunk_courses] | (chunk_courses < 0)[:, :, np.newaxis]
+            available = available.reshape(len(chunk_rows), -1)[:, templates.positions * periods + period_index]
+            student, template = np.nonzero(available.all(axis=2))
+            generated.append(chunk_courses[student[:, np.newaxis], templates.positions[template]])
+            owners.append(chunk_rows[student])
+
+            # without changes to count, the penalty only depends on the set of courses that is assigned, which is the
+            # same for many templates, so it is calculated once per set
+            subset_count = len(templates.subsets)
+            subset_rows = np.repeat(chunk_rows, subset_count)
+            penalties = calculate_penalties(chunk_courses[:, templates.subsets].reshape(-1, periods),
+                                            instance.choices[subset_rows, :periods],
+                                            instance.choices[subset_rows, periods:], instance.previous[subset_rows],
+                                            instance.has_previous[subset_rows], False)
+            generated_penalties.append(penalties.reshape(-1, subset_count)[student, templates.subset[template]])
+
+    assignments = np.concatenate(generated) if generated else np.zeros((0, periods), dtype=np.int16)
+    owner = np.concatenate(owners) if owners else np.zeros(0, dtype=np.int64)
+    penalties = np.concatenate(generated_penalties) if generated else np.zeros(0, dtype=np.int64)
+    if minimize_changes:
+        changes = instance.has_previous[owner]
+        penalties[changes] = calculate_penalties(assignments[changes], instance.choices[owner[changes], :periods],
+                                                 instance.choices[owner[changes], periods:],
+                                                 instance.previous[owner[changes]], changes[changes], True)
+    # by student and penalty, the order of generating is kept for equal penalties
+    order = np.lexsort((penalties, owner))
+    counts = np.bincount(owner, minlength=len(instance.choices))
+    return Candidates(assignments[order], penalties[order], np.concatenate(([0], np.cumsum(counts))))
+
+
+@lru_cache
+def _templates(course_count: int, periods: int, empty_slots: int) -> Templates:
+    """
+    All assignments of course_count distinct courses (by position) to the periods with at most empty_slots empty
+    periods, in the order of Solver._generate_assignments.
+    """
+    templates = []
+    current = [-1] * periods
+    used = [False] * course_count
+
+    def place(period: int, empty_left: int):
+        if period == periods:
+            templates.append(tuple(current))
+            return
+        for i in range(course_count):
+            if not used[i]:
+                used[i] = True
+                current[period] = i
+                place(period + 1, empty_left)
+                used[i] = False
+        if empty_left > 0:
+            current[period] = -1
+            place(period + 1, empty_left - 1)
+
+    place(0, empty_slots)
+    subsets: dict[tuple[int, ...], int] = {}
+    subset = [subsets.setdefault(tuple(sorted(i for i in template if i >= 0)), len(subsets)) for template in templates]
+    return Templates(np.array(templates, dtype=np.int64).reshape(-1, periods), np.array(subset, dtype=np.int64),
+                     np.array([positions + (-1,) * (periods - len(positions)) for positions in subsets],
+                              dtype=np.int64).reshape(-1, periods))
+
+
+def heuristic_solution(data: Data, solver_pass: int, minimize_changes: bool, places: np.ndarray,
+                       pairs: list[tuple[int, int, int]], current: np.ndarray | None = None,
+                       time_limit: float = LOCAL_SEARCH_TIME, seed: int | None = None) -> np.ndarray:
+    """
+    A schedule as course number per student and period, from the valid assignments of the given pass and with the
+    given places per course and period. The pairs are (row, row, penalty per shared course period). The students that
+    have courses in current keep these as a start, the others are assigned greedily, after which all students are
+    improved by local search for at most time_limit seconds.
+    """
+    start = time.perf_counter()
+    candidates = valid_candidates(data, solver_pass, minimize_changes)
+    heuristic = GreedyHeuristic(data, candidates, places, pairs, minimize_changes, seed)
+    free = np.ones(len(data.students), dtype=bool)
+    if current is not None:
+        heuristic.start_from(current)
+        free = (current < 0).all(axis=1)
+    heuristic.assign(np.flatnonzero(free))
+    greedy_time = time.perf_counter() - start
+    heuristic.improve(time.perf_counter() + time_limit)
+    print(f"Heuristic: {len(candidates.penalties)} valid assignments, {free.sum()} students assigned greedily in "
+          f"{greedy_time:.2f}s, improved in {time.perf_counter() - start - greedy_time:.2f}s")
+    return heuristic.courses
+
+
+class GreedyHeuristic:
+    """
+    Assigns the students greedily by regret and improves the assignment by local search, see heuristic_solution. The
+    places are kept per slot (course and period), with an extra last slot for the empty periods that never fills up.
+    """
+
+    def __init__(self, data: Data, candidates: Candidates, places: np.ndarray,
+                 pairs: list[tuple[int, int, int]], minimize_changes: bool, seed: int | None = None):
+        self.instance = data.get_instance()
+        self.candidates = candidates
+        self.minimize_changes = minimize_changes
+        self.periods = self.instance.periods
+        self.random = random.Random(seed)
+        student_count = len(self.instance.choices)
+        self.remaining = np.append(places.ravel(), student_count + 1).astype(np.int64)
+        self.period_index = np.arange(self.periods)
+        # the slot of each period of the candidates
+        self.slots = self._slots(candidates.assignments).astype(np.int32)
+        self.courses = np.full((student_count, self.periods), -1, dtype=np.int16)
+        # the penalty of the assignment of each student, without the pair penalties
+        self.penalties = np.zeros(student_count, dtype=np.int64)
+        # the together/apart partners of each student in a pair, with the penalty per shared course period
+        self.partners: dict[int, list[tuple[int, int]]] = {}
+        for student1, student2, penalty in pairs:
+            self.partners.setdefault(student1, []).append((student2, penalty))
+            self.partners.setdefault(student2, []).append((student1, penalty))
+
+    def start_from(self, current: np.ndarray):
+        """Takes the places of the given assignment (course number per student and period)"""
+        self.courses = current.astype(np.int16)
+        np.subtract.at(self.remaining, self._slots(self.courses).ravel(), 1)
+        self.remaining[-1] = len(self.courses) + 1
+
+    def assign(self, students: np.ndarray):
+        """
+        Assigns the given students (rows) greedily. The students for which the best assignment that fits is the most
+        better than the next best are assigned first, as they have the most to lose when others take their places. The
+        regret of the students that are left is determined again a few times, as the places fill up.
+        """
+        todo = students
+        for round_nr in range(REGRET_ROUNDS):
+            if not len(todo):
+                break
+            order = todo[self._by_regret(todo)]
+            count = math.ceil(len(order) / (REGRET_ROUNDS - round_nr))
+            for row in order[:count].tolist():
+                self._assign_best(row)
+            todo = order[count:]
+
+    def improve(self, deadline: float):
+        """
+        Local search until no student improves anymore or the deadline has passed: a student moves to a better
+        assignment that fits, or swaps places with a student in a full course period that can move elsewhere.
+        """
+        instance = self.instance
+        self.penalties = calculate_penalties(self.courses, instance.choices[:, :self.periods],
+                                             instance.choices[:, self.periods:], instance.previous,
+                                             instance.has_previous, self.minimize_changes)
+        starts = self.candidates.starts
+        has_candidates = starts[1:] > starts[:-1]
+        # the assignments of a student are ordered by penalty, so its first one is the best
+        best = np.zeros(len(has_candidates), dtype=np.int64)
+        best[has_candidates] = self.candidates.penalties[starts[:-1][has_candidates]]
+        paired = np.zeros(len(has_candidates), dtype=bool)
+        paired[list(self.partners)] = True
+        improved = True
+        while improved and time.perf_counter() < deadline:
+            improved = False
+            excess = self.penalties - best
+            # the students that are furthest from their best assignment first
+            rows = np.flatnonzero(has_candidates & ((excess > 0) | paired))
+            for row in rows[np.argsort(-excess[rows], kind="stable")].tolist():
+                if time.perf_counter() >= deadline:
+                    return
+                if self._move(row) or self._swap(row):
+                    improved = True
+
+    def _by_regret(self, rows: np.ndarray) -> np.ndarray:
+        """
+        The order of the given students by regret: the difference between the penalties of the best and the second best
+        assignment that fits, the students with a single assignment that fits first and those without one last.
+        """
+        starts = self.candidates.starts
+        counts = starts[rows + 1] - starts[rows]
+        offsets = np.cumsum(counts) - counts
+        index = np.repeat(starts[rows] - offsets, counts) + np.arange(counts.sum())
+        # all fit until a course period is full, after that they are checked period by period, which avoids gathering
+        # the slots of all periods of (millions of) assignments at once
+        open_slots = self.remaining > 0
+        fits = np.ones(len(index), dtype=bool)
+        if not open_slots.all():
+            for period in range(self.periods):
+                fits &= open_slots[self.slots[index, period]]
+        student = np.repeat(np.arange(len(rows)), counts)
+
+        # the rank of each assignment that fits among the ones of its student, counting from 1
+        fitting = np.cumsum(fits)
+        rank = fitting - np.repeat(np.concatenate(([0], fitting))[offsets], counts)
+        penalties = self.candidates.penalties[index]
+        first = np.full(len(rows), np.inf)
+        second = np.full(len(rows), np.inf)
+        first[student[fits & (rank == 1)]] = penalties[fits & (rank == 1)]
+        second[student[fits & (rank == 2)]] = penalties[fits & (rank == 2)]
+        fitting_count = np.bincount(student, weights=fits, minlength=len(rows))
+        regret = np.full(len(rows), -1.0)
+        some_fit = fitting_count > 0
+        regret[some_fit] = second[some_fit] - first[some_fit]
+        return np.lexsort((fitting_count, -regret))
+
+    def _assign_best(self, row: int):
+        """Assigns the best assignment that fits, or else the one with the fewest full course periods left empty"""
+        start, end = self.candidates.starts[row], self.candidates.starts[row + 1]
+        if start == end:
+            return
+        best = self._best_fit(row, start, end)
+        if best is not None:
+            self._take_candidate(row, start + best)
+        else:
+            full = self.remaining[self.slots[start:end]] <= 0
+            best = np.argmin(full.sum(axis=1))
+            self._take(row, np.where(full[best], -1, self.candidates.assignments[start + best]))
+
+    def _move(self, row: int) -> bool:
+        """Moves the student to the best assignment that fits, if that is better than its current assignment"""
+        start, end = self.candidates.starts[row], self.candidates.starts[row + 1]
+        current, current_penalty = self.courses[row].copy(), self.penalties[row]
+        current_cost = self._current_cost(row)
+        self._release(row)
+        best = self._best_fit(row, start, end)
+        if best is not None and self._costs(row, start + best, start + best + 1)[0] < current_cost:
+            self._take_candidate(row, start + best)
+            return True
+        self._take(row, current, current_penalty)
+        return False
+
+    def _swap(self, row: int) -> bool:
+        """
+        Gives the student a better assignment that is blocked by a single full course period, by moving another student
+        out of that course period to another assignment that fits, if that is better in total.
+        """
+        start, end = self.candidates.starts[row], self.candidates.starts[row + 1]
+        current, current_penalty = self.courses[row].copy(), self.penalties[row]
+        current_cost = self._current_cost(row)
+        self._release(row)
+        costs = self._costs(row, start, end)
+        full = self.remaining[self.slots[start:end]] <= 0
+        options = np.flatnonzero((costs < current_cost) & (full.sum(axis=1) == 1))
+        partners = {partner for partner, _ in self.partners.get(row, [])}
+        for option in options[np.argsort(costs[options], kind="stable")][:SWAP_OPTIONS].tolist():
+            assignment = self.candidates.assignments[start + option]
+            period = int(np.argmax(full[option]))
+            others = [other for other in np.flatnonzero(self.courses[:, period] == assignment[period]).tolist()
+                      if other not in partners]
+            self._take_candidate(row, start + option)
+            for other in self.random.sample(others, min(SWAP_CANDIDATES, len(others))):
+                other_start, other_end = self.candidates.starts[other], self.candidates.starts[other + 1]
+                other_current, other_penalty = self.courses[other].copy(), self.penalties[other]
+                other_cost = self._current_cost(other)
+                self._release(other)
+                best = self._best_fit(other, other_start, other_end)
+                if best is not None:
+                    gain = (costs[option] - current_cost
+                            + self._costs(other, other_start + best, other_start + best + 1)[0] - other_cost)
+                    if gain < 0:
+                        self._take_candidate(other, other_start + best)
+                        return True
+                self._take(other, other_current, other_penalty)
+            self._release(row)
+        self._take(row, current, current_penalty)
+        return False
+
+    def _best_fit(self, row: int, start: int, end: int) -> int | None:
+        """
+        The (relative) index of the assignment of the student with the lowest cost that fits, None if none fits. Of the
+        assignments with the same cost, the one with the most places left in its fullest course period is taken, so the
+        places that are scarce are left for others.
+        """
+        room = self.remaining[self.slots[start:end]].min(axis=1)
+        fits = room > 0
+        if not fits.any():
+            return None
+        costs = self._costs(row, start, end)
+        return int(np.argmax(np.where(fits & (costs == costs[fits].min()), room, 0)))
+
+    def _costs(self, row: int, start: int, end: int) -> np.ndarray:
+        """The penalties of assignments of a student, with the pair penalties for the current partner assignments"""
+        costs = self.candidates.penalties[start:end]
+        for partner, penalty in self.partners.get(row, []):
+            assignments = self.candidates.assignments[start:end]
+            costs = costs + penalty * ((assignments == self.courses[partner]) & (assignments >= 0)).sum(axis=1)
+        return costs
+
+    def _current_cost(self, row: int) -> int:
+        cost = int(self.penalties[row])
+        courses = self.courses[row]
+        for partner, penalty in self.partners.get(row, []):
+            cost += penalty * int(((courses == self.courses[partner]) & (courses >= 0)).sum())
+        return cost
+
+    def _take(self, row: int, courses: np.ndarray, penalty: int = 0):
+        self.courses[row] = courses
+        self.penalties[row] = penalty
+        self.remaining[self._slots(courses)] -= 1
+
+    def _take_candidate(self, row: int, index: int):
+        """Takes the valid assignment with the given index, of which the slots are already known"""
+        self.courses[row] = self.candidates.assignments[index]
+        self.penalties[row] = self.candidates.penalties[index]
+        self.remaining[self.slots[index]] -= 1
+
+    def _release(self, row: int):
+        self.remaining[self._slots(self.courses[row])] += 1
+        self.courses[row] = -1
+
+    def _slots(self, courses: np.ndarray) -> np.ndarray:
+        """The slot of each period of one or more assignments, the last slot for an empty period"""
+        return np.where(courses >= 0, courses.astype(np.int64) * self.periods + self.period_index,
+                        len(self.remaining) - 1)
@@ -0,0 +1,154 @@
+import random
+from typing import NamedTuple
+
+import numpy as np
+
+from delta import affected_students
+from model import Data
+
+# Large neighbourhood search (LNS) for schools that are too large to solve as one model in time. Starting from a
+# solution, a neighbourhood of students is solved again with the other students fixed to their assignment, which is a
+# small model that solves fast. Neighbourhoods are taken by class, by an oversubscribed course and at random in turn,
+# so the students that compete for places are solved together. See Solver._solve_lns for the search itself.
+
+# the number of students in a neighbourhood, and the time limit of solving one, no neighbourhood is solved with less
+# time than the minimum
+NEIGHBOURHOOD_SIZE = 100
+NEIGHBOURHOOD_TIME = 5.0
+MIN_NEIGHBOURHOOD_TIME = 1.0
+
+CLASS, COURSE, RANDOM = "class", "course", "random"
+KINDS = (CLASS, COURSE, RANDOM)
+
+
+class Neighbourhood(NamedTuple):
+    kind: str
+
+    # True for the students (by index in Data.students) that are solved again
+    free: np.ndarray
+
+
+class NeighbourhoodSolution(NamedTuple):
+    # the students that were solved again
+    free: np.ndarray
+
+    # the course number per student and period, only the rows of the free students differ from the current solution
+    courses: np.ndarray
+
+    # the objective of the solution and of the current solution it started from, in the model of the neighbourhood
+    objective: float
+    current_objective: float
+
+
+def initial_solution(data: Data, solver_pass: int) -> np.ndarray:
+    """
+    The solution to start from, as course number per student and period: the previous result of the students that can
+    keep it (see delta.affected_students), the other students get no courses, which is always feasible.
+    """
+    instance = data.get_instance()
+    return np.where(affected_students(data, solver_pass)[:, np.newaxis], -1, instance.previous)
+
+
+class NeighbourhoodPicker:
+    """Picks disjoint neighbourhoods, taking the kinds of neighbourhoods in turn"""
+
+    def __init__(self, data: Data, seed: int | None, size: int = NEIGHBOURHOOD_SIZE):
+        instance = data.get_instance()
+        self.size = size
+        self.student_count = len(data.students)
+        self.random = random.Random(seed)
+        self.rounds = 0
+
+        self.classes: dict[str, list[int]] = {}
+        for i, student in enumerate(data.students):
+            self.classes.setdefault(data.student_to_class.get(student.name), []).append(i)
+
+        # the students per course that more students chose than it has places, like in decomposition.find_components
+        course_students: dict[int, list[int]] = {}
+        for i, (row, count) in enumerate(zip(instance.choices, instance.choice_counts)):
+            for course in dict.fromkeys(row[:count].tolist()):
+                if course >= 0:
+                    course_students.setdefault(course, []).append(i)
+        self.courses = [students for course, students in course_students.items()
+                        if len(students) > instance.sizes[course]]
+
+        # the students that are connected by pairs (including over other students) per student in a pair
+        self.partners: dict[int, list[int]] = {}
+        for student1, student2 in np.concatenate((instance.together, instance.apart)).tolist():
+            group1 = self.partners.get(student1, [student1])
+            group2 = self.partners.get(student2, [student2])
+            if group1 is not group2:
+                group1.extend(group2)
+                for student in group1:
+                    self.partners[student] = group1
+
+    def parallel_count(self, workers: int) -> int:
+        """The number of neighbourhoods to solve at the same time, together at most half of the students"""
+        return max(1, min(workers, self.student_count // (2 * self.size)))
+
+    def pick(self, current: np.ndarray, count: int) -> list[Neighbourhood]:
+        """
+        Picks count disjoint neighbourhoods. The students without any course in the current solution are taken first, so
+        a solution is built up in the first rounds. The (indirect) partners of a student are in its neighbourhood.
+        """
+        unassigned = set(np.flatnonzero((current < 0).all(axis=1)).tolist())
+        taken = np.zeros(self.student_count, dtype=bool)
+        neighbourhoods = []
+        for _ in range(count):
+            kind = KINDS[self.rounds % len(KINDS)]
+            self.rounds += 1
+            if kind == CLASS:
+                candidates = list(self.random.choice(list(self.classes.values())))
+            elif kind == COURSE and self.courses:
+                candidates = list(self.random.choice(self.courses))
+            else:
+                kind = RANDOM
+                candidates = list(range(self.student_count))
+            self.random.shuffle(candidates)
+            candidates.sort(key=lambda i: i not in unassigned)
+
+            free = np.zeros(self.student_count, dtype=bool)
+            selected = 0
+            for i in candidates:
+                if selected >= self.size:
+                    break
+                group = self.partners.get(i, [i])
+                if taken[group].any():
+                    continue
+                free[group] = taken[group] = True
+                selected += len(group)
+            neighbourhoods.append(Neighbourhood(kind, free))
+        return neighbourhoods
+
+
+def combine_solutions(data: Data, current: np.ndarray, objective: float,
+                      solutions: list[NeighbourhoodSolution | None]) -> tuple[np.ndarray, float, int]:
+    """
+    Combines the improvements of disjoint neighbourhoods that were solved from the same current solution. Partners are
+    in the same neighbourhood, so the objective of the combination changes by the sum of the improvements, but the
+    students of different neighbourhoods can together exceed the size of a course. The improvements are taken best
+    first, as long as the combination fits the course sizes.
+
+    Returns the combined solution, its objective and the number of improvements taken.
+    """
+    instance = data.get_instance()
+    solutions = sorted((solution for solution in solutions if solution is not None),
+                       key=lambda solution: solution.objective - solution.current_objective)
+    accepted = 0
+    for solution in solutions:
+        if solution.objective >= solution.current_objective:
+            break
+        combined = np.where(solution.free[:, np.newaxis], solution.courses, current)
+        if accepted and not _fits(instance.sizes, combined):
+            continue
+        current = combined
+        objective += solution.objective - solution.current_objective
+        accepted += 1
+    return current, objective, accepted
+
+
+def _fits(sizes: np.ndarray, courses: np.ndarray) -> bool:
+    assigned = courses >= 0
+    occupancy = np.zeros((len(sizes), courses.shape[1]), dtype=np.int32)
+    np.add.at(occupancy, (courses[assigned], np.nonzero(assigned)[1]), 1)
+    return bool((occupancy <= sizes[:, np.newaxis]).all())
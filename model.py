@@ -1,4 +1,7 @@
-from typing import NamedTuple
+from types import MappingProxyType
+from typing import Iterator, NamedTuple
+
+import numpy as np
 
 
 class ClassConfig(NamedTuple):
@@ -45,12 +48,13 @@ class EnrichedResultRecord(NamedTuple):
     penalty: int
 
     @staticmethod
-    def from_result_record(config: Config, courses: list[Course], result_record: ResultRecord, student: Student):
+    def from_result_record(config: Config, courses: list[Course], course_index: dict[str, int],
+                           result_record: ResultRecord, student: Student):
         def is_reserve(cc):
             return cc in student.choices[config.periods:]
 
         def get_course(cc):
-            return next(course for course in courses if course.code == cc)
+            return courses[course_index[cc]]
 
         # all choices that are not in the result
         remaining_codes = [course for course in student.choices if course and course not in result_record.courses]
@@ -84,28 +88,240 @@ class EnrichedResultRecord(NamedTuple):
         return EnrichedResultRecord(student.name, course_choices, result_record.penalty)
 
 
+class PreviousResult:
+    """
+    The result of an earlier calculation as course indices (in Data.courses) per student and period, -1 for no course.
+    It is built once when loading and is immutable, so the solver, its components and the difference count share it.
+    """
+
+    def __init__(self, courses: dict[str, tuple[int, ...]], unknown_students: tuple[str, ...] = (),
+                 unknown_courses: tuple[tuple[str, str], ...] = (), duplicate_students: tuple[str, ...] = ()):
+        self._courses = MappingProxyType(courses)
+        # students that are not in the data, they are not in the mapping
+        self.unknown_students = unknown_students
+        # (student, value) of the values that are not a known course, they are -1 in the mapping
+        self.unknown_courses = unknown_courses
+        # students with more than one record, only the first record is used
+        self.duplicate_students = duplicate_students
+
+    @staticmethod
+    def from_records(data: 'Data', records: list[ResultRecord]) -> 'PreviousResult':
+        """
+        Converts the course codes of the records to indices once. The reserve marker '*' that the exporter adds to a
+        course is ignored, so an exported result can be used as previous result.
+        """
+        periods = data.config.periods
+        courses: dict[str, tuple[int, ...]] = {}
+        unknown_students: dict[str, None] = {}
+        unknown_courses = []
+        duplicate_students = []
+        for record in records:
+            if record.student in courses or record.student in unknown_students:
+                duplicate_students.append(record.student)
+                continue
+            if data.find_student(record.student) is None:
+                unknown_students[record.student] = None
+                continue
+            indices = [-1] * periods
+            for period, value in enumerate(record.courses[:periods]):
+                code = str(value).removesuffix("*") if value else None
+                indices[period] = data.index_of_course(code)
+                if code and indices[period] == -1:
+                    unknown_courses.append((record.student, value))
+            courses[record.student] = tuple(indices)
+        return PreviousResult(courses, tuple(unknown_students), tuple(unknown_courses), tuple(duplicate_students))
+
+    def get(self, student: str) -> tuple[int, ...] | None:
+        return self._courses.get(student)
+
+    def warnings(self) -> list[str]:
+        """The parts of the previous result that are ignored, as messages for the user"""
+        # a course that is no longer given (e.g. cancelled) is left empty, which is then re-solved as usual
+        return [f"Onbekend vak {course} in eerdere indeling van leerling {student_name}, genegeerd"
+                for student_name, course in self.unknown_courses] + \
+            [f"Leerling {student_name} uit de eerdere indeling is niet gevonden in een klas, genegeerd"
+             for student_name in self.unknown_students]
+
+    def __contains__(self, student: str) -> bool:
+        return student in self._courses
+
+    def __iter__(self) -> Iterator[str]:
+        return iter(self._courses)
+
+    def __len__(self) -> int:
+        return len(self._courses)
+
+    def restricted_to(self, students: set[str]) -> 'PreviousResult':
+        """The previous result of the given students only, the course indices are kept"""
+        return PreviousResult({name: courses for name, courses in self._courses.items() if name in students})
+
+
+class ProblemInstance(NamedTuple):
+    """
+    Integer array representation of the problem, see Data.get_instance. Courses and students are referred to by their
+    index in Data.courses and Data.students, -1 is an empty or unknown course. The arrays are read-only, so an instance
+    can be shared by the solver and the exporter, and be pickled cheaply.
+    """
+    periods: int
+
+    # course index per student and choice (students x max(periods, longest choice list)), padded with -1. The choices
+    # from column `periods` on are the reserves.
+    choices: np.ndarray
+
+    # number of choices per student, including empty choices
+    choice_counts: np.ndarray
+
+    # True if the course is given in the period (courses x periods)
+    availability: np.ndarray
+
+    sizes: np.ndarray
+
+    # student indices of the together and apart pairs (pairs x 2)
+    together: np.ndarray
+    apart: np.ndarray
+
+    # course index per student and period in the previous result (students x periods), -1 for no course
+    previous: np.ndarray
+
+    # True if the student has a (non-empty) previous result
+    has_previous: np.ndarray
+
+    @staticmethod
+    def from_data(data: 'Data') -> 'ProblemInstance':
+        periods = data.config.periods
+        student_count = len(data.students)
+        width = max([periods] + [len(student.choices) for student in data.students])
+        choices = np.full((student_count, width), -1, dtype=np.int16)
+        choice_counts = np.zeros(student_count, dtype=np.int16)
+        previous = np.full((student_count, periods), -1, dtype=np.int16)
+        has_previous = np.zeros(student_count, dtype=bool)
+        for i, student in enumerate(data.students):
+            choices[i, :len(student.choices)] = [data.index_of_course(choice) for choice in student.choices]
+            choice_counts[i] = len(student.choices)
+            previous_courses = data.get_previous_result(student.name)
+            if previous_courses is not None:
+                previous[i] = previous_courses
+                has_previous[i] = True
+
+        def pairs(pair_list: list[list[str]]) -> np.ndarray:
+            return np.array([[data.index_of_student(name) for name in pair] for pair in pair_list],
+                            dtype=np.int32).reshape(-1, 2)
+
+        instance = ProblemInstance(
+            periods=periods,
+            choices=choices,
+            choice_counts=choice_counts,
+            availability=np.array([course.availability[:periods] for course in data.courses],
+                                  dtype=bool).reshape(-1, periods),
+            sizes=np.array([course.size for course in data.courses], dtype=np.int32),
+            together=pairs(data.config.together),
+            apart=pairs(data.config.apart),
+            previous=previous,
+            has_previous=has_previous
+        )
+        for array in instance[1:]:
+            array.flags.writeable = False
+        return instance
+
+
 class Data:
     def __init__(self):
-        self.config = None
-        self.students: list[Student] = []
-        self.courses: list[Course] = []
+        self._config: Config | None = None
+        self._students: list[Student] = []
+        self._courses: list[Course] = []
+        # lookup indexes, kept up to date by the setters, add_students and add_course
+        self._student_index: dict[str, int] = {}
+        self._course_index: dict[str, int] = {}
         self._result: list[ResultRecord] = []
         self._enriched_result: list[EnrichedResultRecord] = []
-        self.previous_result: list[ResultRecord] | None = None
-        self.previous_result_dict = None  # cache omdat er vaak lookups in worden gedaan
+        self._previous_result: PreviousResult | None = None
         self.student_to_class = {}
+        # built on first use, cleared when the data changes
+        self._instance: ProblemInstance | None = None
+
+    @property
+    def config(self) -> Config | None:
+        return self._config
+
+    @config.setter
+    def config(self, value: Config):
+        self._config = value
+        self._instance = None
+
+    @property
+    def previous_result(self) -> PreviousResult | None:
+        return self._previous_result
+
+    @previous_result.setter
+    def previous_result(self, value: PreviousResult | None):
+        self._previous_result = value
+        self._instance = None
+
+    def copy(self) -> 'Data':
+        """
+        A copy with its own result, that shares the configuration, courses, students, previous result and problem
+        instance with this data. These are not changed by solving, so the copies can be solved at the same time, but
+        the shared parts must not be changed.
+        """
+        data = Data()
+        data._config = self._config
+        data._students = self._students
+        data._courses = self._courses
+        data._student_index = self._student_index
+        data._course_index = self._course_index
+        data._previous_result = self._previous_result
+        data.student_to_class = self.student_to_class
+        data._instance = self.get_instance()
+        return data
+
+    def get_instance(self) -> ProblemInstance:
+        """The integer array representation of this data, built once and shared until the data changes"""
+        if self._instance is None:
+            self._instance = ProblemInstance.from_data(self)
+        return self._instance
+
+    @property
+    def students(self) -> list[Student]:
+        return self._students
+
+    @students.setter
+    def students(self, value: list[Student]):
+        self._students = value
+        self._instance = None
+        self._student_index = {}
+        for i, student in enumerate(value):
+            self._student_index.setdefault(student.name, i)
+
+    @property
+    def courses(self) -> list[Course]:
+        return self._courses
+
+    @courses.setter
+    def courses(self, value: list[Course]):
+        self._courses = value
+        self._instance = None
+        self._course_index = {}
+        for i, course in enumerate(value):
+            self._course_index.setdefault(course.code, i)
 
     def add_students(self, class_code, students):
+        self._instance = None
         for student in students:
-            self.students.append(student)
+            self._student_index.setdefault(student.name, len(self._students))
+            self._students.append(student)
             self.student_to_class[student.name] = class_code
 
+    def add_course(self, course: Course):
+        self._instance = None
+        self._course_index.setdefault(course.code, len(self._courses))
+        self._courses.append(course)
+
     def validate(self):
         validation_errors = []
         # check if all student choices are valid
         for student in self.students:
             for choice in student.choices:
-                if choice and not any(course.code == choice for course in self.courses):
+                if choice and choice not in self._course_index:
                     validation_errors.append(f"Onbekend vak {choice} voor leerling {student.name}")
 
         for group_name, pairs in {'Samen': self.config.together, 'Apart': self.config.apart}.items():
@@ -113,7 +329,7 @@ class Data:
                 if len(pair) != 2:
                     validation_errors.append(f"{group_name} lijst moet paren van 2 elementen bevatten")
                 for student_name in pair:
-                    if not any(student.name == student_name for student in self.students):
+                    if student_name not in self._student_index:
                         validation_errors.append(
                             f"{student_name} staat onder '{group_name}', maar is niet gevonden in een klas")
 
@@ -122,11 +338,19 @@ class Data:
             if len(student.choices) != len(set(student.choices)):
                 validation_errors.append(f"Duplicaten in keuzes van leerling {student.name}")
 
-        # TODO check with last year's data if available
+        if self.previous_result:
+            # unknown courses and students are not errors, see warnings
+            for student_name in self.previous_result.duplicate_students:
+                validation_errors.append(f"Leerling {student_name} komt meerdere keren voor in de eerdere indeling")
 
         if validation_errors:
             raise HandledException("\n".join(validation_errors))
 
+    @property
+    def warnings(self) -> list[str]:
+        """Problems in the input that do not stop the calculation, because the affected parts are ignored"""
+        return self.previous_result.warnings() if self.previous_result else []
+
     # setter for result, which also derives the enriched result
     @property
     def result(self):
@@ -136,7 +360,8 @@ class Data:
     def result(self, value):
         self._result = value
         self._enriched_result = [
-            EnrichedResultRecord.from_result_record(self.config, self.courses, record, self.get_student(record.student))
+            EnrichedResultRecord.from_result_record(self.config, self.courses, self._course_index, record,
+                                                    self.get_student(record.student))
             for record in value]
 
     @property
@@ -149,62 +374,55 @@ class Data:
         changes and how many after a recalculation with potentially different parameters or input.
         """
 
-        def diffs(l1: list, l2: list) -> int:
-            ll1 = ["" if x is None else x for x in l1]
-            ll2 = ["" if x is None else x for x in l2]
-
-            diff_count = 0
-            for i in range(min(len(ll1), len(ll2))):
-                if ll1[i] != ll2[i]:
-                    diff_count += 1
+        def diffs(l1: tuple[int, ...], l2: tuple[int, ...]) -> int:
+            diff_count = sum(1 for i in range(min(len(l1), len(l2))) if l1[i] != l2[i])
             # Add the remaining elements in the longer list to the difference count
-            diff_count += abs(len(ll1) - len(ll2))
+            diff_count += abs(len(l1) - len(l2))
             return diff_count
 
-        previous = self.previous_result if self.previous_result else []
-
-        pr = self._result_to_dict(previous)
+        previous = self.previous_result if self.previous_result else PreviousResult({})
 
-        nw = self._result_to_dict(self.result)
+        nw = {record.student: tuple(self.index_of_course(course) for course in record.courses)
+              for record in self.result}
 
         diff = 0
         for student in self.students:
-            if student.name in pr and student.name in nw:
-                diff += diffs(pr[student.name], nw[student.name])
+            previous_courses = previous.get(student.name)
+            if previous_courses is not None and student.name in nw:
+                diff += diffs(previous_courses, nw[student.name])
             else:
                 diff += 1
 
         # Add 1 for each student that is in the previous result but not in the new result
-        for student in pr:
-            if student not in nw:
-                diff += 1
+        diff += sum(1 for student in previous if student not in nw)
+        diff += len(previous.unknown_students)
 
         return diff
 
-    def get_previous_result(self, student_name):
+    def get_previous_result(self, student_name) -> tuple[int, ...] | None:
+        """The course index per period in the previous result of the student, None if not in the previous result"""
         if not self.previous_result:
             return None
-
-        return self._get_previous_result_dict().get(student_name)
-
-    def _get_previous_result_dict(self):
-        if not self.previous_result_dict:
-            self.previous_result_dict = self._result_to_dict(self.previous_result)
-        return self.previous_result_dict
-
-    def _result_to_dict(self, result):
-        return {record.student: record.courses for record in result}
+        return self.previous_result.get(student_name)
 
     def get_course_name(self, course):
         if not course:
             return ''
-        return next(c.name for c in self.courses if c.code == course)
+        return self.courses[self._course_index[course]].name
+
+    def index_of_course(self, course) -> int:
+        """The index of the course with the given code, -1 for an empty or unknown code"""
+        return self._course_index.get(course, -1) if course else -1
 
     def get_student(self, student):
-        return next(s for s in self.students if s.name == student)
+        return self.students[self._student_index[student]]
 
     def index_of_student(self, student):
-        return next(i for i, s in enumerate(self.students) if s.name == student)
+        return self._student_index[student]
+
+    def find_student(self, student) -> int | None:
+        """The index of the student, None if unknown"""
+        return self._student_index.get(student)
 
 
 class HandledException(Exception):
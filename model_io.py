@@ -1,15 +1,75 @@
+import os
+from typing import Callable, NamedTuple
+
+import data_cache
+import excel_loader
+import table_io
 from excel_exporter import ExcelExporter
 from excel_loader import ExcelLoader
-from model import Data
+from model import Data, HandledException, PreviousResult, ResultRecord
+from table_io import TableExporter, TableLoader
+
+
+class FileFormat(NamedTuple):
+    # creates the loader for an input (and a previous result in the same format) with a number of processes to parse
+    # with, which has a load() method
+    loader: Callable[[str, str | None, int | None], ExcelLoader | TableLoader]
+    # creates the exporter of a result, which has an export(data, path) method
+    exporter: Callable[[], ExcelExporter | TableExporter]
+    read_previous_records: Callable[[str], list[ResultRecord]]
+    # parsing is slow enough to keep a snapshot of the parsed data, see data_cache
+    cached: bool
+
+
+EXCEL = FileFormat(ExcelLoader, ExcelExporter, excel_loader.read_previous_records, True)
+# the tables are read by pandas in this process
+TABLES = FileFormat(lambda path, previous, workers: TableLoader(path, previous), TableExporter,
+                    table_io.read_previous_records, False)
+
+# the file format per extension
+FORMATS = {".xlsx": EXCEL} | {extension: TABLES for extension in table_io.TABLE_EXTENSIONS}
 
 
-def load(file_path: str, previous: str | None) -> Data:
-    loader = ExcelLoader(file_path, previous)
-    data = loader.load()
+def file_format(path: str) -> FileFormat:
+    extension = os.path.splitext(path)[1].lower()
+    if extension not in FORMATS:
+        raise HandledException(f"Onbekend bestandstype '{extension}' van {path}, "
+                               f"ondersteund zijn {', '.join(FORMATS)}")
+    return FORMATS[extension]
+
+
+def load(file_path: str, previous: str | None, use_cache: bool = True, workers: int | None = 1) -> Data:
+    """
+    Loads the input and the optional previous result, in the formats that follow from their extensions. Unless
+    use_cache is False, the parsed data of a workbook is taken from the snapshot next to it if the files did not change
+    since it was written, and the snapshot is written otherwise. A workbook is parsed with the given number of
+    processes (see ExcelLoader), the default of 1 starts none.
+    """
+    input_format = file_format(file_path)
+    previous_format = file_format(previous) if previous else None
+    use_cache = use_cache and input_format.cached
+    data = data_cache.load_cached(file_path, previous) if use_cache else None
+    if data is not None:
+        print(f"Loaded {file_path} from {data_cache.cache_path(file_path)}")
+        data.validate()
+        return data
+
+    if previous_format is None or previous_format is input_format:
+        data = input_format.loader(file_path, previous, workers).load()
+    else:
+        data = input_format.loader(file_path, None, workers).load()
+        data.previous_result = PreviousResult.from_records(data, previous_format.read_previous_records(previous))
     data.validate()
+    if use_cache:
+        data_cache.store(data, file_path, previous)
     return data
 
 
+def write_result(data: Data, path: str):
+    """Writes the result in the format that follows from the extension of the path"""
+    file_format(path).exporter().export(data, path)
+
+
 def write_to_excel(data: Data, path: str):
     exporter = ExcelExporter()
     exporter.export(data, path)
@@ -0,0 +1,36 @@
+import numpy as np
+
+UNSOLVABLE_PENALTY = 10000
+
+
+def calculate_penalties(assignments: np.ndarray, choices: np.ndarray, reserve: np.ndarray, previous: np.ndarray,
+                        has_previous: np.ndarray, minimize_changes: bool) -> np.ndarray:
+    """
+    Calculates the penalty of many assignments at once, tests/test_penalties.py checks it against a reference written
+    out per student. Row i of assignments (n x periods, -1 for an empty period) belongs to a student with row i of
+    choices (n x periods), reserve (n x reserves), previous (n x periods) and has_previous (n).
+    A single student can be passed with rows of one, these are broadcast over all its assignments.
+    """
+    periods = assignments.shape[1]
+    assignments = assignments[:, :, np.newaxis]
+
+    # the choices that are not assigned cost 3 for the first choice, 2 for the second, etc. counting non-empty choices
+    valid_choices = choices != -1
+    rank = np.cumsum(valid_choices, axis=1) - 1
+    choice_assigned = (assignments == choices[:, np.newaxis, :]).any(axis=1)
+    priority_penalty = (np.where(valid_choices & ~choice_assigned, 3 - rank, 0)).sum(axis=1)
+
+    valid_reserve = reserve != -1
+    reserves_used = (valid_reserve & (assignments == reserve[:, np.newaxis, :]).any(axis=1)).sum(axis=1)
+
+    assigned_count = (assignments[:, :, 0] != -1).sum(axis=1)
+    assignable_count = np.minimum(periods, valid_choices.sum(axis=1) + valid_reserve.sum(axis=1))
+    unsolvable_penalty = (assignable_count - assigned_count) ** 2 * UNSOLVABLE_PENALTY
+
+    penalty = priority_penalty
+    if minimize_changes:
+        # students with a previous result are penalized for each period that changed, instead of by priority
+        changes = ((previous != -1) & (previous != assignments[:, :, 0])).sum(axis=1)
+        penalty = np.where(has_previous, changes, priority_penalty)
+
+    return penalty + reserves_used ** 2 * 10 + unsolvable_penalty
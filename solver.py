@@ -1,19 +1,88 @@
-import itertools
+import multiprocessing
 import os
-from typing import NamedTuple
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor, wait
+from multiprocessing.context import BaseContext
+from typing import Callable, NamedTuple
 
+import numpy as np
 from ortools.sat.python import cp_model
 from ortools.sat.python.cp_model import ObjLinearExprT
 
-from model import Data, ResultRecord, HandledException
+from assignment_cache import AssignmentCache
+import cp_proto
+from capacity_check import CapacityAnalysis, analyse_capacity
+from decomposition import component_data, find_components, group_components
+from delta import affected_students, grow_neighbourhood
+from heuristic import heuristic_solution
+from lns import MIN_NEIGHBOURHOOD_TIME, NEIGHBOURHOOD_TIME, NeighbourhoodPicker, NeighbourhoodSolution, \
+    combine_solutions, initial_solution
+from model import Data, ResultRecord, HandledException, Student
+from penalties import UNSOLVABLE_PENALTY, calculate_penalties
 
-UNSOLVABLE_PENALTY = 10000
+# the last pass, in pass n each student may get up to n empty periods (or more if there are not enough choices)
+MAX_PASS = 4
+# proving infeasibility under assumptions can be much harder than solving a pass, so the core search is time boxed
+CORE_TIME_LIMIT = 10.0
+# the number of conflicts the solver may spend on repairing a hint that does not fit
+HINT_CONFLICT_LIMIT = 10
+TOGETHER_PENALTY = -5
+APART_PENALTY = 5
+
+# Pair (together/apart) formulations:
+# - combinations: a variable per combination of the assignments of both students, only used in the first passes
+#   because the number of combinations grows quadratically with the number of assignments
+# - slots: a variable per (course, period) slot the students can share, linear in courses x periods, used in all passes
+PAIR_MODEL_COMBINATIONS = "combinations"
+PAIR_MODEL_SLOTS = "slots"
+
+# the valid assignments are shared by all solvers in the process, so a recalculation reuses them as well
+ASSIGNMENT_CACHE = AssignmentCache()
 
 
 class Assignment(NamedTuple):
     assignment: tuple[int, ...]
     penalty: int
 
+    # the first solver pass in which this assignment is allowed
+    min_pass: int = 0
+
+
+class SolverOptions(NamedTuple):
+    # number of parallel search workers, 0 lets CP-SAT use all cores
+    workers: int = 0
+
+    # time budget per pass in seconds, deterministic time units in deterministic mode
+    time_per_pass: float = 60.0
+
+    # stop when the gap between the objective and the best bound is at most this fraction of the objective
+    relative_gap: float = 0.0
+
+    # random seed of the search, None for the CP-SAT default
+    seed: int | None = None
+
+    # limit the search by deterministic time instead of wall time, so the same input gives the same result
+    deterministic: bool = False
+
+    # model students with the same choices and previous result, that are in no pair, as one group with a count per
+    # assignment instead of a boolean per student and assignment
+    aggregate: bool = False
+
+    # formulation of the together/apart pairs, PAIR_MODEL_COMBINATIONS or PAIR_MODEL_SLOTS
+    pair_model: str = PAIR_MODEL_COMBINATIONS
+
+    # with a previous result, only solve the students affected by a change of the input again, see delta.py
+    delta: bool = False
+
+    # improve a solution by solving neighbourhoods of students instead of the whole model at once, see lns.py. The time
+    # per pass is then the time budget of the whole search.
+    lns: bool = False
+
+    # only use the greedy heuristic (see heuristic.py), which gives a schedule in seconds even for 10000 students, but
+    # not the best one
+    fast: bool = False
+
 
 class SolverResult(NamedTuple):
     # if False, this assignment is not schedulable, some students can not follow their choices
@@ -30,122 +99,529 @@ class SolverResult(NamedTuple):
     # if not None, another pass can be attempted relaxing constraints
     next_pass: int | None
 
+    # codes of the courses that have too little capacity to give all students their choices
+    oversubscribed: list[str] = []
+
+    # number of students for which the previous result was used as hint
+    hinted_students: int = 0
+
+    # True if the hint is complete and fits the course sizes, which is checked before solving and not taken from what
+    # the solver did with it. Otherwise the solver repairs the hint, see Solver._solve.
+    hint_accepted: bool = False
+
+    # the options used to solve the last pass
+    options: SolverOptions = SolverOptions()
+
+    # objective value and best bound of the last pass, None if no solution was found
+    objective: float | None = None
+    bound: float | None = None
+
+    # relative gap between objective and bound, 0 for an optimal solution
+    gap: float | None = None
+
+    # the number of students that were solved again in a delta solve, the others kept their previous assignment. None
+    # if all students were solved.
+    delta_students: int | None = None
+
+
+class SolverProgress(NamedTuple):
+    solver_pass: int
+
+    # objective value of the best solution so far and the best bound on it, there is no bound in a LNS solve
+    objective: float
+    bound: float | None
+
+    # seconds since the start of the pass
+    wall_time: float
+
+    # number of solutions found in this pass
+    solutions: int
+
+
+ProgressListener = Callable[[SolverProgress], None]
+
+
+class ProgressCallback(cp_model.CpSolverSolutionCallback):
+    """Reports every improving solution of a pass to the progress listener"""
+
+    def __init__(self, solver_pass: int, listener: ProgressListener | None):
+        super().__init__()
+        self.solver_pass = solver_pass
+        self.listener = listener
+        self.solutions = 0
+
+    def on_solution_callback(self):
+        self.solutions += 1
+        if self.listener:
+            self.listener(SolverProgress(
+                solver_pass=self.solver_pass,
+                objective=self.ObjectiveValue(),
+                bound=self.BestObjectiveBound(),
+                wall_time=self.WallTime(),
+                solutions=self.solutions
+            ))
+
+
+class SolverModel:
+    """
+    The CP model with the valid assignments of all passes up to built_pass. When a later pass is needed, the model is
+    extended in place with the assignments of that pass, instead of building a new model.
+    """
+
+    def __init__(self):
+        self.model = cp_model.CpModel()
+
+        # the valid assignments per student
+        self.valid_assignments: list[list[Assignment]] = []
+
+        # (student, assignment index) -> boolean variable that is true if the student gets that assignment
+        self.assignment: dict[tuple[int, int], cp_model.IntVar] = {}
+
+        # solver pass -> literal that must be true for assignments that are only allowed from that pass on
+        self.pass_allowed: dict[int, cp_model.IntVar] = {}
+
+        # the last pass of which the assignments are in the model
+        self.built_pass = -1
+
+        # proto indices of the constraints that get the assignments of later passes added to them
+        self.exactly_one: list[int] = []
+        self.capacity: dict[tuple[int, int], int] = {}
+
+        # student -> (course, period) -> (indicator variable, proto index of its defining constraint), slot pair model
+        self.slots: dict[int, dict[tuple[int, int], tuple[cp_model.IntVar, int]]] = {}
+
+        # (pair index, course, period) of the slots that already have an AND variable, slot pair model
+        self.shared_slots: set[tuple[int, int, int]] = set()
+
+        # (and variable, variable 1, variable 2) of the pair penalties
+        self.and_literals: list[tuple[cp_model.IntVar, cp_model.IntVar, cp_model.IntVar]] = []
+
 
 class Solver:
-    def __init__(self, data: Data, minimize_changes: bool, debug: bool = False):
+    def __init__(self, data: Data, minimize_changes: bool, debug: bool = False,
+                 options: SolverOptions = SolverOptions(), progress_listener: ProgressListener | None = None,
+                 mp_context: BaseContext | None = None):
         self.data = data
         self.minimize_changes = minimize_changes
         self.debug = debug
+        self.options = options
+        self.progress_listener = progress_listener
+        # the context of the processes of a decomposed or LNS solve, the default of the platform if None. Forking is
+        # unsafe in a process with other threads, which then passes threaded_mp_context().
+        self.mp_context = mp_context or multiprocessing.get_context()
+        # set by stop(), possibly from another thread
+        self.stopped = False
+        self.active_solver: cp_model.CpSolver | None = None
+        self.stop_event = None
         self.periods = data.config.periods
         self.courses = data.courses
-        self.students = data.students
+        # the integer representation of the data, students are referred to by their row in it
+        self.instance = data.get_instance()
+        # the number of places per course and period, less than the size for a neighbourhood of a LNS solve
+        self.places = np.repeat(self.instance.sizes[:, np.newaxis], self.periods, axis=1)
+        # in a delta solve, True for the rows of the students that keep their previous assignment
+        self.fixed: np.ndarray | None = None
+        # the current course number per row and period that the fixed students keep, the previous result in a delta
+        # solve. In a LNS neighbourhood the students may keep it, so a neighbourhood always has a solution (the hint).
+        self.current: np.ndarray | None = None
+        self.keep_current = False
+        # the course number per row and period to hint instead of the previous result, the current assignment in a LNS
+        # neighbourhood or the heuristic solution
+        self.hint: np.ndarray | None = None
+        # the solver of the neighbourhood that is solved in this process in a LNS solve
+        self.neighbourhood_solver: Solver | None = None
+        self._init_students()
+        # availability[course][period] is True if the course is given in that period
+        self.availability = tuple(tuple(row) for row in self.instance.availability.tolist())
+        self.assignment_cache = ASSIGNMENT_CACHE
+
+    def _init_students(self):
+        """Determines the students of the model, which depend on the aggregation and the fixed students"""
+        # with aggregation each student represents a group of identical students, otherwise a group of its own
+        self.groups = self._group_identical_students() if self.options.aggregate \
+            else [[student] for student in self.data.students]
+        self.students = [group[0] for group in self.groups]
+        self.student_rows = [self.data.index_of_student(student.name) for student in self.students]
+        self.model_student = {row: i for i, row in enumerate(self.student_rows)}
 
     def solve(self):
-        solver_pass = 0
+        if self.options.fast:
+            return self._solve_fast()
+        if self.options.lns:
+            return self._solve_lns()
+        if self.options.delta and self.minimize_changes and self.data.previous_result:
+            return self._solve_delta()
+        # Groups of students that do not interact are solved in parallel, each as a separate model. With a single
+        # worker no processes are started.
+        total_workers = self.options.workers or os.cpu_count() or 1
+        if total_workers > 1:
+            groups = group_components(find_components(self.data), total_workers)
+            if len(groups) > 1:
+                return self._solve_groups(groups, total_workers)
+        return self._solve_passes()
+
+    def _analyse_capacity(self) -> CapacityAnalysis:
+        """A cheap capacity bound tells which passes can not be feasible, so these do not have to be tried"""
+        analysis = analyse_capacity(self.data, MAX_PASS)
+        if analysis.oversubscribed:
+            print(f"Over-subscribed courses ({analysis.shortage} places short): {', '.join(analysis.oversubscribed)}")
+        if analysis.first_pass is None:
+            raise HandledException("No solution possible, over-subscribed courses: " +
+                                   ", ".join(self.data.get_course_name(code) for code in analysis.oversubscribed))
+        return analysis
+
+    def _solve_passes(self):
+        analysis = self._analyse_capacity()
+        solver_pass = analysis.first_pass
+        # without a previous result, the heuristic gives a schedule to start from. A single search worker follows the
+        # hint and tends to get stuck near it, the portfolio of several workers gains from it.
+        heuristic_hint = not (self.minimize_changes and self.data.previous_result) \
+            and (self.options.workers or os.cpu_count()) != 1
+        solver_model = self._build_model(solver_pass)
         while True:
-            # start_time = time.time()
-            # while time.time() - start_time < 5:
-            #     pass
-
-            result = self._solve(solver_pass)
-            if result.next_pass is None:
-                if result.optimal or result.feasable:
-                    self.data.result = result.result
-                else:
-                    raise HandledException("No solution found")
-                return result
+            if heuristic_hint:
+                # the heuristic of the pass, a later pass leaves the students that are short more periods empty
+                self.hint = self._heuristic_solution(solver_pass)
+            self._extend_model(solver_model, solver_pass)
+            result = self._solve(solver_model, solver_pass)
+            if result.next_pass is None or self.stopped:
+                if not (result.optimal or result.feasable):
+                    print("Stopped before a solution was found" if self.stopped else "No solution found")
+                    return self._heuristic_result(analysis, solver_pass)
+                self.data.result = result.result
+                return result._replace(oversubscribed=analysis.oversubscribed)
             solver_pass = result.next_pass
 
-    def _solve(self, solver_pass: int) -> SolverResult:
-        print(f"Solver pass {solver_pass}")
-        # Generate all valid assignments per student
-        valid_assignments: list[list[Assignment]] = self._create_valid_assignments(solver_pass)
-        # self._print_valid_assignments(valid_assignments)
-        # sys.exit(1)
+    def _solve_delta(self) -> SolverResult:
+        """
+        Solves only the students affected by a change of the input since the previous result (see delta.py), the other
+        students are fixed to their previous assignment. If the free students can not be solved in the first pass with
+        the others fixed, the free students are grown, until all students are free and the problem is solved as usual.
+        With students fixed, the result is only optimal for the free students, so it is not reported as optimal and
+        there is no bound on the objective of the whole problem.
+        """
+        analysis = self._analyse_capacity()
+        solver_pass = analysis.first_pass
+        free = affected_students(self.data, solver_pass)
+        self.current = self.instance.previous
+        while not free.all():
+            print(f"Delta: solving {free.sum()} of {len(free)} students, the others keep their previous assignment")
+            self.fixed = ~free
+            self._init_students()
+            result = self._solve(self._build_model(solver_pass), solver_pass)
+            if result.optimal or result.feasable:
+                self.data.result = result.result
+                return result._replace(optimal=False, feasable=True, bound=None, gap=None,
+                                       oversubscribed=analysis.oversubscribed, delta_students=int(free.sum()))
+            if self.stopped:
+                print("Stopped before a solution was found")
+                result = self._heuristic_result(analysis, solver_pass, np.where(free[:, np.newaxis], -1, self.current))
+                return result._replace(delta_students=int(free.sum()))
+            free = grow_neighbourhood(self.data, free)
+        self.fixed = self.current = None
+        self._init_students()
+        return self._solve_passes()
 
-        model = cp_model.CpModel()
+    def _solve_lns(self) -> SolverResult:
+        """
+        Large neighbourhood search: starts from the previous result (as far as it can be kept) with the other students
+        assigned by the heuristic, and repeatedly solves a neighbourhood of students (see lns.py) with the other
+        students fixed to their current assignment, keeping the improvements. Disjoint neighbourhoods are solved in
+        parallel processes, and their improvements are combined as long as they fit the course sizes. A stop takes
+        effect after the running neighbourhoods. The result is feasible, but not proven optimal, so there is no bound.
+        """
+        analysis = self._analyse_capacity()
+        solver_pass = analysis.first_pass
+        current = self._heuristic_solution(solver_pass, initial_solution(self.data, solver_pass))
+        picker = NeighbourhoodPicker(self.data, self.options.seed)
+        total_workers = self.options.workers or os.cpu_count() or 1
+        parallel = picker.parallel_count(total_workers)
+        options = self.options._replace(workers=max(1, total_workers // parallel), delta=False, lns=False)
+        print(f"LNS: {parallel} neighbourhoods of up to {picker.size} students in parallel, "
+              f"{self.options.time_per_pass}s in total")
 
-        ### Variables ###
+        start = time.perf_counter()
+        deadline = start + self.options.time_per_pass
+        objective = float(self._objective(current))
+        rounds = improvements = 0
+        executor = None
+        if parallel > 1:
+            executor = ProcessPoolExecutor(max_workers=parallel, mp_context=self.mp_context,
+                                           initializer=_init_neighbourhood_worker,
+                                           initargs=(self.data, self.minimize_changes, self.debug))
+        try:
+            # building a neighbourhood takes time as well, so no round is started in the last moment
+            while not self.stopped and time.perf_counter() < deadline - MIN_NEIGHBOURHOOD_TIME:
+                options = options._replace(time_per_pass=min(NEIGHBOURHOOD_TIME, deadline - time.perf_counter()))
+                neighbourhoods = picker.pick(current, parallel)
+                if executor:
+                    futures = [executor.submit(_solve_neighbourhood, neighbourhood.free, current, solver_pass,
+                                               options) for neighbourhood in neighbourhoods]
+                    solutions = [future.result() for future in futures]
+                else:
+                    solutions = [self.solve_neighbourhood(neighbourhood.free, current, solver_pass, options)
+                                 for neighbourhood in neighbourhoods]
+                rounds += 1
+                current, objective, accepted = combine_solutions(self.data, current, objective, solutions)
+                improvements += accepted
+                elapsed = time.perf_counter() - start
+                print(f"LNS round {rounds} ({', '.join(neighbourhood.kind for neighbourhood in neighbourhoods)}): "
+                      f"{accepted} improvement{'' if accepted == 1 else 's'}, penalty {objective} after {elapsed:.1f}s")
+                if accepted and self.progress_listener:
+                    self.progress_listener(SolverProgress(solver_pass=solver_pass, objective=objective, bound=None,
+                                                          wall_time=elapsed, solutions=improvements))
+        finally:
+            if executor:
+                executor.shutdown(cancel_futures=True)
 
-        assignment = {}
-        for student in range(len(self.students)):
-            for index, possible_assignment in enumerate(valid_assignments[student]):
-                assignment[(student, index)] = model.NewBoolVar(
-                    f"student{student}_assignment{index}")
+        print(f"LNS: penalty {objective} after {rounds} rounds and {time.perf_counter() - start:.1f}s")
+        return self._feasible_result(current, objective, solver_pass, analysis)
 
-        print(f"Number of assignment variables: {len(assignment)}")
+    def _solve_fast(self) -> SolverResult:
+        """Solves with the heuristic only, which is fast but not optimal"""
+        analysis = self._analyse_capacity()
+        return self._heuristic_result(analysis, analysis.first_pass)
 
-        ### Constraints ###
+    def _heuristic_result(self, analysis: CapacityAnalysis, solver_pass: int,
+                          current: np.ndarray | None = None) -> SolverResult:
+        """
+        The result of the heuristic, starting from the students with courses in current. Without current, when
+        minimizing changes, the students that can keep their previous assignment start from it, like in a delta solve.
+        """
+        if current is None and self.minimize_changes and self.data.previous_result:
+            current = initial_solution(self.data, solver_pass)
+        courses = self._heuristic_solution(solver_pass, current)
+        objective = float(self._objective(courses))
+        print(f"Heuristic: penalty {objective}")
+        return self._feasible_result(courses, objective, solver_pass, analysis)
 
-        # Each student is assigned to exactly one valid assignment
-        for student in range(len(self.students)):
-            model.AddExactlyOne(
-                [assignment[(student, assignment_index)] for assignment_index in range(len(valid_assignments[student]))]
-            )
+    def _heuristic_solution(self, solver_pass: int, current: np.ndarray | None = None) -> np.ndarray:
+        """The schedule of the heuristic (see heuristic.heuristic_solution) with the places and pairs of this solver"""
+        pairs = [(row1, row2, TOGETHER_PENALTY) for row1, row2 in self.instance.together.tolist()]
+        pairs += [(row1, row2, APART_PENALTY) for row1, row2 in self.instance.apart.tolist()]
+        return heuristic_solution(self.data, solver_pass, self.minimize_changes, self.places, pairs, current,
+                                  seed=self.options.seed)
 
-        # Each course is assigned to at most its size in each period
-        for course in range(len(self.courses)):
-            for period in range(self.periods):
-                # find all assignment variables that assign this course in this period
-                in_assignemnts = []
-                for student in range(len(self.students)):
-                    for index, possible_assignment in enumerate(valid_assignments[student]):
-                        if possible_assignment.assignment[period] == course:
-                            assignment_var = assignment[(student, index)]
-                            in_assignemnts.append(assignment_var)
-                model.Add(sum(in_assignemnts) <= self.courses[course].size)
+    def _feasible_result(self, courses: np.ndarray, objective: float, solver_pass: int,
+                         analysis: CapacityAnalysis) -> SolverResult:
+        """
+        The result of a solution (course number per student and period) that is not found by the model, but by LNS or
+        the heuristic. It is feasible, but not proven optimal, so there is no bound.
+        """
+        penalties = self._penalties(courses)
+        self.data.result = [ResultRecord(student.name, [self.courses[course].code if course >= 0 else ""
+                                                        for course in student_courses], penalty)
+                            for student, student_courses, penalty in zip(self.data.students, courses.tolist(),
+                                                                         penalties)]
+        return SolverResult(
+            schedulable=solver_pass == 0 and all(penalty < UNSOLVABLE_PENALTY for penalty in penalties),
+            optimal=False,
+            feasable=True,
+            result=self.data.result,
+            next_pass=None,
+            oversubscribed=analysis.oversubscribed,
+            options=self.options,
+            objective=objective
+        )
 
-        ### Objective ###
+    def solve_neighbourhood(self, free: np.ndarray, current: np.ndarray, solver_pass: int,
+                            options: SolverOptions) -> NeighbourhoodSolution | None:
+        """
+        Solves the free students (a boolean per row) of a LNS solve, with the other students fixed to their current
+        assignment (course number per row and period). Partners are in the same neighbourhood, so the other students
+        only take places, and the neighbourhood is solved as a model of its own, with the places that are left.
+        Returns None if no solution was found in time.
+        """
+        rows = np.flatnonzero(free)
+        fixed = np.where(free[:, np.newaxis], -1, current)
+        assigned = fixed >= 0
+        occupancy = np.zeros(self.places.shape, dtype=self.places.dtype)
+        np.add.at(occupancy, (fixed[assigned], np.nonzero(assigned)[1]), 1)
 
-        penalty_expressions: list[ObjLinearExprT] = []
-        penalty_weights: list[int] = []
-        for student in range(len(self.students)):
-            for index in range(len(valid_assignments[student])):
-                penalty_expressions.append(assignment[(student, index)])
-                penalty_weights.append(valid_assignments[student][index].penalty)
+        solver = Solver(component_data(self.data, rows.tolist()), self.minimize_changes, self.debug, options)
+        solver.places = self.places - occupancy
+        solver.current = solver.hint = current[rows]
+        solver.keep_current = True
+        self.neighbourhood_solver = solver
+        if self.stopped:
+            solver.stop()
+        try:
+            solver_model = solver._build_model(solver_pass)
+            result = solver._solve(solver_model, solver_pass)
+        finally:
+            self.neighbourhood_solver = None
+        if not (result.optimal or result.feasable):
+            return None
+        # the objective of the current assignment, which is the hint
+        current_objective = cp_proto.hint_objective(solver_model.model)
+        courses = current.copy()
+        courses[rows] = [[self.data.index_of_course(code) if code else -1 for code in record.courses]
+                         for record in result.result]
+        return NeighbourhoodSolution(free, courses, result.objective, current_objective)
 
-        if solver_pass < 2:
-            # Since this can blow up the number of combinations, we only do this in the first passes
-            # We could base this decision on the number of parameters or time it took in the previous pass
-            (c_expr, c_weights) = self._calculate_combination_penalties(model, valid_assignments, assignment)
-            penalty_expressions += c_expr
-            penalty_weights += c_weights
+    def _penalties(self, courses: np.ndarray) -> list[int]:
+        """The penalty of the assignment (course number per period) of each student"""
+        instance = self.instance
+        return calculate_penalties(courses, instance.choices[:, :self.periods], instance.choices[:, self.periods:],
+                                   instance.previous, instance.has_previous, self.minimize_changes).tolist()
 
-        print(f"Number of penalty expressions: {len(penalty_expressions)}")
-        model.Minimize(cp_model.LinearExpr.weighted_sum(penalty_expressions, penalty_weights))
+    def _objective(self, courses: np.ndarray) -> int:
+        """
+        The objective of a solution (course number per student and period) like the model calculates it: the penalties
+        of the students plus the penalty of each pair for each course period they share. The combination pair model
+        leaves out the pairs of the assignments of later passes, which is not taken into account.
+        """
+        objective = sum(self._penalties(courses))
+        for (student1, student2), penalty in self._pairs_with_penalty():
+            courses1, courses2 = courses[self.student_rows[student1]], courses[self.student_rows[student2]]
+            objective += penalty * int(((courses1 == courses2) & (courses1 >= 0)).sum())
+        return objective
 
-        ### Hints or Assumptions ###
+    def _solve_groups(self, groups: list[list[int]], total_workers: int) -> SolverResult:
+        """
+        Solves each group in its own process and merges the results. The workers are divided over the groups, progress
+        is combined over the groups and a stop is forwarded to all of them.
+        """
+        print(f"Solving {len(groups)} independent groups of {', '.join(str(len(group)) for group in groups)} students")
+        options = self.options._replace(workers=max(1, total_workers // len(groups)))
+        start_time = time.time()
+        with self.mp_context.Manager() as manager, \
+                ProcessPoolExecutor(max_workers=len(groups), mp_context=self.mp_context) as executor:
+            progress_queue = manager.Queue()
+            self.stop_event = manager.Event()
+            if self.stopped:
+                self.stop_event.set()
+            futures = [executor.submit(_solve_group, component_data(self.data, group), self.minimize_changes,
+                                       self.debug, options, group_nr, progress_queue,
+                                       self.stop_event)
+                       for group_nr, group in enumerate(groups)]
+            latest: dict[int, SolverProgress] = {}
+            failure = None
+            while not all(future.done() for future in futures):
+                wait(futures, timeout=0.1)
+                if failure is None:
+                    failure = next((future.exception() for future in futures
+                                    if future.done() and future.exception()), None)
+                    if failure:
+                        # the result can not be complete anymore, the other groups are stopped
+                        self.stop_event.set()
+                while not progress_queue.empty():
+                    group_nr, progress = progress_queue.get()
+                    latest[group_nr] = progress
+                    if self.progress_listener:
+                        self.progress_listener(SolverProgress(
+                            solver_pass=max(p.solver_pass for p in latest.values()),
+                            objective=sum(p.objective for p in latest.values()),
+                            bound=sum(p.bound for p in latest.values()),
+                            wall_time=time.time() - start_time,
+                            solutions=sum(p.solutions for p in latest.values())
+                        ))
+            self.stop_event = None
+            if failure is None:
+                failure = next((future.exception() for future in futures if future.exception()), None)
+            if failure:
+                raise failure
+            results = [future.result() for future in futures]
 
-        # if self.minimize_changes and self.data.previous_result:
-        #     # Unfortunately, hints do not seem to have effect while assumptions seem to result in suboptimal solutions
-        #     self._add_hints(assignment, model, valid_assignments)
+        records = {record.student: record for result in results for record in result.result}
+        result = [records[student.name] for student in self.data.students]
+        self.data.result = result
+        optimal = all(r.optimal for r in results)
+        objective = sum(r.objective for r in results)
+        # a group that fell back on the heuristic has no bound
+        bound = None if any(r.bound is None for r in results) else sum(r.bound for r in results)
+        return SolverResult(
+            schedulable=all(r.schedulable for r in results),
+            optimal=optimal,
+            feasable=not optimal,
+            result=result,
+            next_pass=None,
+            oversubscribed=list(dict.fromkeys(code for r in results for code in r.oversubscribed)),
+            hinted_students=sum(r.hinted_students for r in results),
+            hint_accepted=all(r.hint_accepted for r in results),
+            options=self.options,
+            objective=objective,
+            bound=bound,
+            gap=None if bound is None else abs(objective - bound) / max(abs(objective), 1.0)
+        )
+
+    def stop(self):
+        """Stops the search, solve() returns the best solution found so far. Can be called from another thread."""
+        self.stopped = True
+        neighbourhood_solver = self.neighbourhood_solver
+        if neighbourhood_solver:
+            neighbourhood_solver.stop()
+        solver = self.active_solver
+        if solver:
+            solver.StopSearch()
+        stop_event = self.stop_event
+        if stop_event:
+            stop_event.set()
+
+    def _solve(self, solver_model: SolverModel, solver_pass: int) -> SolverResult:
+        print(f"Solver pass {solver_pass}")
+        model = solver_model.model
+
+        # The model may contain the assignments of later passes, these are disabled by fixing their literal to false.
+        # Unlike assumptions, fixed literals allow presolve to remove the disabled assignments.
+        for p, literal in solver_model.pass_allowed.items():
+            cp_proto.set_domain(model, literal, 0, 0 if p > solver_pass else 1)
+
+        ### Hints ###
+
+        hinted_students = 0
+        hint_accepted = False
+        hinted = self.hint is not None or bool(self.minimize_changes and self.data.previous_result)
+        if hinted:
+            hinted_students, hint_accepted = self._add_hints(solver_model, solver_pass)
 
         ### Solve ###
 
         solver = cp_model.CpSolver()
-        solver.parameters.max_time_in_seconds = 60.0
+        self._apply_options(solver, self.options.time_per_pass)
+        if hinted and not hint_accepted:
+            # let the solver repair a partial or infeasible hint, instead of dropping it at the first conflict.
+            # Repairing a hint that is far from feasible can take longer than not hinting at all, so it is time boxed.
+            solver.parameters.repair_hint = True
+            solver.parameters.hint_conflict_limit = HINT_CONFLICT_LIMIT
         log_file = None
         if self.debug:
             path = os.path.join("logs", f"search_progress_{solver_pass}.txt")
             os.makedirs(os.path.dirname(path), exist_ok=True)
-            log_file = open(f"search_progress_{solver_pass}.txt", "w")
+            log_file = open(path, "w")
             solver.log_callback = lambda x: log_file.write(x + "\n")
             solver.parameters.log_search_progress = True
             solver.parameters.log_to_stdout = False
 
-        status = solver.Solve(model)
+        callback = ProgressCallback(solver_pass, self.progress_listener)
+        self.active_solver = solver
+        # a stop before the search leaves no solution, like a stop before the first solution
+        status = cp_model.UNKNOWN if self.stopped else solver.Solve(model, callback)
+        self.active_solver = None
         solved = False
         result = []
+        objective = bound = gap = None
+        next_pass = solver_pass + 1 if solver_pass < MAX_PASS else None
         if status == cp_model.OPTIMAL or status == cp_model.FEASIBLE:
-            penalty = solver.ObjectiveValue()
-            result = self._get_result(solver, valid_assignments, assignment)
+            objective = solver.ObjectiveValue()
+            bound = solver.BestObjectiveBound()
+            gap = abs(objective - bound) / max(abs(objective), 1.0)
+            result = self._get_result(solver, solver_model.valid_assignments, solver_model.assignment)
             result_type = "optimal" if status == cp_model.OPTIMAL else "feasible"
-            print(f"{result_type} solution found. Penalty: {penalty}")
+            print(f"{result_type} solution found. Penalty: {objective}, bound: {bound}, gap: {gap:.2%}")
             solved = True
+            next_pass = None
+        elif status == cp_model.INFEASIBLE and self.fixed is not None:
+            # a delta solve grows the free students instead of relaxing the pass
+            next_pass = None
+            print("No solution possible with the fixed students")
+        elif status == cp_model.INFEASIBLE:
+            next_pass = self._next_feasible_pass(solver_model, solver_pass)
+            print(f"No solution possible, next pass is {next_pass}")
         else:
             print(f"No solution found, solver status is {status}")
 
-        print(f"Time to solve: {solver.WallTime():.2f}s")
+        print(f"Time to solve: {solver.WallTime():.2f}s, {callback.solutions} solutions")
         if log_file:
             log_file.close()
         return SolverResult(
@@ -153,143 +629,420 @@ class Solver:
             optimal=status == cp_model.OPTIMAL,
             feasable=status == cp_model.FEASIBLE,
             result=result,
-            next_pass=solver_pass + 1 if (not solved and solver_pass < 4) else None
+            next_pass=next_pass,
+            hinted_students=hinted_students,
+            hint_accepted=hint_accepted,
+            options=self.options,
+            objective=objective,
+            bound=bound,
+            gap=gap
         )
 
-    def _add_hints(self, assignment, model, valid_assignments):
-        reference_result = self.data.previous_result
-        for student_nr, student in enumerate(self.students):
-            # find matching record in reference result
-            reference_record = next((record for record in reference_result if record.student == student.name), None)
-            if reference_record:
-                # convert reference result to course numbers
-                reference_courses = [self._course_number(course) for course in reference_record.courses]
-                # find matching assignment
-                matching_index = None
-                for index, possible_assignment in enumerate(valid_assignments[student_nr]):
-                    if possible_assignment.assignment == tuple(reference_courses):
-                        matching_index = index
-                        break
-                if matching_index is not None:
-                    for index, possible_assignment in enumerate(valid_assignments[student_nr]):
-                        var = assignment[(student_nr, index)]
-                        model.AddAssumption(var if index == matching_index else var.Not())
+    def _apply_options(self, solver: cp_model.CpSolver, time_limit: float):
+        parameters = solver.parameters
+        if self.options.workers > 0:
+            parameters.num_workers = self.options.workers
+        if self.options.deterministic:
+            parameters.max_deterministic_time = time_limit
+            # interleaving the workers in a single thread makes the parallel search reproducible
+            parameters.interleave_search = True
+        else:
+            parameters.max_time_in_seconds = time_limit
+        if self.options.relative_gap > 0:
+            parameters.relative_gap_limit = self.options.relative_gap
+        if self.options.seed is not None:
+            parameters.random_seed = self.options.seed
+        if self.keep_current:
+            # probing takes most of the presolve of a LNS neighbourhood, which is small and solved many times
+            parameters.cp_model_probing_level = 0
+
+    def _next_feasible_pass(self, solver_model: SolverModel, solver_pass: int) -> int | None:
+        """
+        Determines the first pass after an infeasible pass that may be feasible. The model is extended with all passes,
+        and a copy of it without objective is solved with the literals of the later passes assumed false. Each pass up
+        to the lowest pass in the infeasibility core would still include all assumptions of the core, so these passes
+        can be skipped. If the core contains no assumptions, the model is infeasible in every pass. If no core is found
+        in time, the next pass is simply the following one.
+        """
+        self._extend_model(solver_model, MAX_PASS)
+        model = solver_model.model.Clone()
+        cp_proto.clear_objective(model)
+        for literal in solver_model.pass_allowed.values():
+            cp_proto.set_domain(model, literal, 0, 1)
+        model.AddAssumptions([literal.Not() for p, literal in solver_model.pass_allowed.items() if p > solver_pass])
+
+        solver = cp_model.CpSolver()
+        self._apply_options(solver, min(CORE_TIME_LIMIT, self.options.time_per_pass))
+        self.active_solver = solver
+        status = solver.Solve(model)
+        self.active_solver = None
+        if status != cp_model.INFEASIBLE:
+            return solver_pass + 1 if solver_pass < MAX_PASS else None
+
+        pass_of_assumption = {literal.Not().Index(): p for p, literal in solver_model.pass_allowed.items()}
+        core_passes = [pass_of_assumption[index] for index in solver.SufficientAssumptionsForInfeasibility()
+                       if index in pass_of_assumption]
+        return min(core_passes) if core_passes else None
+
+    def _build_model(self, solver_pass: int) -> SolverModel:
+        solver_model = SolverModel()
+        self._extend_model(solver_model, solver_pass)
+        return solver_model
+
+    def _extend_model(self, solver_model: SolverModel, solver_pass: int):
+        """
+        Adds the valid assignments of the passes after solver_model.built_pass up to solver_pass to the model, with
+        their variables, constraints and penalties.
+        """
+        if solver_pass <= solver_model.built_pass:
+            return
+
+        # Generate all valid assignments per student, only the ones of the new passes are added
+        valid_assignments: list[list[Assignment]] = self._create_valid_assignments(solver_pass)
+        # self._print_valid_assignments(valid_assignments)
+        # sys.exit(1)
+
+        model = solver_model.model
+        assignment = solver_model.assignment
+
+        ### Variables ###
+
+        # index of the first new assignment per student
+        first_new = []
+        # inverted index: (course, period) -> all new assignment variables that assign the course in that period
+        in_course_period: dict[tuple[int, int], list[cp_model.IntVar]] = {}
+        in_pass: dict[int, list[cp_model.IntVar]] = {}
+        penalty_vars: list[int] = []
+        penalty_weights: list[int] = []
+        for student in range(len(self.students)):
+            if student == len(solver_model.valid_assignments):
+                solver_model.valid_assignments.append([])
+            student_assignments = solver_model.valid_assignments[student]
+            first_new.append(len(student_assignments))
+            for possible_assignment in valid_assignments[student]:
+                if possible_assignment.min_pass <= solver_model.built_pass:
+                    continue
+                index = len(student_assignments)
+                student_assignments.append(possible_assignment)
+                count = len(self.groups[student])
+                var = model.NewIntVar(0, count, f"student{student}_assignment{index}") if count > 1 \
+                    else model.NewBoolVar(f"student{student}_assignment{index}")
+                assignment[(student, index)] = var
+                penalty_vars.append(var.Index())
+                penalty_weights.append(possible_assignment.penalty)
+                for period, course in enumerate(possible_assignment.assignment):
+                    if course >= 0:
+                        in_course_period.setdefault((course, period), []).append(var)
+                if possible_assignment.min_pass > 0:
+                    in_pass.setdefault(possible_assignment.min_pass, []).append(var)
+
+        print(f"Number of assignment variables: {len(assignment)}")
+
+        # Assignments of later passes are only allowed if the literal of their pass is true
+        for p in range(max(solver_model.built_pass + 1, 1), solver_pass + 1):
+            solver_model.pass_allowed[p] = model.NewBoolVar(f"pass{p}_allowed")
+            if p in in_pass:
+                cp_proto.add_linear(model, in_pass[p], [1] * len(in_pass[p]), 0, 0, solver_model.pass_allowed[p].Not())
+
+        ### Constraints ###
+
+        # Each student is assigned to exactly one valid assignment, a group of n students to n assignments in total
+        for student in range(len(self.students)):
+            new_vars = [assignment[(student, index)]
+                        for index in range(first_new[student], len(solver_model.valid_assignments[student]))]
+            count = len(self.groups[student])
+            if student == len(solver_model.exactly_one):
+                solver_model.exactly_one.append(cp_proto.add_linear(model, [], [], count, count) if count > 1
+                                                else cp_proto.add_exactly_one(model))
+            if count > 1:
+                cp_proto.extend_linear(model, solver_model.exactly_one[student], new_vars, [1] * len(new_vars))
+            else:
+                cp_proto.extend_exactly_one(model, solver_model.exactly_one[student], new_vars)
+
+        # Each course is assigned to at most its size in each period
+        for course in range(len(self.courses)):
+            for period in range(self.periods):
+                in_assignments = in_course_period.get((course, period))
+                if not in_assignments:
+                    continue
+                if (course, period) in solver_model.capacity:
+                    cp_proto.extend_linear(model, solver_model.capacity[(course, period)], in_assignments,
+                                           [1] * len(in_assignments))
+                else:
+                    solver_model.capacity[(course, period)] = cp_proto.add_linear(
+                        model, in_assignments, [1] * len(in_assignments), cp_model.INT_MIN,
+                        int(self.places[course, period]))
+
+        ### Objective ###
+
+        if self.options.pair_model == PAIR_MODEL_SLOTS:
+            (c_expr, c_weights) = self._calculate_slot_penalties(solver_model, first_new)
+        else:
+            # Since this can blow up the number of combinations, we only do this for the assignments of the first passes
+            # We could base this decision on the number of parameters or time it took in the previous pass
+            (c_expr, c_weights) = self._calculate_combination_penalties(solver_model, first_new, max_pass=1)
+        penalty_vars += [var.Index() for var in c_expr]
+        penalty_weights += c_weights
+
+        print(f"Number of penalty expressions: {cp_proto.objective_size(model) + len(penalty_vars)}")
+        # minimize the sum of the penalties
+        cp_proto.extend_objective(model, penalty_vars, penalty_weights)
+
+        solver_model.built_pass = solver_pass
+
+    def _add_hints(self, solver_model: SolverModel, solver_pass: int) -> tuple[int, bool]:
+        """
+        Hints the previous result (or Solver.hint: the heuristic solution or the current assignment of a LNS
+        neighbourhood) to the solver. Each student gets its previous assignment if that is allowed in this pass,
+        otherwise the allowed assignment with the lowest penalty (the fewest changes), and all other assignments are
+        hinted as zero. A student whose assignment in Solver.hint is not allowed (a student the heuristic could only
+        partly place) gets all assignments hinted as zero instead, as the substitute would ignore the course sizes the
+        hint respects. The other variables only depend on the assignments, so they are derived to make the hint
+        complete. Only a complete hint that also fits the course sizes can be used as the first solution as is.
+
+        Returns the number of students that got their previous assignment as hint and whether the hint is feasible.
+        """
+        valid_assignments = solver_model.valid_assignments
+        values: dict[int, int] = {}
+        hinted_assignments: list[tuple[int, ...] | None] = []
+        # students whose hint is used as is, and whether every student got an assignment
+        matched = 0
+        all_assigned = True
+        for student_nr in range(len(self.students)):
+            allowed = [index for index, possible_assignment in enumerate(valid_assignments[student_nr])
+                       if possible_assignment.min_pass <= solver_pass]
+            if not allowed:
+                hinted_assignments.append(None)
+                continue
+
+            previous = self._hint_course_numbers(student_nr)
+            hinted = None
+            if previous:
+                hinted = next((index for index in allowed
+                               if valid_assignments[student_nr][index].assignment == tuple(previous)), None)
+            count = len(self.groups[student_nr])
+            if hinted is not None:
+                matched += count
+            elif self.hint is None:
+                hinted = min(allowed, key=lambda index: valid_assignments[student_nr][index].penalty)
+            else:
+                all_assigned = False
+            hinted_assignments.append(valid_assignments[student_nr][hinted].assignment if hinted is not None else None)
+
+            for index in range(len(valid_assignments[student_nr])):
+                values[solver_model.assignment[(student_nr, index)].Index()] = count if index == hinted else 0
+
+        # derived variables
+        for p, literal in solver_model.pass_allowed.items():
+            values[literal.Index()] = 1 if p <= solver_pass else 0
+        for student_nr, slots in solver_model.slots.items():
+            hinted_assignment = hinted_assignments[student_nr]
+            for (course, period), (var, _) in slots.items():
+                values[var.Index()] = 1 if hinted_assignment and hinted_assignment[period] == course else 0
+        for var1and2, var1, var2 in solver_model.and_literals:
+            values[var1and2.Index()] = values.get(var1.Index(), 0) & values.get(var2.Index(), 0)
+
+        # the hint is feasible if every student got an assignment and the course sizes are respected
+        occupancy: dict[tuple[int, int], int] = {}
+        for student_nr, hinted_assignment in enumerate(hinted_assignments):
+            for period, course in enumerate(hinted_assignment or ()):
+                if course >= 0:
+                    occupancy[(course, period)] = occupancy.get((course, period), 0) + len(self.groups[student_nr])
+        complete = all_assigned and len(values) == cp_proto.variable_count(solver_model.model)
+        fits = all(count <= self.places[course, period] for (course, period), count in occupancy.items())
+        hint_accepted = complete and fits
+
+        cp_proto.set_hint(solver_model.model, list(values.keys()), list(values.values()))
+        print(f"Hint: {'previous' if self.hint is None else 'given'} assignment of {matched} of "
+              f"{len(self.data.students)} students, {'feasible' if hint_accepted else 'not feasible'}")
+        return matched if self.hint is None else 0, hint_accepted
+
+    def _group_identical_students(self) -> list[list[Student]]:
+        """
+        Groups the students with the same choices and the same previous result (that are both fixed or both free in a
+        delta solve, and have the same current assignment in a LNS neighbourhood), these have the same valid
+        assignments with the same penalties. Students in a together/apart pair have penalties of their own and are not
+        grouped.
+        """
+        paired = {name for pair in self.data.config.together + self.data.config.apart for name in pair}
+        groups: dict[tuple, list[Student]] = {}
+        for row, student in enumerate(self.data.students):
+            if student.name in paired:
+                key = (student.name,)
+            else:
+                fixed = self.fixed is not None and bool(self.fixed[row])
+                current = tuple(self.current[row].tolist()) if self.keep_current else None
+                key = (tuple(student.choices), self.data.get_previous_result(student.name), fixed, current)
+            groups.setdefault(key, []).append(student)
+        print(f"Grouped {len(self.data.students)} students into {len(groups)} groups of identical students")
+        return list(groups.values())
 
     def _create_valid_assignments(self, solver_pass: int) -> list[list[Assignment]]:
         """
-        Returns the valid assignments per student
+        Returns the valid assignments per student. The assignments only depend on the choices, the availability of the
+        chosen courses, the number of empty periods allowed and the penalty mode, so they are cached under those and
+        shared by identical students and later passes. The assignments that are not cached are generated first, so
+        their penalties can be calculated in one batch.
         """
-        result: list[list[Assignment]] = []
-        for student_nr, student in enumerate(self.students):
-            # generate all permutations of the requested course numbers (including reserves)
-            course_names = student.choices
-            course_numbers = [self._course_number(course_name) for course_name in course_names]
-            valid_assignments: list[Assignment] = []
+        keys: list[tuple] = []
+        # student -> key of the current assignment, for the students of a LNS neighbourhood
+        current_keys: dict[int, tuple] = {}
+        found: dict[tuple, list[Assignment]] = {}
+        # key -> (row of a student with this key, needed empty slots, generated assignments)
+        missing: dict[tuple, tuple[int, int, list[tuple[int, ...]]]] = {}
+        hits = misses = 0
+        for student_nr, row in enumerate(self.student_rows):
+            # the requested course numbers (including reserves)
+            course_numbers = self.instance.choices[row, :self.instance.choice_counts[row]].tolist()
 
             # just extend the list with -1's up to the number of periods
             course_numbers += [-1] * (self.periods - len(course_numbers))
+            # assignments with up to this number of empty periods are allowed from the first pass on, assignments with
+            # more empty periods from the pass that allows that number of empty periods
+            needed_empty_slots = course_numbers.count(-1)
+            # there are at least 'solver_pass' empty slots
+            empty_slots = max(needed_empty_slots, solver_pass)
 
-            # ensure that there are at least 'solver_pass' -1 elements in the list
-            course_numbers += [-1] * (solver_pass - course_numbers.count(-1))
-
-            for permutation in itertools.permutations(course_numbers, self.periods):
-                if self._is_valid_assignment(permutation):
-                    penalty = self._calculate_penalty(permutation, course_numbers[:self.periods],
-                                                      course_numbers[self.periods:], student.name)
-                    valid_assignments.append(Assignment(permutation, penalty))
-
-            # Remove duplicates (may happen because of the -1's)
-            valid_assignments = list({assignment: None for assignment in valid_assignments})
+            courses = list(dict.fromkeys(course for course in course_numbers if course >= 0))
+            previous = self._previous_course_numbers(student_nr) if self.minimize_changes else None
+            fixed = self.fixed is not None and self.fixed[row]
+            if fixed or self.keep_current:
+                # a fixed student only gets its current assignment, in every pass, which is not worth caching. In a LNS
+                # neighbourhood the current assignment is added to the valid assignments after generating.
+                current = tuple(self.current[row].tolist())
+                current_key = ("current", tuple(course_numbers), previous, current)
+                if current_key not in missing:
+                    missing[current_key] = (row, self.periods, [current])
+                if fixed:
+                    keys.append(current_key)
+                    continue
+                current_keys[student_nr] = current_key
+            key = (tuple(course_numbers), tuple(self.availability[course] for course in courses), empty_slots,
+                   self.periods, "changes" if previous else "priority", previous)
+            keys.append(key)
+            if key in found or key in missing:
+                hits += 1
+                continue
+            cached = self.assignment_cache.get(key)
+            if cached is not None:
+                hits += 1
+                found[key] = cached
+            else:
+                misses += 1
+                missing[key] = (row, needed_empty_slots, list(self._generate_assignments(courses, empty_slots)))
 
             # For testing the stability of our algorithm, shuffle the valid assignments
             # import random
-            # random.shuffle(valid_assignments)
-
-            result.append(valid_assignments)
-        return result
-
-    def _is_valid_assignment(self, assignment: tuple[int, ...]):
-        # check if all courses are available in the requested periods
-        for period, course in enumerate(assignment):
-            if course >= 0 and not self.courses[course].availability[period]:
-                return False
-        # check if there are no duplicates
-        courses = [course for course in assignment if course >= 0]
-        if len(set(courses)) < len(courses):
-            return False
-        return True
-
-    def _calculate_penalty(self, assignment: tuple[int, ...], choices: list[int], reserve: list[int],
-                           student_name: str):
-        if self.minimize_changes:
-            return self._calculate_penalty_minimizing_changes(assignment, choices, reserve, student_name)
-        else:
-            return self._calculate_penalty_preferring_priority(assignment, choices, reserve)
-
-    def _calculate_penalty_minimizing_changes(self, assignment: tuple[int, ...], choices: list[int],
-                                              reserve: list[int], student_name: str):
-        prev_course_names = self.data.get_previous_result(student_name)
-        if not prev_course_names:
-            return self._calculate_penalty_preferring_priority(assignment, choices, reserve)
-
-        prev_course_numbers = [self._course_number(course_name) for course_name in prev_course_names]
-        penalty = 0
-        reserves_used = 0
-        for idx, prev_course_number in enumerate(prev_course_numbers):
-            if prev_course_number != -1 and prev_course_number != assignment[idx]:
-                penalty += 1
-
-        for course in reserve:
-            if course != -1 and course in assignment:
-                reserves_used += 1
-
-        return penalty + reserves_used ** 2 * 10 + self.unsolvable_penalty(assignment, choices, reserve)
-
-    def _calculate_penalty_preferring_priority(self, assignment: tuple[int, ...], choices: list[int],
-                                               reserve: list[int]):
-        penalty = 0
-        reserves_used = 0
-
-        # filter empty choices
-        ordered_choices = [course for course in choices if course != -1]
-
-        for i, course in enumerate(ordered_choices):
-            if course not in assignment:
-                penalty += 3 - i  # 3 if the first choice is not assigned, 2 if the second, etc.
-
-        for course in reserve:
-            if course != -1 and course in assignment:
-                reserves_used += 1
-
-        return penalty + reserves_used ** 2 * 10 + self.unsolvable_penalty(assignment, choices, reserve)
-
-    def unsolvable_penalty(self, assignment: tuple[int, ...], choices: list[int], reserve: list[int]):
-        assigned_count = len([course for course in assignment if course != -1])
-        choice_count = len([course for course in choices if course != -1]) + len(
-            [course for course in reserve if course != -1])
-        assignable_count = min(self.periods, choice_count)
-        # short = choice_count - assigned_count if choice_count > assigned_count else 0
-        short = assignable_count - assigned_count
-        return short ** 2 * UNSOLVABLE_PENALTY
-
-    def _calculate_combination_penalties(self, model, valid_assignments: list[list[Assignment]], assignment) -> tuple[
-        list[ObjLinearExprT], list[int]]:
+            # random.shuffle(missing[key][2])
+
+        if missing:
+            # one row per assignment, with the choices, reserves and previous result of its student
+            generated = [assignments for _, _, assignments in missing.values()]
+            counts = [len(assignments) for assignments in generated]
+            owner = np.repeat(np.array([row for row, _, _ in missing.values()], dtype=np.int64), counts)
+            all_assignments = np.array([assignment for assignments in generated for assignment in assignments],
+                                       dtype=np.int16).reshape(-1, self.periods)
+            instance = self.instance
+            penalties = calculate_penalties(all_assignments, instance.choices[owner, :self.periods],
+                                            instance.choices[owner, self.periods:], instance.previous[owner],
+                                            instance.has_previous[owner], self.minimize_changes).tolist()
+            empty = (all_assignments == -1).sum(axis=1)
+            needed = np.repeat([needed_empty for _, needed_empty, _ in missing.values()], counts)
+            min_passes = np.where(empty <= needed, 0, empty).tolist()
+
+            start = 0
+            for key, assignments in zip(missing, generated):
+                end = start + len(assignments)
+                found[key] = list(map(Assignment, assignments, penalties[start:end], min_passes[start:end]))
+                if key[0] != "current":
+                    self.assignment_cache.put(key, found[key])
+                start = end
+
+        print(f"Assignment cache: {hits} hits, {misses} misses ({len(self.assignment_cache)} cached students)")
+        valid_assignments = [found[key] for key in keys]
+        for student_nr, current_key in current_keys.items():
+            current = found[current_key][0]
+            if all(possible_assignment.assignment != current.assignment
+                   for possible_assignment in valid_assignments[student_nr]):
+                # the cached list is shared, so it is copied
+                valid_assignments[student_nr] = valid_assignments[student_nr] + [current]
+        return valid_assignments
+
+    def _generate_assignments(self, courses: list[int], empty_slots: int):
+        """
+        Generates all valid assignments of the given (distinct) courses to the periods, period by period. A period can
+        only get a course that is available in that period, or be left empty as long as there are empty slots left.
+        Assignments are generated in the same order as the (deduplicated) permutations of the courses followed by the
+        empty slots, without ever generating a duplicate.
+        """
+        periods = self.periods
+        available = self.availability
+        current = [-1] * periods
+        used = [False] * len(courses)
+
+        def place(period: int, free_courses: int, empty_left: int):
+            if period == periods:
+                yield tuple(current)
+                return
+            # prune branches that can not fill the remaining periods anymore
+            if periods - period > free_courses + empty_left:
+                return
+            for i, course in enumerate(courses):
+                if not used[i] and available[course][period]:
+                    used[i] = True
+                    current[period] = course
+                    yield from place(period + 1, free_courses - 1, empty_left)
+                    used[i] = False
+            if empty_left > 0:
+                current[period] = -1
+                yield from place(period + 1, free_courses, empty_left - 1)
+
+        return place(0, len(courses), empty_slots)
+
+    def _hint_course_numbers(self, student_nr: int) -> tuple[int, ...] | None:
+        """The course number per period to hint for the student, the previous result unless another hint is set"""
+        if self.hint is not None:
+            return tuple(self.hint[self.student_rows[student_nr]].tolist())
+        return self._previous_course_numbers(student_nr)
+
+    def _previous_course_numbers(self, student_nr: int) -> tuple[int, ...] | None:
+        """The course number per period in the previous result of the student, None if there is none"""
+        return self.data.get_previous_result(self.data.students[self.student_rows[student_nr]].name)
+
+    def _pairs_with_penalty(self) -> list[tuple[list[int], int]]:
+        """The pairs as model student numbers, with their penalty"""
+        pairs_with_penalty = []
+        for pair in self.instance.together.tolist():
+            pairs_with_penalty.append(([self.model_student[row] for row in pair], TOGETHER_PENALTY))
+        for pair in self.instance.apart.tolist():
+            pairs_with_penalty.append(([self.model_student[row] for row in pair], APART_PENALTY))
+        return pairs_with_penalty
+
+    def _calculate_combination_penalties(self, solver_model: SolverModel, first_new: list[int],
+                                         max_pass: int = MAX_PASS) -> tuple[list[ObjLinearExprT], list[int]]:
+        """
+        Adds a penalty (or bonus) for each combination of assignments of the students in a pair that share a course in
+        the same period. Only assignments allowed up to max_pass are combined, and only combinations with at least one
+        new assignment (from index first_new[student] on) are added.
+        """
+        model = solver_model.model
+        valid_assignments = solver_model.valid_assignments
+        assignment = solver_model.assignment
         c_expr: list[ObjLinearExprT] = []
         c_weights: list[int] = []
 
-        pairs_with_penalty = []
-        for pair in self.data.config.together:
-            pairs_with_penalty.append((pair, -5))
-        for pair in self.data.config.apart:
-            pairs_with_penalty.append((pair, 5))
-
-        for pair_with_penalty in pairs_with_penalty:
-            friend1_idx = self.data.index_of_student(pair_with_penalty[0][0])
-            friend2_idx = self.data.index_of_student(pair_with_penalty[0][1])
+        for pair_with_penalty in self._pairs_with_penalty():
+            friend1_idx, friend2_idx = pair_with_penalty[0]
             prefix = f"comb_{friend1_idx}_{friend2_idx}"
 
             for assignment1_index in range(len(valid_assignments[friend1_idx])):
-                for assignment2_index in range(len(valid_assignments[friend2_idx])):
+                if valid_assignments[friend1_idx][assignment1_index].min_pass > max_pass:
+                    continue
+                # if the first assignment is not new, only combine with the new assignments of the second student
+                start2 = 0 if assignment1_index >= first_new[friend1_idx] else first_new[friend2_idx]
+                for assignment2_index in range(start2, len(valid_assignments[friend2_idx])):
+                    if valid_assignments[friend2_idx][assignment2_index].min_pass > max_pass:
+                        continue
                     # for each course which is the same in each period, subtract 10 from the penalty (a bonus)
                     assignment1 = valid_assignments[friend1_idx][assignment1_index].assignment
                     assignment2 = valid_assignments[friend2_idx][assignment2_index].assignment
@@ -304,40 +1057,130 @@ class Solver:
                         var1and2 = model.NewBoolVar(f"{prefix}_{assignment1_index}_{assignment2_index}")
                         model.AddBoolAnd([var1, var2]).only_enforce_if(var1and2)
                         model.AddBoolOr([var1.Not(), var2.Not()]).only_enforce_if(var1and2.Not())
+                        solver_model.and_literals.append((var1and2, var1, var2))
                         c_expr.append(var1and2)
                         c_weights.append(together_penalty)
 
         return c_expr, c_weights
 
+    def _calculate_slot_penalties(self, solver_model: SolverModel, first_new: list[int]) -> tuple[
+        list[ObjLinearExprT], list[int]]:
+        """
+        Alternative for _calculate_combination_penalties. Each student in a pair gets an indicator variable per
+        (course, period) slot that is true if the student is assigned to that course in that period. The pair gets a
+        penalty (or bonus) for each slot both students are assigned to, which needs one AND per slot they can share.
+        The new assignments (from index first_new[student] on) are added to the indicators, creating new indicators
+        and ANDs for slots that were not possible before.
+        """
+        model = solver_model.model
+        valid_assignments = solver_model.valid_assignments
+        assignment = solver_model.assignment
+        c_expr: list[ObjLinearExprT] = []
+        c_weights: list[int] = []
+        updated: set[int] = set()
+
+        def student_slots(student_idx):
+            slots = solver_model.slots.setdefault(student_idx, {})
+            if student_idx not in updated:
+                updated.add(student_idx)
+                in_slot: dict[tuple[int, int], list[cp_model.IntVar]] = {}
+                for index in range(first_new[student_idx], len(valid_assignments[student_idx])):
+                    for period, course in enumerate(valid_assignments[student_idx][index].assignment):
+                        if course >= 0:
+                            in_slot.setdefault((course, period), []).append(assignment[(student_idx, index)])
+                for (course, period), variables in in_slot.items():
+                    if (course, period) in slots:
+                        cp_proto.extend_linear(model, slots[(course, period)][1], variables, [1] * len(variables))
+                    else:
+                        var = model.NewBoolVar(f"student{student_idx}_course{course}_period{period}")
+                        # var == sum(variables), the student has exactly one assignment so this is 0 or 1
+                        slots[(course, period)] = (var, cp_proto.add_linear(model, variables + [var],
+                                                                             [1] * len(variables) + [-1], 0, 0))
+            return slots
+
+        for pair_index, pair_with_penalty in enumerate(self._pairs_with_penalty()):
+            friend1_idx, friend2_idx = pair_with_penalty[0]
+            prefix = f"slot_{friend1_idx}_{friend2_idx}"
+
+            slots1 = student_slots(friend1_idx)
+            slots2 = student_slots(friend2_idx)
+            for slot, (var1, _) in slots1.items():
+                if slot not in slots2 or (pair_index, *slot) in solver_model.shared_slots:
+                    continue
+                solver_model.shared_slots.add((pair_index, *slot))
+                var2 = slots2[slot][0]
+                var1and2 = model.NewBoolVar(f"{prefix}_{slot[0]}_{slot[1]}")
+                model.AddBoolAnd([var1, var2]).only_enforce_if(var1and2)
+                model.AddBoolOr([var1.Not(), var2.Not()]).only_enforce_if(var1and2.Not())
+                solver_model.and_literals.append((var1and2, var1, var2))
+                c_expr.append(var1and2)
+                c_weights.append(pair_with_penalty[1])
+
+        return c_expr, c_weights
+
     def _get_result(self, solver, valid_assignments, assignment) -> list[ResultRecord]:
         def get_course_code(idx):
             if idx < 0:
                 return ""
             return self.courses[idx].code
 
-        result = []
+        records = {}
         for student in range(len(self.students)):
+            # the students of a group are identical, so they get the assignments of the group in their order
+            members = iter(self.groups[student])
             for assignment_index in range(len(valid_assignments[student])):
-                if solver.Value(assignment[(student, assignment_index)]) == 1:
-                    result.append(ResultRecord(self.students[student].name,
-                                               [get_course_code(course) for course in
-                                                valid_assignments[student][assignment_index].assignment],
-                                               valid_assignments[student][assignment_index].penalty))
-        return result
+                valid_assignment = valid_assignments[student][assignment_index]
+                for _ in range(solver.Value(assignment[(student, assignment_index)])):
+                    name = next(members).name
+                    records[name] = ResultRecord(name, [get_course_code(c) for c in valid_assignment.assignment],
+                                                 valid_assignment.penalty)
+        return [records[student.name] for student in self.data.students]
 
     def _print_valid_assignments(self, valid_assignments):
         for i, student_assignments in enumerate(valid_assignments):
-            if self.data.students[i].name == "Grietje":
-                print(f"Student {self.data.students[i].name}")
+            if self.students[i].name == "Grietje":
+                print(f"Student {self.students[i].name}")
                 for assignment in student_assignments:
                     course_codes = [self._course_code(course) for course in assignment.assignment]
                     print(f"  {",".join(course_codes)} penalty: {assignment.penalty}")
 
-    def _course_number(self, course_name):
-        for i, course in enumerate(self.courses):
-            if course.code == course_name:
-                return i
-        return -1
-
     def _course_code(self, course_number):
         return '   ' if course_number < 0 else self.courses[course_number].code
+
+
+def threaded_mp_context() -> BaseContext:
+    """
+    The context for the processes of a Solver that solves on another thread (of the UI or the service), forking a
+    process with several threads can deadlock. A fork server where there is one, otherwise spawned processes.
+    """
+    return multiprocessing.get_context(
+        "forkserver" if "forkserver" in multiprocessing.get_all_start_methods() else "spawn")
+
+
+def _solve_group(data: Data, minimize_changes: bool, debug: bool, options: SolverOptions,
+                 group_nr: int, progress_queue, stop_event) -> SolverResult:
+    """Solves a group of students in a worker process, see Solver._solve_groups"""
+    solver = Solver(data, minimize_changes, debug, options,
+                    progress_listener=lambda progress: progress_queue.put((group_nr, progress)))
+
+    def forward_stop():
+        stop_event.wait()
+        solver.stop()
+
+    threading.Thread(target=forward_stop, daemon=True).start()
+    return solver._solve_passes()
+
+
+# the solver of the neighbourhoods in a worker process of a LNS solve, created once per process
+_neighbourhood_solver: Solver | None = None
+
+
+def _init_neighbourhood_worker(data: Data, minimize_changes: bool, debug: bool):
+    global _neighbourhood_solver
+    _neighbourhood_solver = Solver(data, minimize_changes, debug)
+
+
+def _solve_neighbourhood(free: np.ndarray, current: np.ndarray, solver_pass: int,
+                         options: SolverOptions) -> NeighbourhoodSolution | None:
+    """Solves a neighbourhood in a worker process, see Solver._solve_lns"""
+    return _neighbourhood_solver.solve_neighbourhood(free, current, solver_pass, options)
@@ -0,0 +1,404 @@
+import argparse
+import itertools
+import json
+import os
+import threading
+import time
+import urllib.error
+import urllib.request
+from collections import OrderedDict, deque
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from model import Data, HandledException, Config, ClassConfig, Course, Student, ResultRecord, PreviousResult
+from model_io import load
+from solver import Solver, SolverOptions, SolverResult, SolverProgress, threaded_mp_context
+
+# Long-lived local solver service with a small JSON over HTTP API, so repeated solves of the same school reuse the
+# parsed data and the generated assignments (see solver.ASSIGNMENT_CACHE) of earlier solves:
+#
+#   POST /jobs                 submit a job, {"client", "input", "previous", "options"} or {"client", "data", "options"}
+#   GET  /jobs                 the status of all jobs
+#   GET  /jobs/<id>            the status of a job, with the progress of the search
+#   GET  /jobs/<id>/result     the SolverResult of a finished job
+#   POST /jobs/<id>/stop       stop a job, a running job keeps its best solution so far
+#
+# Jobs are queued per client and the clients take turns, so one client submitting many jobs does not hold up the
+# others. The groups of a decomposed problem are solved in child processes, whose generated assignments are not kept.
+# The jobs run on threads, so the child processes are not forked from this process but started by a fork server (or
+# spawned where there is none).
+
+DEFAULT_PORT = 8765
+QUEUED, RUNNING, DONE, FAILED, STOPPED = "queued", "running", "done", "failed", "stopped"
+
+# number of parsed inputs kept in memory, and of finished jobs kept for their results
+PARSED_CACHE_SIZE = 8
+FINISHED_JOBS = 100
+
+
+class Job:
+    def __init__(self, job_id: str, client: str, options: SolverOptions, input_path: str | None = None,
+                 previous_path: str | None = None, data: Data | None = None):
+        self.id = job_id
+        self.client = client
+        self.options = options
+        self.input_path = input_path
+        self.previous_path = previous_path
+        self.data = data
+        self.status = QUEUED
+        self.submitted = time.time()
+        self.started: float | None = None
+        self.finished: float | None = None
+        self.solver: Solver | None = None
+        self.stop_requested = False
+        self.progress: SolverProgress | None = None
+        self.result: SolverResult | None = None
+        self.error: str | None = None
+
+    def to_json(self) -> dict:
+        return {
+            "id": self.id,
+            "client": self.client,
+            "status": self.status,
+            "input": self.input_path,
+            "submitted": self.submitted,
+            "started": self.started,
+            "finished": self.finished,
+            "progress": self.progress._asdict() if self.progress else None,
+            "objective": self.result.objective if self.result else None,
+            "error": self.error,
+        }
+
+
+class SolverService:
+    """
+    Queues the submitted jobs and solves them on concurrent_jobs threads. The parsed inputs are kept in an LRU cache
+    keyed by their paths, modification times and sizes, each job solves its own copy.
+    """
+
+    def __init__(self, concurrent_jobs: int = 1):
+        self._lock = threading.Condition()
+        self._jobs: OrderedDict[str, Job] = OrderedDict()
+        # queued jobs per client, and the clients with queued jobs in the order they get their turn
+        self._queues: dict[str, deque[Job]] = {}
+        self._turns: deque[str] = deque()
+        self._ids = itertools.count(1)
+        self._parsed: OrderedDict[tuple, Data] = OrderedDict()
+        self._parsed_lock = threading.Lock()
+        self._mp_context = threaded_mp_context()
+        for _ in range(concurrent_jobs):
+            threading.Thread(target=self._work, daemon=True).start()
+
+    def submit(self, client: str, options: SolverOptions, input_path: str | None = None,
+               previous_path: str | None = None, data: Data | None = None) -> Job:
+        with self._lock:
+            job = Job(str(next(self._ids)), client, options, input_path, previous_path, data)
+            self._jobs[job.id] = job
+            if client not in self._queues:
+                self._queues[client] = deque()
+                self._turns.append(client)
+            self._queues[client].append(job)
+            self._forget_finished_jobs()
+            self._lock.notify()
+            return job
+
+    def get(self, job_id: str) -> Job | None:
+        return self._jobs.get(job_id)
+
+    def jobs(self) -> list[Job]:
+        with self._lock:
+            return list(self._jobs.values())
+
+    def stop(self, job_id: str) -> Job | None:
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return None
+            job.stop_requested = True
+            if job.status == QUEUED:
+                self._queues[job.client].remove(job)
+                self._finish(job, STOPPED)
+            elif job.solver:
+                job.solver.stop()
+            return job
+
+    def _next_job(self) -> Job:
+        """The first job of the client whose turn it is, the client then goes to the back of the line"""
+        with self._lock:
+            while True:
+                while self._turns:
+                    client = self._turns.popleft()
+                    queue = self._queues[client]
+                    if not queue:
+                        del self._queues[client]
+                        continue
+                    job = queue.popleft()
+                    if queue:
+                        self._turns.append(client)
+                    else:
+                        del self._queues[client]
+                    job.status = RUNNING
+                    job.started = time.time()
+                    return job
+                self._lock.wait()
+
+    def _work(self):
+        while True:
+            job = self._next_job()
+            try:
+                data = job.data if job.data is not None else self._load(job.input_path, job.previous_path)
+                data = data.copy()
+                job.solver = Solver(data, data.previous_result is not None, options=job.options,
+                                    progress_listener=lambda progress, job=job: setattr(job, "progress", progress),
+                                    mp_context=self._mp_context)
+                # a stop between taking the job and creating the solver
+                if job.stop_requested:
+                    job.solver.stop()
+                job.result = job.solver.solve()
+                self._finish(job, DONE)
+            except Exception as e:
+                job.error = str(e)
+                self._finish(job, STOPPED if job.stop_requested and isinstance(e, HandledException) else FAILED)
+
+    def _finish(self, job: Job, status: str):
+        job.status = status
+        job.finished = time.time()
+        # the data and solver are only needed while solving
+        job.data = None
+        job.solver = None
+
+    def _forget_finished_jobs(self):
+        finished = [job.id for job in self._jobs.values() if job.status not in (QUEUED, RUNNING)]
+        for job_id in finished[:max(0, len(finished) - FINISHED_JOBS)]:
+            del self._jobs[job_id]
+
+    def _load(self, input_path: str, previous_path: str | None) -> Data:
+        key = tuple((os.path.abspath(path), os.stat(path).st_mtime_ns, os.stat(path).st_size) if path else None
+                    for path in (input_path, previous_path))
+        with self._parsed_lock:
+            data = self._parsed.get(key)
+            if data is not None:
+                self._parsed.move_to_end(key)
+                print(f"Using parsed {input_path}")
+                return data
+        data = load(input_path, previous_path)
+        with self._parsed_lock:
+            self._parsed[key] = data
+            while len(self._parsed) > PARSED_CACHE_SIZE:
+                self._parsed.popitem(last=False)
+        return data
+
+
+def data_to_json(data: Data) -> dict:
+    """The input data as JSON, the previous result as course codes"""
+    previous = None
+    if data.previous_result is not None:
+        previous = [[name, [data.courses[index].code if index >= 0 else None
+                            for index in data.previous_result.get(name)]] for name in data.previous_result]
+    return {
+        "periods": data.config.periods,
+        "classes": [[cl.code, cl.name] for cl in data.config.classes],
+        "together": data.config.together,
+        "apart": data.config.apart,
+        "courses": [[course.code, course.size, "".join("1" if available else "0" for available in course.availability),
+                     course.name] for course in data.courses],
+        "students": [[student.name, data.student_to_class.get(student.name), student.choices]
+                     for student in data.students],
+        "previous": previous,
+    }
+
+
+def data_from_json(value: dict) -> Data:
+    data = Data()
+    data.config = Config(value["periods"], [ClassConfig(code, name) for code, name in value["classes"]],
+                         value["together"], value["apart"])
+    for code, size, availability, name in value["courses"]:
+        data.add_course(Course(code, size, availability, name))
+    for name, class_code, choices in value["students"]:
+        data.add_students(class_code, [Student(name, choices)])
+    if value.get("previous") is not None:
+        records = [ResultRecord(name, courses, 0) for name, courses in value["previous"]]
+        data.previous_result = PreviousResult.from_records(data, records)
+    data.validate()
+    return data
+
+
+def result_to_json(result: SolverResult) -> dict:
+    return result._asdict() | {
+        "result": [[record.student, record.courses, record.penalty] for record in result.result],
+        "options": result.options._asdict(),
+    }
+
+
+def result_from_json(value: dict) -> SolverResult:
+    return SolverResult(**value | {
+        "result": [ResultRecord(student, courses, penalty) for student, courses, penalty in value["result"]],
+        "options": SolverOptions(**value["options"]),
+    })
+
+
+def _to_json(value) -> bytes:
+    # numpy scalars (penalties) are written as the Python numbers they hold
+    return json.dumps(value, default=lambda o: o.item() if hasattr(o, "item") else str(o)).encode()
+
+
+class _RequestHandler(BaseHTTPRequestHandler):
+    service: SolverService
+
+    def do_GET(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            self._reply(200, [job.to_json() for job in self.service.jobs()])
+            return
+        job = self.service.get(parts[1]) if len(parts) in (2, 3) and parts[0] == "jobs" else None
+        if job is None:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+        elif len(parts) == 2:
+            self._reply(200, job.to_json())
+        elif parts[2] != "result":
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+        elif job.result is None:
+            self._reply(409, {"error": f"Job {job.id} has no result", "status": job.status})
+        else:
+            self._reply(200, result_to_json(job.result))
+
+    def do_POST(self):
+        parts = self.path.strip("/").split("/")
+        if parts == ["jobs"]:
+            try:
+                request = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))))
+                options = SolverOptions(**request.get("options", {}))
+                data = data_from_json(request["data"]) if request.get("data") else None
+                if data is None and not request.get("input"):
+                    raise ValueError("Either data or input is required")
+            except (ValueError, TypeError, KeyError, HandledException) as e:
+                self._reply(400, {"error": str(e)})
+                return
+            job = self.service.submit(request.get("client") or self.client_address[0], options,
+                                      request.get("input"), request.get("previous"), data)
+            self._reply(201, job.to_json())
+        elif len(parts) == 3 and parts[0] == "jobs" and parts[2] == "stop":
+            job = self.service.stop(parts[1])
+            if job is None:
+                self._reply(404, {"error": f"Unknown job {parts[1]}"})
+            else:
+                self._reply(200, job.to_json())
+        else:
+            self._reply(404, {"error": f"Unknown path {self.path}"})
+
+    def _reply(self, status: int, body):
+        content = _to_json(body)
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def serve(port: int = DEFAULT_PORT, concurrent_jobs: int = 1):
+    """Runs the service on localhost until interrupted"""
+    handler = type("RequestHandler", (_RequestHandler,), {"service": SolverService(concurrent_jobs)})
+    server = ThreadingHTTPServer(("127.0.0.1", port), handler)
+    print(f"Solver service listening on http://127.0.0.1:{port}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+class SolverClient:
+    """Client of the solver service"""
+
+    def __init__(self, url: str, client: str | None = None):
+        self.url = url.rstrip("/")
+        self.client = client
+
+    def submit(self, options: SolverOptions, input_path: str | None = None, previous_path: str | None = None,
+               data: Data | None = None) -> dict:
+        return self._request("POST", "/jobs", {
+            "client": self.client,
+            "options": options._asdict(),
+            "input": os.path.abspath(input_path) if input_path else None,
+            "previous": os.path.abspath(previous_path) if previous_path else None,
+            "data": data_to_json(data) if data is not None else None,
+        })
+
+    def status(self, job_id: str) -> dict:
+        return self._request("GET", f"/jobs/{job_id}")
+
+    def result(self, job_id: str) -> SolverResult:
+        return result_from_json(self._request("GET", f"/jobs/{job_id}/result"))
+
+    def stop(self, job_id: str) -> dict:
+        return self._request("POST", f"/jobs/{job_id}/stop")
+
+    def _request(self, method: str, path: str, body: dict | None = None) -> dict:
+        request = urllib.request.Request(self.url + path, method=method, data=_to_json(body) if body else None,
+                                         headers={"Content-Type": "application/json"})
+        try:
+            with urllib.request.urlopen(request) as response:
+                return json.loads(response.read())
+        except urllib.error.HTTPError as e:
+            raise HandledException(f"Rekenservice: {json.loads(e.read()).get('error', e.reason)}")
+        except urllib.error.URLError as e:
+            raise HandledException(f"Rekenservice op {self.url} niet bereikbaar: {e.reason}")
+
+
+class RemoteSolver:
+    """
+    Solves through the solver service, with the part of the Solver interface the UI uses: solve() blocks until the
+    job is finished, reports the progress to the listener and sets the result on the data, stop() stops the job.
+    """
+
+    def __init__(self, client: SolverClient, data: Data, input_path: str | None, previous_path: str | None,
+                 options: SolverOptions = SolverOptions(), progress_listener=None, poll_interval: float = 0.2):
+        self.client = client
+        self.data = data
+        self.input_path = input_path
+        self.previous_path = previous_path
+        self.options = options
+        self.progress_listener = progress_listener
+        self.poll_interval = poll_interval
+        self.job_id: str | None = None
+        self.stopped = False
+
+    def solve(self) -> SolverResult:
+        # with paths the service can reuse its parsed data, otherwise the data is sent
+        if self.input_path:
+            job = self.client.submit(self.options, self.input_path, self.previous_path)
+        else:
+            job = self.client.submit(self.options, data=self.data)
+        self.job_id = job["id"]
+        if self.stopped:
+            self.client.stop(self.job_id)
+        while job["status"] in (QUEUED, RUNNING):
+            time.sleep(self.poll_interval)
+            job = self.client.status(self.job_id)
+            if job["progress"] and self.progress_listener:
+                self.progress_listener(SolverProgress(**job["progress"]))
+        if job["status"] != DONE:
+            raise HandledException(job["error"] or "Gestopt voordat er een oplossing was gevonden")
+        result = self.client.result(self.job_id)
+        self.data.result = result.result
+        return result
+
+    def stop(self):
+        self.stopped = True
+        if self.job_id:
+            self.client.stop(self.job_id)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Lokale rekenservice voor het verdelen van keuzevakken")
+    parser.add_argument("--port", type=int, default=DEFAULT_PORT, help="Poort op localhost")
+    parser.add_argument("--jobs", type=int, default=1, help="Aantal berekeningen dat tegelijk wordt uitgevoerd")
+    args = parser.parse_args()
+    serve(args.port, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,171 @@
+import os
+
+import pandas as pd
+
+from model import Data, HandledException, Config, ClassConfig, Course, Student, ResultRecord, PreviousResult
+from util import make_backup
+
+# Input and output as plain tables in CSV or Parquet files, for batch runs that do not need the layout of a workbook.
+# The input is a directory with a courses table, an optional config table and a choices table per class, all in the
+# same format. The courses table is the file that is passed as input, the other tables are found next to it.
+
+TABLE_EXTENSIONS = (".csv", ".parquet")
+CONFIG_TABLE = "config"
+CLASS_TABLE_PREFIX = "keuzes-"
+
+
+class TableLoaderException(HandledException):
+    pass
+
+
+class TableLoader:
+    """
+    Loads the input from tables, as written by write_input_tables (and testset_generator):
+
+    - the courses table (normally vakken.csv) with the columns code, size, periods (a 1 or 0 per period) and name
+    - the optional config table, with a setting and up to two values per row: 'periodes' with the number of periods,
+      'klas' with a class (in order), and 'samen' and 'apart' with a pair of students. Without config table the
+      number of periods follows from the courses, the classes are the class tables in alphabetical order and there are
+      no pairs.
+    - a table keuzes-<class> per class, with the name of the student followed by the choices
+    """
+
+    def __init__(self, inputpath: str, previous: str | None):
+        self.input = inputpath
+        self.previous = previous
+        self.directory = os.path.dirname(inputpath)
+        self.extension = os.path.splitext(inputpath)[1].lower()
+
+    def load(self) -> Data:
+        data = Data()
+        courses = _read_rows(self.input)
+        periods, class_codes, together, apart = self._parse_config(courses)
+        data.config = Config(periods, [ClassConfig(code, code) for code in class_codes], together, apart)
+        for code, size, availability, name in ((row + [None] * 4)[:4] for row in courses):
+            if not code:
+                continue
+            availability = str(availability or "")[:periods].ljust(periods, "0")
+            data.add_course(Course(code, int(size), availability, name))
+
+        for code in class_codes:
+            students = [Student(row[0], [choice for choice in row[1:] if choice])
+                        for row in _read_rows(self._table_path(CLASS_TABLE_PREFIX + code)) if row and row[0]]
+            data.add_students(code, students)
+
+        if self.previous:
+            data.previous_result = PreviousResult.from_records(data, read_previous_records(self.previous))
+        return data
+
+    def _parse_config(self, courses: list[list]) -> tuple[int, list[str], list[list[str]], list[list[str]]]:
+        periods = None
+        class_codes = []
+        pairs: dict[str, list[list[str]]] = {"samen": [], "apart": []}
+        config_path = self._table_path(CONFIG_TABLE)
+        if os.path.exists(config_path):
+            for row in _read_rows(config_path):
+                setting = str(row[0]).lower() if row and row[0] else None
+                values = (row[1:] + [None, None])[:2]
+                if setting == "periodes":
+                    periods = int(values[0])
+                elif setting == "klas":
+                    class_codes.append(values[0])
+                elif setting in pairs:
+                    pairs[setting].append(values)
+                elif setting:
+                    raise TableLoaderException(f"Onbekende instelling '{row[0]}' in {config_path}")
+
+        if periods is None:
+            periods = max((len(str(row[2])) for row in courses if len(row) > 2 and row[2]), default=0)
+        if not periods:
+            raise TableLoaderException(f"Het aantal periodes is niet te bepalen uit {self.input}")
+        if not class_codes:
+            prefix, extension = CLASS_TABLE_PREFIX, self.extension
+            class_codes = sorted(name[len(prefix):-len(extension)] for name in os.listdir(self.directory or ".")
+                                 if name.startswith(prefix) and name.lower().endswith(extension))
+        return periods, class_codes, pairs["samen"], pairs["apart"]
+
+    def _table_path(self, name: str) -> str:
+        return os.path.join(self.directory, name + self.extension)
+
+
+class TableExporter:
+    """Writes the result as one table, with the class, the name, the course per period and the penalty per student"""
+
+    def export(self, data: Data, filename: str):
+        periods = [f"periode {period + 1}" for period in range(data.config.periods)]
+        columns = ["klas", "naam"] + periods + ["strafpunten"]
+        rows = [[data.student_to_class.get(record.student), record.student]
+                + [course or None for course in record.courses] + [record.penalty]
+                for record in data.result]
+        make_backup(filename)
+        _write_rows(filename, columns, rows)
+
+
+def read_previous_records(path: str) -> list[ResultRecord]:
+    """The records of a result table written by the TableExporter, the courses are in the 'periode' columns"""
+    frame = _read_frame(path)
+    columns = [str(column).lower() for column in frame.columns]
+    if "naam" not in columns:
+        raise TableLoaderException(f"Kolom 'naam' niet gevonden in {path}")
+    name_column = columns.index("naam")
+    period_columns = [i for i, column in enumerate(columns) if column.startswith("periode")]
+    return [ResultRecord(row[name_column], [row[i] for i in period_columns], 0)
+            for row in _rows(frame) if row[name_column]]
+
+
+def write_input_tables(data: Data, path: str):
+    """Writes the input as tables that the TableLoader reads, path is the courses table"""
+    directory = os.path.dirname(path)
+    extension = os.path.splitext(path)[1].lower()
+    _write_rows(path, ["code", "size", "periods", "name"],
+                [[course.code, course.size, "".join("1" if available else "0" for available in course.availability),
+                  course.name] for course in data.courses])
+
+    config = [["periodes", data.config.periods, None]]
+    config += [["klas", class_config.code, None] for class_config in data.config.classes]
+    config += [["samen", *pair] for pair in data.config.together]
+    config += [["apart", *pair] for pair in data.config.apart]
+    _write_rows(os.path.join(directory, CONFIG_TABLE + extension), ["instelling", "waarde 1", "waarde 2"], config)
+
+    choice_count = max((len(student.choices) for student in data.students), default=0)
+    for class_config in data.config.classes:
+        rows = [[student.name] + student.choices + [None] * (choice_count - len(student.choices))
+                for student in data.students if data.student_to_class.get(student.name) == class_config.code]
+        _write_rows(os.path.join(directory, CLASS_TABLE_PREFIX + class_config.code + extension),
+                    ["naam"] + [f"k{i + 1}" for i in range(choice_count)], rows)
+
+
+def _read_frame(path: str) -> pd.DataFrame:
+    extension = os.path.splitext(path)[1].lower()
+    try:
+        if extension == ".csv":
+            # all values as strings, like they are in the file, and empty cells as empty strings
+            return pd.read_csv(path, dtype=str, keep_default_na=False)
+        return pd.read_parquet(path)
+    except FileNotFoundError:
+        raise TableLoaderException(f"Bestand '{path}' niet gevonden")
+    except ImportError:
+        raise TableLoaderException("Voor Parquet-bestanden moet pyarrow (of fastparquet) geïnstalleerd zijn")
+
+
+def _rows(frame: pd.DataFrame) -> list[list]:
+    """The rows of the frame as lists, with None for empty cells"""
+    return [[None if pd.isna(value) or value == "" else value for value in row]
+            for row in frame.itertuples(index=False, name=None)]
+
+
+def _read_rows(path: str) -> list[list]:
+    return _rows(_read_frame(path))
+
+
+def _write_rows(path: str, columns: list[str], rows: list[list]):
+    # the columns of a Parquet file have a single type, so the values (numbers in a workbook) are written as text
+    frame = pd.DataFrame([[None if value is None else str(value) for value in row] for row in rows],
+                         columns=columns, dtype=object)
+    try:
+        if path.lower().endswith(".csv"):
+            frame.to_csv(path, index=False)
+        else:
+            frame.to_parquet(path, index=False)
+    except ImportError:
+        raise TableLoaderException("Voor Parquet-bestanden moet pyarrow (of fastparquet) geïnstalleerd zijn")
@@ -0,0 +1,12 @@
+from collections import Counter
+
+from model import Data, ResultRecord
+
+
+def assert_fits(data: Data, records: list[ResultRecord]):
+    """Every course is given in the periods it is assigned in, to no more students than its size"""
+    courses = {course.code: course for course in data.courses}
+    occupancy = Counter((code, period) for record in records for period, code in enumerate(record.courses) if code)
+    for (code, period), count in occupancy.items():
+        assert courses[code].availability[period], f"{code} is not given in period {period}"
+        assert count <= courses[code].size, f"{code} has {count} students in period {period}"
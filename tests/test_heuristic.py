@@ -0,0 +1,31 @@
+from checks import assert_fits
+from model import ClassConfig, Config, Course, Data, Student
+from solver import Solver, SolverOptions
+from testset_generator import generate_data
+
+FAST = SolverOptions(fast=True, seed=1)
+
+
+def test_heuristic_fits_course_sizes():
+    # about as many places as choices, so courses fill up and the regret order matters
+    data = generate_data(seed=42, periods=5, course_count=20, student_count=400, size_min=15, size_max=25,
+                         availability_chance=0.9)
+    result = Solver(data, False, options=FAST).solve()
+    assert len(result.result) == len(data.students)
+    assert_fits(data, result.result)
+
+
+def test_heuristic_keeps_pairs_together_and_apart():
+    # three courses in every period with room for two students, so all four students can get their three choices
+    # with the pair p1 and p2 in the same course periods and q1 and q2 in none
+    data = Data()
+    data.config = Config(3, [ClassConfig("k", "k")], [["p1", "p2"]], [["q1", "q2"]])
+    data.courses = [Course(code, 2, "111") for code in "ABC"]
+    data.add_students("k", [Student(name, ["A", "B", "C"]) for name in ("p1", "p2", "q1", "q2")])
+    Solver(data, False, options=FAST).solve()
+
+    assert_fits(data, data.result)
+    courses = {record.student: record.courses for record in data.result}
+    assert all(sorted(courses[name]) == ["A", "B", "C"] for name in courses)
+    assert courses["p1"] == courses["p2"]
+    assert all(course1 != course2 for course1, course2 in zip(courses["q1"], courses["q2"]))
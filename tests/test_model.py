@@ -0,0 +1,20 @@
+from model import PreviousResult, ResultRecord
+from testset_generator import generate_data
+
+
+def test_unknown_courses_and_students_in_previous_result_are_warnings(capsys):
+    data = generate_data(seed=42, periods=3, course_count=5, student_count=4, size_min=2, size_max=4,
+                         availability_chance=1)
+    student = data.students[0]
+    data.previous_result = PreviousResult.from_records(data, [
+        ResultRecord(student.name, ["c0", "cancelled", None], 0),
+        ResultRecord("left school", ["c1", None, None], 0),
+    ])
+    data.validate()
+
+    assert data.previous_result.get(student.name) == (0, -1, -1)
+    assert data.warnings == [
+        f"Onbekend vak cancelled in eerdere indeling van leerling {student.name}, genegeerd",
+        "Leerling left school uit de eerdere indeling is niet gevonden in een klas, genegeerd",
+    ]
+    assert capsys.readouterr().out == ""
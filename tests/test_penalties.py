@@ -0,0 +1,95 @@
+import random
+
+import numpy as np
+import pytest
+
+from heuristic import valid_candidates
+from model import Data, PreviousResult, ResultRecord
+from penalties import UNSOLVABLE_PENALTY, calculate_penalties
+from solver import MAX_PASS, Solver
+from testset_generator import generate_data
+
+SAMPLES = 20
+
+
+def reference_penalty(periods: int, assignment: tuple[int, ...], choices: list[int], reserve: list[int],
+                      previous: tuple[int, ...] | None, minimize_changes: bool) -> int:
+    """
+    The penalty of a single assignment, written out per student. penalties.calculate_penalties calculates the same for
+    many assignments at once and is checked against this.
+    """
+    penalty = 0
+    if minimize_changes and previous:
+        for idx, prev_course_number in enumerate(previous):
+            if prev_course_number != -1 and prev_course_number != assignment[idx]:
+                penalty += 1
+    else:
+        # filter empty choices
+        ordered_choices = [course for course in choices if course != -1]
+        for i, course in enumerate(ordered_choices):
+            if course not in assignment:
+                penalty += 3 - i  # 3 if the first choice is not assigned, 2 if the second, etc.
+
+    reserves_used = len([course for course in reserve if course != -1 and course in assignment])
+    return penalty + reserves_used ** 2 * 10 + unsolvable_penalty(periods, assignment, choices, reserve)
+
+
+def unsolvable_penalty(periods: int, assignment: tuple[int, ...], choices: list[int], reserve: list[int]) -> int:
+    assigned_count = len([course for course in assignment if course != -1])
+    choice_count = len([course for course in choices if course != -1]) + len(
+        [course for course in reserve if course != -1])
+    short = min(periods, choice_count) - assigned_count
+    return short ** 2 * UNSOLVABLE_PENALTY
+
+
+@pytest.fixture(scope="module")
+def data() -> Data:
+    """Generated data with a random previous result for most students"""
+    data = generate_data(seed=42, periods=5, course_count=20, student_count=200, size_min=10, size_max=20,
+                         availability_chance=0.9)
+    rnd = random.Random(42)
+    codes = [course.code for course in data.courses] + [None]
+    data.previous_result = PreviousResult.from_records(
+        data, [ResultRecord(student.name, [rnd.choice(codes) for _ in range(data.config.periods)], 0)
+               for student in data.students if rnd.random() < 0.8])
+    return data
+
+
+@pytest.mark.parametrize("minimize_changes", [False, True])
+def test_batched_penalties_equal_reference(data: Data, minimize_changes: bool):
+    """For the valid assignments the solver generates and for random assignments"""
+    rnd = random.Random(42)
+    periods = data.config.periods
+    instance = data.get_instance()
+    solver = Solver(data, minimize_changes)
+    valid_assignments = solver._create_valid_assignments(MAX_PASS)
+    for student_nr, row in enumerate(solver.student_rows):
+        course_numbers = instance.choices[row, :instance.choice_counts[row]].tolist()
+        course_numbers += [-1] * (periods - len(course_numbers))
+        choices, reserve = course_numbers[:periods], course_numbers[periods:]
+        previous = data.get_previous_result(data.students[row].name)
+
+        random_assignments = [tuple(rnd.randint(-1, len(data.courses) - 1) for _ in range(periods))
+                              for _ in range(SAMPLES)]
+        batched = calculate_penalties(np.array(random_assignments, dtype=np.int16).reshape(-1, periods),
+                                      np.array([choices]), np.array([reserve], dtype=np.int16).reshape(1, -1),
+                                      instance.previous[row:row + 1], instance.has_previous[row:row + 1],
+                                      minimize_changes).tolist()
+        expected = [(a.assignment, a.penalty) for a in valid_assignments[student_nr]] + \
+            list(zip(random_assignments, batched))
+        for assignment, penalty in expected:
+            assert penalty == reference_penalty(periods, assignment, choices, reserve, previous, minimize_changes), \
+                f"penalty of {assignment} of student {row}"
+
+
+@pytest.mark.parametrize("minimize_changes", [False, True])
+def test_heuristic_candidates_equal_valid_assignments(data: Data, minimize_changes: bool):
+    """The heuristic generates its candidates separately, they must be the valid assignments of the solver"""
+    solver = Solver(data, minimize_changes)
+    valid_assignments = solver._create_valid_assignments(MAX_PASS)
+    candidates = valid_candidates(data, MAX_PASS, minimize_changes)
+    for student_nr, row in enumerate(solver.student_rows):
+        start, end = candidates.starts[row], candidates.starts[row + 1]
+        heuristic_assignments = zip(map(tuple, candidates.assignments[start:end].tolist()),
+                                    candidates.penalties[start:end].tolist())
+        assert sorted(heuristic_assignments) == sorted((a.assignment, a.penalty) for a in valid_assignments[student_nr])
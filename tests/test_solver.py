@@ -0,0 +1,30 @@
+from checks import assert_fits
+from model import PreviousResult, Student
+from solver import Solver, SolverOptions
+from testset_generator import generate_data
+
+OPTIONS = SolverOptions(workers=1, time_per_pass=20)
+
+
+def test_delta_solve_compared_to_full_solve():
+    data = generate_data(seed=42, periods=3, course_count=8, student_count=60, size_min=20, size_max=30,
+                         availability_chance=0.9)
+    Solver(data, False, options=OPTIONS).solve()
+    previous = list(data.result)
+    data.previous_result = PreviousResult.from_records(data, previous)
+    # a student that joins after the previous result is the only change
+    data.add_students(data.config.classes[0].code, [Student("new", [course.code for course in data.courses[:4]])])
+
+    delta = Solver(data, True, options=OPTIONS._replace(delta=True)).solve()
+    delta_records = list(data.result)
+    full = Solver(data, True, options=OPTIONS).solve()
+
+    assert delta.delta_students is not None and delta.delta_students < len(data.students)
+    assert not delta.optimal and delta.feasable
+    assert delta.bound is None and delta.gap is None
+    assert_fits(data, delta_records)
+    kept = sum(record.courses == courses for record, courses in zip(delta_records, (r.courses for r in previous)))
+    assert kept >= len(previous) - delta.delta_students
+
+    assert full.optimal and full.delta_students is None
+    assert full.objective <= delta.objective
@@ -0,0 +1,26 @@
+import os
+
+import pytest
+
+from model import ResultRecord
+from table_io import TABLE_EXTENSIONS, TableExporter, TableLoader, read_previous_records, write_input_tables
+from testset_generator import generate_data
+
+
+@pytest.mark.parametrize("extension", TABLE_EXTENSIONS)
+def test_tables_round_trip(tmp_path, extension: str):
+    data = generate_data(seed=42, periods=3, course_count=6, student_count=20, size_min=5, size_max=10,
+                         availability_chance=0.8, class_count=2)
+    courses_path = os.path.join(tmp_path, "vakken" + extension)
+    write_input_tables(data, courses_path)
+
+    loaded = TableLoader(courses_path, None).load()
+    assert [(c.code, c.size, c.availability) for c in loaded.courses] == \
+        [(c.code, c.size, c.availability) for c in data.courses]
+    assert [(s.name, s.choices) for s in loaded.students] == [(s.name, s.choices) for s in data.students]
+
+    loaded.result = [ResultRecord(student.name, (student.choices + [None])[:3], 0) for student in loaded.students]
+    result_path = os.path.join(tmp_path, "resultaat" + extension)
+    TableExporter().export(loaded, result_path)
+    assert [(r.student, list(r.courses)) for r in read_previous_records(result_path)] == \
+        [(r.student, list(r.courses)) for r in loaded.result]
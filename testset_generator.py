@@ -1,18 +1,24 @@
 import os
 import random
 
-from model import Course, Student
+from openpyxl.cell import WriteOnlyCell
+from openpyxl.styles import Border, Side
+from openpyxl.workbook import Workbook
+
+from model import Course, Student, Data, Config, ClassConfig
+from table_io import write_input_tables
 
 directory = os.path.join("data", "testset")
 
 
-def generate_data(seed, periods, course_count, student_count, size_min, size_max, availability_chance):
+def generate_data(seed, periods, course_count, student_count, size_min, size_max, availability_chance,
+                  class_count=1) -> Data:
     random.seed(seed)
     courses = []
     students = []
     for i in range(course_count):
         size = random.randint(size_min, size_max)
-        availability = "".join("1" if random.random() < availability_chance else "0" for _ in range(4))
+        availability = "".join("1" if random.random() < availability_chance else "0" for _ in range(periods))
         code = f"c{i}"
         courses.append(Course(code, size, availability))
 
@@ -22,25 +28,66 @@ def generate_data(seed, periods, course_count, student_count, size_min, size_max
         count = random.randint(periods - 1, periods + 1)
         students.append(Student(f"s{i}", choices[:count]))
 
-    with open(os.path.join(directory, "vakken.csv"), "w") as f:
-        f.write("code,size,periods,name\n")
-        for course in courses:
-            availability = "".join("1" if available else "0" for available in course.availability)
-            f.write(f"{course.name},{course.size},{availability},{course.name}\n")
-
-    with open(os.path.join(directory, f"keuzes-a.csv"), "w") as f:
-        f.write("naam,k1,k2,k3,k4,k5,k6\n")
-        for student in students:
-            f.write(f"{student.name},{','.join(student.choices)}\n")
-    print()
-
-
-generate_data(
-    seed=42,
-    periods=5,
-    course_count=20,
-    student_count=200,
-    size_min=10,
-    size_max=20,
-    availability_chance=0.9
-)
+    data = Data()
+    if class_count == 1:
+        classes = [ClassConfig("a", "a")]
+    else:
+        classes = [ClassConfig(f"klas {i + 1}", f"klas {i + 1}") for i in range(class_count)]
+    data.config = Config(periods, classes, [], [])
+    data.courses = courses
+    for i, class_config in enumerate(classes):
+        data.add_students(class_config.code, students[i::class_count])
+    return data
+
+
+def write_data(data: Data):
+    os.makedirs(directory, exist_ok=True)
+    write_input_tables(data, os.path.join(directory, "vakken.csv"))
+
+
+def write_workbook(data: Data, path: str, formatted_rows: int = 0):
+    """
+    Writes the data as input workbook for the ExcelLoader. The class sheets get formatted_rows empty but formatted rows
+    below the students, like sheets that are formatted far down.
+    """
+    wb = Workbook(write_only=True)
+
+    ws = wb.create_sheet("Config")
+    ws.append(["Periodes", data.config.periods])
+    ws.append([])
+    ws.append(["Samen", None, None, "Apart"])
+    for i in range(max(len(data.config.together), len(data.config.apart))):
+        together = data.config.together[i] if i < len(data.config.together) else [None, None]
+        apart = data.config.apart[i] if i < len(data.config.apart) else [None, None]
+        ws.append([*together, None, *apart])
+
+    ws = wb.create_sheet("Vakken")
+    ws.append(["Naam", "Grootte"] + [f"Periode {p + 1}" for p in range(data.config.periods)])
+    for course in data.courses:
+        ws.append([course.code, course.size] + ["x" if available else None for available in course.availability])
+
+    border = Border(bottom=Side(style="thin"))
+    for class_config in data.config.classes:
+        ws = wb.create_sheet(class_config.code)
+        ws.append(["Naam"] + [f"Keuze {i + 1}" for i in range(data.config.periods + 2)])
+        for student in data.students:
+            if data.student_to_class[student.name] == class_config.code:
+                ws.append([student.name] + student.choices)
+        for _ in range(formatted_rows):
+            cell = WriteOnlyCell(ws)
+            cell.border = border
+            ws.append([cell])
+
+    wb.save(path)
+
+
+if __name__ == "__main__":
+    write_data(generate_data(
+        seed=42,
+        periods=5,
+        course_count=20,
+        student_count=200,
+        size_min=10,
+        size_max=20,
+        availability_chance=0.9
+    ))
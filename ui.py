@@ -6,7 +6,13 @@ from tkinter import filedialog
 
 from model import HandledException
 from model_io import load, write_to_excel
-from solver import Solver, SolverResult
+from solver import Solver, SolverOptions, SolverResult, threaded_mp_context
+from solver_service import RemoteSolver, SolverClient
+
+# url of a solver service (see solver_service.py) to solve with, instead of in this process
+SERVICE_URL = os.environ.get("KEUZEVAKKEN_SERVICE")
+# the number of warnings about the input shown in the result dialog, the rest is counted
+MAX_WARNINGS = 10
 
 
 class AppUI:
@@ -24,7 +30,7 @@ class AppUI:
         root.title("Keuzevakken verdelen")
 
         window_width = 500
-        window_height = 300
+        window_height = 380
         screen_width = root.winfo_screenwidth()
         screen_height = root.winfo_screenheight()
         position_top = int(screen_height / 2 - window_height / 2)
@@ -50,9 +56,22 @@ class AppUI:
         self.output_file_entry.grid(row=2, column=1, padx=10, pady=10, sticky="w")
         self.output_file_entry.insert(0, "Resultaat.xlsx")
 
+        defaults = SolverOptions()
+        time_limit_label = tk.Label(root, text="Rekentijd per ronde (s):")
+        time_limit_label.grid(row=3, column=0, padx=10, pady=10, sticky="e")
+        self.time_limit_entry = tk.Entry(root)
+        self.time_limit_entry.grid(row=3, column=1, padx=10, pady=10, sticky="w")
+        self.time_limit_entry.insert(0, f"{defaults.time_per_pass:g}")
+
+        workers_label = tk.Label(root, text="Aantal rekenkernen:")
+        workers_label.grid(row=4, column=0, padx=10, pady=10, sticky="e")
+        self.workers_entry = tk.Entry(root)
+        self.workers_entry.grid(row=4, column=1, padx=10, pady=10, sticky="w")
+        self.workers_entry.insert(0, str(os.cpu_count() or 1))
+
         # Create calculate button
         calculate_button = tk.Button(root, text="Bereken", command=self._calculate)
-        calculate_button.grid(row=3, column=1, padx=10, pady=20)
+        calculate_button.grid(row=5, column=1, padx=10, pady=20)
 
     def _select_input_file(self):
         file_path = filedialog.askopenfilename(filetypes=[("Excel files", "*.xlsx")])
@@ -71,6 +90,7 @@ class AppUI:
         if previous_path.startswith("<"):
             previous_path = None
         try:
+            options = self._solver_options()
             self.data = load(input_path, previous_path)
         except Exception as e:
             self._error_dialog(e)
@@ -78,14 +98,33 @@ class AppUI:
                 raise e
             return
 
-        solver = Solver(self.data, self.data.previous_result is not None, False)
+        # the listener is called from the solver thread, the spinner picks up the latest progress when polling
+        self.progress = None
+        listener = lambda progress: setattr(self, 'progress', progress)
+        if SERVICE_URL:
+            self.solver = RemoteSolver(SolverClient(SERVICE_URL), self.data, input_path, previous_path, options,
+                                       progress_listener=listener)
+        else:
+            # the solver runs on another thread than Tk, so its processes are not forked
+            self.solver = Solver(self.data, self.data.previous_result is not None, False, options=options,
+                                 progress_listener=listener, mp_context=threaded_mp_context())
 
         self._start_spinner()
 
-        self.calculation_thread = Thread(target=self._solve, args=(solver,))
+        self.calculation_thread = Thread(target=self._solve, args=(self.solver,))
         self.calculation_thread.start()
         self._check_thread()
 
+    def _solver_options(self) -> SolverOptions:
+        try:
+            time_limit = float(self.time_limit_entry.get())
+            workers = int(self.workers_entry.get())
+        except ValueError:
+            raise HandledException("Rekentijd en aantal rekenkernen moeten getallen zijn")
+        if time_limit <= 0 or workers < 0:
+            raise HandledException("Rekentijd moet positief zijn en het aantal rekenkernen mag niet negatief zijn")
+        return SolverOptions(workers=workers, time_per_pass=time_limit)
+
     def _solve(self, solver):
         try:
             self.result = solver.solve()
@@ -93,14 +132,34 @@ class AppUI:
             self.solver_exception = e
 
     def _start_spinner(self):
-        self.spinner_window = self._create_dialog("Rekenen", 200, 100)
+        self.spinner_window = self._create_dialog("Rekenen", 300, 220)
         self.spinner_label = tk.Label(self.spinner_window, text="Aan het rekenen...")
         self.spinner_label.pack(pady=20)
 
+        self.stop_button = tk.Button(self.spinner_window, text="Stop en behoud beste oplossing",
+                                     command=self._stop_solver)
+        self.stop_button.pack(pady=10)
+
         self.spinner_window.grab_set()
 
+    def _stop_solver(self):
+        self.solver.stop()
+        self.stop_button.config(state=tk.DISABLED, text="Stoppen...")
+
+    def _update_spinner(self):
+        progress = self.progress
+        if progress is None:
+            return
+        bound = "-" if progress.bound is None else f"{progress.bound:g}"
+        self.spinner_label.config(text=f"Aan het rekenen... (ronde {progress.solver_pass})\n\n"
+                                       f"Beste oplossing: {progress.objective:g}\n"
+                                       f"Ondergrens: {bound}\n"
+                                       f"Oplossingen gevonden: {progress.solutions}\n"
+                                       f"Rekentijd: {progress.wall_time:.0f}s")
+
     def _check_thread(self):
         if self.calculation_thread.is_alive():
+            self._update_spinner()
             self.spinner_window.after(100, self._check_thread)
         else:
             self.spinner_window.destroy()
@@ -128,15 +187,22 @@ class AppUI:
                 color = 'green'
             else:
                 message = 'Oplossing gevonden, maar mogelijk niet optimaal door overschrijding van de tijdslimiet'
+                if result.gap is not None:
+                    message += f'\n(maximaal {result.gap:.1%} van optimaal)'
                 color = 'orange'
         else:
             if result.optimal:
                 message = 'Niet alle vakken kunnen worden ingedeeld,\nmet rood zijn de vakken aangegeven die niet passen'
             else:
                 message = 'Niet alle vakken kunnen worden ingedeeld.\ner kon ook niet binnen de tijd een best-mogelijke indeling worden gevonden'
+            if result.oversubscribed:
+                message += '\n\nOvertekende vakken: ' + ', '.join(
+                    self.data.get_course_name(code) for code in result.oversubscribed)
             color = 'red'
 
-        result_window = self._create_dialog("Resultaat", 400, 300)
+        warnings = self.data.warnings
+        shown_warnings = warnings[:MAX_WARNINGS]
+        result_window = self._create_dialog("Resultaat", 400, 300 + (40 + 20 * len(shown_warnings) if warnings else 0))
 
         result_label = tk.Label(result_window, text=message, fg=color)
         result_label.pack(pady=20)
@@ -145,6 +211,13 @@ class AppUI:
             diff_label = tk.Label(result_window, text=f"{diffs} wijzigingen t.o.v. eerder resultaat")
             diff_label.pack(pady=20)
 
+        if warnings:
+            warning_text = "\n".join(shown_warnings)
+            if len(warnings) > len(shown_warnings):
+                warning_text += f"\n... en nog {len(warnings) - len(shown_warnings)} waarschuwingen"
+            warning_label = tk.Label(result_window, text=warning_text, fg='orange', wraplength=380, justify='left')
+            warning_label.pack(pady=10)
+
         open_button = tk.Button(result_window, text="Open resultaat", command=lambda: self._open(output_file))
         open_button.pack(pady=20)
 
@@ -0,0 +1,128 @@
+import posixpath
+import zipfile
+from typing import Iterator
+from xml.etree.ElementTree import iterparse, parse
+
+_MAIN = "{http://schemas.openxmlformats.org/spreadsheetml/2006/main}"
+_RELATIONSHIPS = "{http://schemas.openxmlformats.org/package/2006/relationships}"
+_RELATIONSHIP_ID = "{http://schemas.openxmlformats.org/officeDocument/2006/relationships}id"
+_SHARED_STRINGS_TYPE = "/sharedStrings"
+
+
+class XlsxReader:
+    """
+    Minimal reader of the cell values of an xlsx file, that streams the XML of a sheet straight from the zip file. It
+    offers the part of the read-only openpyxl workbook the ExcelLoader uses, but unlike openpyxl it does not parse all
+    sheets when the file is opened, to find their dimensions, so a process can cheaply read only some of the sheets.
+    Values are strings, numbers and booleans, number formats (such as dates) are not applied.
+    """
+
+    def __init__(self, path: str):
+        self._zip = zipfile.ZipFile(path)
+        try:
+            workbook_path = "xl/workbook.xml"
+            relationships = self._relationships(workbook_path)
+            workbook = parse(self._zip.open(workbook_path)).getroot()
+            self._sheet_paths = {sheet.get("name"): relationships[sheet.get(_RELATIONSHIP_ID)][0]
+                                 for sheet in workbook.iter(f"{_MAIN}sheet")}
+            shared_strings = [path for path, relationship_type in relationships.values()
+                              if relationship_type.endswith(_SHARED_STRINGS_TYPE)]
+            self._shared_strings = self._read_shared_strings(shared_strings[0]) if shared_strings else []
+        except Exception:
+            self._zip.close()
+            raise
+
+    @property
+    def sheetnames(self) -> list[str]:
+        return list(self._sheet_paths)
+
+    def __getitem__(self, name: str) -> 'XlsxSheet':
+        return XlsxSheet(self, name)
+
+    def close(self):
+        self._zip.close()
+
+    def _relationships(self, part: str) -> dict[str, tuple[str, str]]:
+        """The (path in the zip, type) per relationship id of the given part"""
+        directory, name = posixpath.split(part)
+        root = parse(self._zip.open(posixpath.join(directory, "_rels", name + ".rels"))).getroot()
+        relationships = {}
+        for relationship in root.iter(f"{_RELATIONSHIPS}Relationship"):
+            target = relationship.get("Target")
+            if target.startswith("/"):
+                path = target.lstrip("/")
+            else:
+                path = posixpath.normpath(posixpath.join(directory, target))
+            relationships[relationship.get("Id")] = (path, relationship.get("Type"))
+        return relationships
+
+    def _read_shared_strings(self, path: str) -> list[str]:
+        strings = []
+        for _, element in iterparse(self._zip.open(path)):
+            if element.tag == f"{_MAIN}si":
+                # rich text has its text in several runs, phonetic hints are not part of the value
+                phonetic = {text for hint in element.iter(f"{_MAIN}rPh") for text in hint.iter(f"{_MAIN}t")}
+                strings.append("".join(text.text or "" for text in element.iter(f"{_MAIN}t")
+                                       if text not in phonetic))
+                element.clear()
+        return strings
+
+    def _iter_rows(self, name: str, min_row: int) -> Iterator[tuple]:
+        last_number = 0
+        for _, element in iterparse(self._zip.open(self._sheet_paths[name])):
+            if element.tag != f"{_MAIN}row":
+                continue
+            number = int(element.get("r", last_number + 1))
+            # rows without cells are not in the XML, they are read as empty rows
+            for _ in range(max(last_number + 1, min_row), number):
+                yield ()
+            last_number = number
+            if number >= min_row:
+                yield self._row_values(element)
+            element.clear()
+
+    def _row_values(self, row) -> tuple:
+        values = []
+        for cell in row.iter(f"{_MAIN}c"):
+            reference = cell.get("r")
+            column = _column_index(reference) if reference else len(values)
+            values.extend([None] * (column - len(values)))
+            values.append(self._cell_value(cell))
+        return tuple(values)
+
+    def _cell_value(self, cell):
+        # like openpyxl, an empty string is read as no value
+        cell_type = cell.get("t", "n")
+        if cell_type == "inlineStr":
+            return "".join(text.text or "" for text in cell.iter(f"{_MAIN}t")) or None
+        value = cell.findtext(f"{_MAIN}v")
+        if value is None:
+            return None
+        if cell_type == "s":
+            return self._shared_strings[int(value)] or None
+        if cell_type == "b":
+            return value == "1"
+        if cell_type == "n":
+            return float(value) if any(c in value for c in ".eE") else int(value)
+        return value
+
+
+class XlsxSheet:
+    def __init__(self, reader: XlsxReader, title: str):
+        self._reader = reader
+        self.title = title
+
+    def iter_rows(self, min_row: int = 1, values_only: bool = True) -> Iterator[tuple]:
+        """The values per row, a row ends at its last cell with a value or formatting"""
+        assert values_only, "only values can be read"
+        return self._reader._iter_rows(self.title, min_row)
+
+
+def _column_index(reference: str) -> int:
+    """The 0-based column of a cell reference like 'AB12'"""
+    index = 0
+    for c in reference:
+        if not c.isalpha():
+            break
+        index = index * 26 + ord(c.upper()) - ord("A") + 1
+    return index - 1